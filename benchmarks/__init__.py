@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+
+"""Offline benchmarks for the github cloner.
+
+Run with ``python -m benchmarks.run``. See :mod:`benchmarks.run`.
+"""
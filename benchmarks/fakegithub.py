@@ -0,0 +1,168 @@
+"""A local stand-in for the github listing API."""
+
+import hashlib
+import http.server
+import json
+import re
+import socketserver
+import threading
+import typing
+import urllib.parse
+
+_LISTING = re.compile(r'^/(users|orgs)/([^/]+)/(repos|gists|events)$')
+_REPOSITORY = re.compile(r'^/repos/([^/]+)/([^/]+)$')
+
+
+def _graphql_node(entry: dict) -> dict:
+    """The GraphQL repository node of a REST repository listing entry"""
+    parent = entry.get('parent')
+    return {'databaseId': entry.get('id'),
+            'name': entry['name'],
+            'description': entry.get('description'),
+            'sshUrl': entry['ssh_url'],
+            'diskUsage': entry.get('size'),
+            'pushedAt': entry.get('pushed_at'),
+            'updatedAt': entry.get('updated_at'),
+            'isFork': entry.get('fork', False),
+            'isArchived': entry.get('archived', False),
+            'createdAt': entry.get('created_at'),
+            'visibility': (entry.get('visibility') or
+                           ('private' if entry.get('private') else
+                            'public')).upper(),
+            'parent': {'nameWithOwner': parent['full_name']}
+            if parent else None}
+
+
+class FakeGithub(object):
+    """
+    A local HTTP server answering the github listing API.
+
+    It serves /users/{name}/repos, /orgs/{name}/repos,
+    /users/{name}/gists and the events feeds /users/{name}/events and
+    /orgs/{name}/events from the listings it is given, paginated with
+    per_page and page, and with Link headers carrying rel="next" and
+    rel="last" like github's. Responses carry an ETag and honour
+    If-None-Match, and every request is counted.
+
+    It also answers the repositories query of the GraphQL API at /graphql,
+    with cursor pagination, from the same repository listings, and single
+    repositories at /repos/{owner}/{name} from the repositories it is given
+    under those paths.
+
+    Use it as a context manager, or call start and stop.
+    """
+
+    def __init__(self, listings: typing.Dict[str, list] = None):
+        """
+        A fake github API.
+
+        :param listings: the JSON listings to serve, keyed by path, e.g.
+            '/orgs/kb-dk/repos', and the JSON of single repositories, e.g.
+            '/repos/kb-dk/github_cloner'
+        """
+        self.listings = dict(listings or {})
+        self.requests = []
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        """The base url of the fake API"""
+        return 'http://127.0.0.1:{0}'.format(self._server.server_port)
+
+    def start(self) -> 'FakeGithub':
+        fake = self
+
+        class _Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                fake.requests.append(self.path)
+                url = urllib.parse.urlparse(self.path)
+                if _REPOSITORY.match(url.path) and url.path in fake.listings:
+                    self._send(200, fake.listings[url.path])
+                    return
+                if not _LISTING.match(url.path) or \
+                        url.path not in fake.listings:
+                    self._send(404, {'message': 'Not Found'})
+                    return
+                query = urllib.parse.parse_qs(url.query)
+                per_page = int(query.get('per_page', ['30'])[0])
+                page = int(query.get('page', ['1'])[0])
+                listing = fake.listings[url.path]
+                last_page = max((len(listing) + per_page - 1) // per_page, 1)
+                body = listing[(page - 1) * per_page:page * per_page]
+
+                headers = {}
+                if url.path.endswith('/events'):
+                    headers['X-Poll-Interval'] = '60'
+                if page < last_page:
+                    base = '{0}{1}?per_page={2}&page='.format(
+                        fake.url, url.path, per_page)
+                    headers['Link'] = '<{0}{1}>; rel="next", ' \
+                                      '<{0}{2}>; rel="last"'.format(
+                                          base, page + 1, last_page)
+                self._send(200, body, headers)
+
+            def do_POST(self):
+                fake.requests.append(self.path)
+                if self.path != '/graphql':
+                    self._send(404, {'message': 'Not Found'})
+                    return
+                length = int(self.headers.get('Content-Length', 0))
+                variables = json.loads(
+                    self.rfile.read(length).decode('utf-8'))['variables']
+                login = variables['login']
+                listing = fake.listings.get(
+                    '/orgs/{0}/repos'.format(login),
+                    fake.listings.get('/users/{0}/repos'.format(login)))
+                if listing is None:
+                    self._send(200, {'data': {'repositoryOwner': None}})
+                    return
+                start = int(variables.get('cursor') or 0)
+                end = start + variables['first']
+                nodes = [_graphql_node(entry)
+                         for entry in listing[start:end]]
+                self._send(200, {'data': {'repositoryOwner': {
+                    'repositories': {
+                        'pageInfo': {'hasNextPage': end < len(listing),
+                                     'endCursor': str(end)},
+                        'nodes': nodes}}}})
+
+            def _send(self, status: int, body, headers: dict = None):
+                content = json.dumps(body).encode('utf-8')
+                etag = '"{0}"'.format(hashlib.sha1(content).hexdigest())
+                if status == 200 and \
+                        self.headers.get('If-None-Match') == etag:
+                    status, content = 304, b''
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(content)))
+                self.send_header('ETag', etag)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, format, *args):
+                pass
+
+        class _Server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+            daemon_threads = True
+
+        self._server = _Server(('127.0.0.1', 0), _Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self) -> 'FakeGithub':
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,159 @@
+"""Synthetic git remotes for the benchmarks."""
+
+import os
+import subprocess
+import time
+import typing
+import zlib
+
+from statsbiblioteket.github_cloner.myTypes import Path, Url
+
+
+def timestamp(seconds: float = None) -> str:
+    """
+    A time formatted like github's timestamps.
+
+    :param seconds: the time since the epoch, or None for now
+    :return: the formatted time
+    """
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(seconds))
+
+
+def _commit_stream(commits: int, files_per_commit: int, file_size: int,
+                   parent: str = None, start: int = 0) -> bytes:
+    """A git fast-import stream of commits with random file contents"""
+    stream = []
+    for i in range(start, start + commits):
+        message = 'Commit {0}\n'.format(i).encode('utf-8')
+        stream.append(b'commit refs/heads/master\n')
+        stream.append('committer Bench <bench@example.com> {0} +0000\n'
+                      .format(1500000000 + i).encode('utf-8'))
+        stream.append('data {0}\n'.format(len(message)).encode('utf-8'))
+        stream.append(message)
+        if parent is not None and i == start:
+            stream.append('from {0}\n'.format(parent).encode('utf-8'))
+        for j in range(files_per_commit):
+            stream.append('M 644 inline file{0}.bin\n'.format(j)
+                          .encode('utf-8'))
+            stream.append('data {0}\n'.format(file_size).encode('utf-8'))
+            stream.append(os.urandom(file_size))
+            stream.append(b'\n')
+    return b''.join(stream)
+
+
+def _fast_import(path: Path, stream: bytes):
+    command = ['git', '-C', path, 'fast-import', '--quiet']
+    process = subprocess.Popen(command, stdin=subprocess.PIPE)
+    process.communicate(stream)
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, command)
+
+
+def add_commits(path: Path, commits: int = 1, files_per_commit: int = 1,
+                file_size: int = 1024):
+    """
+    Push new commits to a synthetic remote, as if someone had pushed to it.
+
+    :param path: the path of the bare repository
+    :param commits: the number of commits to add
+    :param files_per_commit: the number of files changed by each commit
+    :param file_size: the size of each file in bytes
+    """
+    count = int(subprocess.check_output(
+        ['git', '-C', path, 'rev-list', '--count', 'master']))
+    stream = _commit_stream(commits, files_per_commit, file_size,
+                            parent='refs/heads/master^0', start=count)
+    _fast_import(path, stream)
+
+
+def create_remote(path: Path, commits: int = 10, files_per_commit: int = 1,
+                  file_size: int = 1024) -> Url:
+    """
+    Create a bare repository with a synthetic history.
+
+    Every commit rewrites files_per_commit files with file_size random bytes,
+    so the repository does not compress, and its size is roughly
+    commits * files_per_commit * file_size.
+
+    :param path: the path of the bare repository to create
+    :param commits: the number of commits
+    :param files_per_commit: the number of files changed by each commit
+    :param file_size: the size of each file in bytes
+    :return: the file:// url of the repository
+    """
+    subprocess.check_call(['git', 'init', '-q', '--bare', path])
+    subprocess.check_call(['git', '-C', path, 'symbolic-ref', 'HEAD',
+                           'refs/heads/master'])
+    stream = _commit_stream(commits, files_per_commit, file_size)
+    _fast_import(path, stream)
+    return 'file://' + os.path.abspath(path)
+
+
+def repository_entry(name: str, url: Url, size: int,
+                     fork: bool = False, archived: bool = False) -> dict:
+    """
+    The github listing JSON for a repository.
+
+    :param name: the name of the repository
+    :param url: the url to clone from, served as the ssh_url
+    :param size: the size in KB
+    :param fork: whether the repository is a fork
+    :param archived: whether the repository is archived
+    :return: the repository as github would list it
+    """
+    now = timestamp()
+    return {'id': zlib.crc32(name.encode('utf-8')),
+            'name': name,
+            'full_name': 'bench/' + name,
+            'description': 'Synthetic repository ' + name,
+            'ssh_url': url,
+            'clone_url': url,
+            'size': size,
+            'created_at': now,
+            'pushed_at': now,
+            'updated_at': now,
+            'fork': fork,
+            'archived': archived,
+            'private': False}
+
+
+def gist_entry(gist_id: str, url: Url) -> dict:
+    """
+    The github listing JSON for a gist.
+
+    :param gist_id: the id of the gist
+    :param url: the url to clone from, served as the git_pull_url
+    :return: the gist as github would list it
+    """
+    now = timestamp()
+    return {'id': gist_id,
+            'description': 'Synthetic gist ' + gist_id,
+            'git_pull_url': url,
+            'created_at': now,
+            'updated_at': now,
+            'public': True}
+
+
+def create_remotes(directory: Path, count: int, commits: int = 10,
+                   files_per_commit: int = 1,
+                   file_size: int = 1024) -> typing.List[dict]:
+    """
+    Create count synthetic remotes in directory.
+
+    :param directory: the directory to create the bare repositories in
+    :param count: the number of repositories
+    :param commits: the number of commits in each repository
+    :param files_per_commit: the number of files changed by each commit
+    :param file_size: the size of each file in bytes
+    :return: the github listing JSON for the repositories
+    """
+    entries = []
+    for i in range(count):
+        name = 'repo{0:05d}'.format(i)
+        url = create_remote(os.path.join(directory, name + '.git'),
+                            commits=commits,
+                            files_per_commit=files_per_commit,
+                            file_size=file_size)
+        size = commits * files_per_commit * file_size // 1024
+        entries.append(repository_entry(name, url, size))
+    return entries
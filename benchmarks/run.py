@@ -0,0 +1,172 @@
+"""Time github_backup end-to-end against a fake github API and synthetic
+remotes, and write the results as JSON.
+
+The scenarios are
+
+cold
+    every repository is cloned into an empty directory
+warm
+    every repository is fetched again, with no changes on the remotes
+warm-manifest
+    the manifest of the previous runs lets every repository be skipped
+push
+    one commit is pushed to every remote, and the changes are fetched
+
+Run with e.g. ::
+
+    python -m benchmarks.run --repositories 100 --jobs 8 \\
+        --output benchmark.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import typing
+
+from statsbiblioteket.github_cloner import RepoType, UserType
+from statsbiblioteket.github_cloner.github_cloner import github_backup
+from statsbiblioteket.github_cloner.manifest import Manifest
+from statsbiblioteket.github_cloner.session import GithubSession
+
+from benchmarks.fakegithub import FakeGithub
+from benchmarks.remotes import add_commits, create_remotes, timestamp
+
+ACCOUNT = 'bench'
+
+
+def run_scenario(scenario: str, api_url: str, jobs: int,
+                 manifest: Manifest = None, force: bool = False) -> dict:
+    """
+    Time one github_backup of the benchmark account into the current working
+    dir.
+
+    :param scenario: the name of the scenario
+    :param api_url: the url of the fake github API
+    :param jobs: the number of concurrent backups
+    :param manifest: the manifest of previous backups, if any
+    :param force: fetch every repository, even the unchanged ones
+    :return: the timing of the scenario
+    """
+    session = GithubSession(pool_size=jobs)
+    started = time.monotonic()
+    results = github_backup(ACCOUNT, user_type=UserType.ORG,
+                            repo_type=RepoType.REPO, max_workers=jobs,
+                            session=session, manifest=manifest, force=force,
+                            api_url=api_url)
+    seconds = time.monotonic() - started
+    session.close()
+    return {'scenario': scenario,
+            'seconds': seconds,
+            'repositories': len(results),
+            'skipped': sum(1 for result in results if result.skipped),
+            'failed': sum(1 for result in results if not result.ok),
+            'repositories_per_second': len(results) / seconds}
+
+
+def run(repositories: int, commits: int, files_per_commit: int,
+        file_size: int, jobs: int,
+        workdir: str = None) -> typing.Dict[str, typing.Any]:
+    """
+    Run all the benchmark scenarios.
+
+    :param repositories: the number of synthetic repositories
+    :param commits: the number of commits in each repository
+    :param files_per_commit: the number of files changed by each commit
+    :param file_size: the size of each file in bytes
+    :param jobs: the number of concurrent backups
+    :param workdir: the directory to work in, a new temporary directory if
+        None
+    :return: the benchmark results
+    """
+    workdir = workdir or tempfile.mkdtemp(prefix='github_cloner_bench')
+    remotes = os.path.join(workdir, 'remotes')
+    backup = os.path.join(workdir, 'backup')
+    os.makedirs(remotes)
+    os.makedirs(backup)
+
+    entries = create_remotes(remotes, repositories, commits=commits,
+                             files_per_commit=files_per_commit,
+                             file_size=file_size)
+    listings = {'/orgs/{0}/repos'.format(ACCOUNT): entries}
+    manifest_path = os.path.join(workdir, 'manifest.json')
+
+    scenarios = []
+    cwd = os.getcwd()
+    os.chdir(backup)
+    try:
+        with FakeGithub(listings) as fake:
+            scenarios.append(run_scenario('cold', fake.url, jobs,
+                                          Manifest(manifest_path)))
+            scenarios.append(run_scenario('warm', fake.url, jobs,
+                                          Manifest(manifest_path),
+                                          force=True))
+            scenarios.append(run_scenario('warm-manifest', fake.url, jobs,
+                                          Manifest(manifest_path)))
+            for entry in entries:
+                add_commits(entry['ssh_url'][len('file://'):],
+                            files_per_commit=files_per_commit,
+                            file_size=file_size)
+                # github timestamps have a resolution of one second, so
+                # make sure the push is seen as later than the clone
+                entry['pushed_at'] = entry['updated_at'] = \
+                    timestamp(time.time() + 1)
+            scenarios.append(run_scenario('push', fake.url, jobs,
+                                          Manifest(manifest_path)))
+            api_requests = len(fake.requests)
+    finally:
+        os.chdir(cwd)
+
+    return {'timestamp': timestamp(),
+            'python': platform.python_version(),
+            'git': subprocess.check_output(['git', '--version'])
+                             .decode('utf-8').strip(),
+            'parameters': {'repositories': repositories,
+                           'commits': commits,
+                           'files_per_commit': files_per_commit,
+                           'file_size': file_size,
+                           'jobs': jobs},
+            'api_requests': api_requests,
+            'scenarios': scenarios}
+
+
+def create_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description='Benchmark the github cloner offline')
+    parser.add_argument('--repositories', default=50, type=int,
+                        help='the number of synthetic repositories')
+    parser.add_argument('--commits', default=20, type=int,
+                        help='the number of commits in each repository')
+    parser.add_argument('--files-per-commit', default=1, type=int,
+                        help='the number of files changed by each commit',
+                        dest='files_per_commit')
+    parser.add_argument('--file-size', default=4096, type=int,
+                        help='the size of each file in bytes',
+                        dest='file_size')
+    parser.add_argument('--jobs', default=4, type=int,
+                        help='the number of concurrent backups')
+    parser.add_argument('--workdir',
+                        help='the directory to work in, a temporary '
+                             'directory by default')
+    parser.add_argument('--output', default='benchmark.json',
+                        help='the file to write the JSON results to')
+    return parser
+
+
+def main():
+    args = create_parser().parse_args(sys.argv[1:])
+    results = run(args.repositories, args.commits, args.files_per_commit,
+                  args.file_size, args.jobs, workdir=args.workdir)
+    with open(args.output, 'w', encoding='utf-8') as output:
+        json.dump(results, output, indent=2)
+    for scenario in results['scenarios']:
+        print('{scenario:15} {seconds:8.2f}s {repositories_per_second:8.1f} '
+              'repositories/s'.format(**scenario))
+
+
+if __name__ == '__main__':
+    main()
@@ -7,8 +7,12 @@ import logging
 from statsbiblioteket.github_cloner.github_cloner \
     import \
     github_backup, \
+    backup_accounts, \
+    backup_jobs, \
     fetch_or_clone, \
+    remove_partial_clones, \
     get_github_repositories, \
+    iter_github_repositories, \
     parse_github_repositories, \
     create_parser  # This import is important for the sphinx-argparse docs
 
@@ -16,6 +20,7 @@ from statsbiblioteket.github_cloner.github_cloner \
 from statsbiblioteket.github_cloner.github_cloner import \
     RepoType, \
     UserType, \
+    BackupResult, \
     Repository, \
     Url, \
     Path
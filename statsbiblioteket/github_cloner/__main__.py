@@ -4,6 +4,8 @@
 """github_cloner.__main__: executed when github_cloner directory is called as
 script."""
 
+import sys
+
 from statsbiblioteket.github_cloner.github_cloner import main
 
-main()
+sys.exit(main())
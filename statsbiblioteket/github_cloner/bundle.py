@@ -0,0 +1,362 @@
+"""Incremental export of the mirrors as git bundles, so a backup can be
+shipped offsite as a few large files instead of millions of small ones."""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import subprocess
+import tempfile
+import time
+import typing
+
+from statsbiblioteket.github_cloner.messages import M
+from statsbiblioteket.github_cloner.myTypes import Path
+
+# The snapshots of a mirror are numbered, 00000001.json, 00000002.json, ...
+_INDEX_PATTERN = re.compile(r'^(\d{8})\.json$')
+
+# The coarsest resolution of file modification times to allow for, in
+# seconds
+_MTIME_RESOLUTION = 2.0
+
+
+def list_refs(repository_path: Path) -> typing.Dict[str, str]:
+    """
+    The refs of a repository.
+
+    :param repository_path: the path of the repository
+    :return: a dict from ref name to object id
+    :raises subprocess.CalledProcessError: If git for-each-ref failed
+    """
+    output = subprocess.check_output(
+        ['git', '-C', repository_path, 'for-each-ref',
+         '--format=%(objectname) %(refname)'],
+        stderr=subprocess.STDOUT)
+    refs = {}
+    for line in output.decode('utf-8').splitlines():
+        object_id, _, name = line.partition(' ')
+        refs[name] = object_id
+    return refs
+
+
+def _head(repository_path: Path) -> typing.Optional[str]:
+    """The ref HEAD of a repository points to, or None if it is detached"""
+    try:
+        output = subprocess.check_output(
+            ['git', '-C', repository_path, 'symbolic-ref', '-q', 'HEAD'],
+            stderr=subprocess.DEVNULL)
+    except subprocess.CalledProcessError:
+        return None
+    return output.decode('utf-8').strip()
+
+
+def _communicate(command: typing.List[str], lines: typing.List[str]) -> bytes:
+    """
+    Run a git command with lines on its standard input.
+
+    :return: the output of the command, with standard error merged in
+    :raises subprocess.CalledProcessError: If the command failed
+    """
+    process = subprocess.Popen(command, stdin=subprocess.PIPE,
+                               stdout=subprocess.PIPE,
+                               stderr=subprocess.STDOUT)
+    output, _ = process.communicate(
+        '\n'.join(lines).encode('utf-8') + b'\n')
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, command,
+                                            output)
+    return output
+
+
+def _existing_objects(repository_path: Path,
+                      object_ids: typing.Iterable[str]) -> typing.List[str]:
+    """The objects of object_ids the repository has"""
+    object_ids = sorted(set(object_ids))
+    if not object_ids:
+        return []
+    output = _communicate(
+        ['git', '-C', repository_path, 'cat-file', '--batch-check'],
+        object_ids)
+    return [line.split()[0] for line in output.decode('utf-8').splitlines()
+            if not line.endswith(' missing')]
+
+
+def _sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as bundle_file:
+        for block in iter(lambda: bundle_file.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _write_json(path: Path, content: dict):
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path),
+                                     suffix='.tmp')
+    with os.fdopen(fd, 'w', encoding='utf-8') as index_file:
+        json.dump(content, index_file, indent=1, sort_keys=True)
+    os.replace(temp_path, path)
+
+
+def snapshots(directory: Path) -> typing.List[dict]:
+    """
+    The snapshots exported from a mirror, oldest first.
+
+    :param directory: the export directory of the mirror
+    :return: the indexes of the snapshots
+    """
+    if not os.path.isdir(directory):
+        return []
+    indexes = []
+    for name in sorted(os.listdir(directory)):
+        if _INDEX_PATTERN.match(name):
+            with open(os.path.join(directory, name),
+                      encoding='utf-8') as index_file:
+                indexes.append(json.load(index_file))
+    return indexes
+
+
+def latest_snapshot(directory: Path) -> typing.Optional[dict]:
+    """
+    The last snapshot exported from a mirror, without reading the indexes of
+    the earlier ones.
+
+    :param directory: the export directory of the mirror
+    :return: the index of the snapshot, or None if there is none
+    """
+    if not os.path.isdir(directory):
+        return None
+    names = [name for name in os.listdir(directory)
+             if _INDEX_PATTERN.match(name)]
+    if not names:
+        return None
+    with open(os.path.join(directory, max(names)),
+              encoding='utf-8') as index_file:
+        return json.load(index_file)
+
+
+def _refs_modified(repository_path: Path) -> float:
+    """
+    The last time the refs of a repository or its HEAD changed, from the
+    modification times of the ref files and the directories holding them.
+    """
+    paths = [os.path.join(repository_path, name)
+             for name in ('HEAD', 'packed-refs')]
+    for directory, _, files in os.walk(os.path.join(repository_path,
+                                                    'refs')):
+        paths.append(directory)
+        paths.extend(os.path.join(directory, name) for name in files)
+    modified = 0.0
+    for path in paths:
+        try:
+            modified = max(modified, os.stat(path).st_mtime)
+        except OSError:
+            # A ref was deleted or packed while walking
+            modified = time.time()
+    return modified
+
+
+class BundleExporter(object):
+    """
+    Export of the mirrors as chains of incremental git bundles.
+
+    Every export of a mirror whose refs changed since its last export is a
+    snapshot in the export directory of the mirror, directory/<mirror>/,
+    where <mirror> is the name of the mirror or the name it is exported
+    under.
+    A snapshot is a bundle, 00000002.bundle, with the objects reachable from
+    the changed refs but not from the refs of the previous snapshot, and an
+    index, 00000002.json, describing it::
+
+        {"sequence": 2, "created": 1700000000.0,
+         "bundle": "00000002.bundle", "size": 1234, "sha256": "...",
+         "refs": {"refs/heads/main": "<object id>", ...},
+         "head": "refs/heads/main",
+         "changed": ["refs/heads/main"], "deleted": [],
+         "prerequisites": ["<object id>", ...]}
+
+    refs are all the refs of the mirror at the snapshot, so a restore can
+    set them exactly, including deletions, and head is the ref HEAD points
+    to. bundle is null when the changed refs point to objects an earlier
+    snapshot already has. The bundle is written before its index, so a
+    snapshot without an index is not there.
+    """
+
+    def __init__(self, directory: Path):
+        """
+        Export of the mirrors.
+
+        :param directory: the directory to export to
+        """
+        self.directory = directory
+
+    def _directory(self, repository_path: Path, name: Path = None) -> Path:
+        if name is None:
+            name = os.path.basename(os.path.normpath(repository_path))
+        return os.path.join(self.directory, name)
+
+    def is_current(self, repository_path: Path, name: Path = None) -> bool:
+        """
+        Whether the last snapshot of a mirror was exported after its refs
+        last changed, judged without running git, so mirrors that were not
+        fetched can be left out cheaply.
+
+        :param repository_path: the path of the mirror
+        :param name: the name the mirror is exported under, or None for the
+            name of the mirror
+        :return: True if the mirror has a snapshot newer than its refs
+        """
+        latest = latest_snapshot(self._directory(repository_path, name))
+        return latest is not None and _refs_modified(repository_path) < \
+            latest['created'] - _MTIME_RESOLUTION
+
+    def migrate(self, repository_path: Path, name: Path,
+                old_name: Path) -> bool:
+        """
+        Move the snapshots of a mirror exported under an earlier name to its
+        name, by renaming, so its chain continues instead of starting over.
+
+        The snapshots are only moved if the mirror has the objects of their
+        refs, so the chain of another mirror of the same name is left alone.
+
+        :param repository_path: the path of the mirror
+        :param name: the name the mirror is exported under now
+        :param old_name: the name it was exported under before
+        :return: True if the snapshots were moved
+        :raises OSError: If the snapshots could not be moved
+        """
+        directory = os.path.join(self.directory, name)
+        old_directory = os.path.join(self.directory, old_name)
+        if os.path.exists(directory) or not os.path.isdir(old_directory):
+            return False
+        previous = latest_snapshot(old_directory)
+        if previous is None:
+            return False
+        object_ids = set(previous['refs'].values())
+        if len(_existing_objects(repository_path, object_ids)) != \
+                len(object_ids):
+            logging.debug(M('The snapshots in {0} are not of {1}, leaving '
+                            'them', old_directory, repository_path))
+            return False
+        logging.info(M('Moving the snapshots of {0} from {1} to {2}',
+                       repository_path, old_directory, directory))
+        os.makedirs(os.path.dirname(directory), exist_ok=True)
+        os.rename(old_directory, directory)
+        return True
+
+    def export(self, repository_path: Path,
+               name: Path = None) -> typing.Optional[dict]:
+        """
+        Export the changes of a mirror since its last snapshot.
+
+        :param repository_path: the path of the mirror
+        :param name: the relative path to export the mirror under, e.g.
+            'kb-dk/repos/github_cloner.git', or None for the name of the
+            mirror
+        :return: the index of the new snapshot, or None if no ref changed
+        :raises subprocess.CalledProcessError: If any of the git processes
+            failed
+        """
+        directory = self._directory(repository_path, name)
+        previous = latest_snapshot(directory)
+        previous_refs = previous['refs'] if previous else {}
+        refs = list_refs(repository_path)
+        head = _head(repository_path)
+        if refs == previous_refs and \
+                head == (previous.get('head') if previous else head):
+            logging.debug(M('{0} has not changed since its last export',
+                            repository_path))
+            return None
+
+        sequence = previous['sequence'] + 1 if previous else 1
+        changed = sorted(name for name, object_id in refs.items()
+                         if previous_refs.get(name) != object_id)
+        # Objects the mirror no longer has cannot be prerequisites
+        prerequisites = _existing_objects(repository_path,
+                                          previous_refs.values())
+        index = {'sequence': sequence,
+                 'created': time.time(),
+                 'bundle': None,
+                 'size': 0,
+                 'sha256': None,
+                 'refs': refs,
+                 'head': head,
+                 'changed': changed,
+                 'deleted': sorted(set(previous_refs) - set(refs)),
+                 'prerequisites': prerequisites}
+
+        os.makedirs(directory, exist_ok=True)
+        if changed:
+            bundle_name = '{0:08d}.bundle'.format(sequence)
+            bundle_path = os.path.join(directory, bundle_name)
+            if self._create_bundle(repository_path, bundle_path, changed,
+                                   prerequisites):
+                index.update(bundle=bundle_name,
+                             size=os.path.getsize(bundle_path),
+                             sha256=_sha256(bundle_path))
+        _write_json(os.path.join(directory,
+                                 '{0:08d}.json'.format(sequence)), index)
+        logging.info(M('Exported snapshot {0} of {1}: {2} changed and {3} '
+                       'deleted refs, {4} bytes', sequence, repository_path,
+                       len(changed), len(index['deleted']), index['size']))
+        return index
+
+    def _create_bundle(self, repository_path: Path, bundle_path: Path,
+                       changed: typing.List[str],
+                       prerequisites: typing.List[str]) -> bool:
+        temp_path = bundle_path + '.tmp'
+        revisions = changed + ['^' + object_id
+                               for object_id in prerequisites]
+        try:
+            _communicate(['git', '-C', repository_path, 'bundle', 'create',
+                          '-q', os.path.abspath(temp_path), '--stdin'],
+                         revisions)
+        except subprocess.CalledProcessError as error:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            if b'empty bundle' in (error.output or b''):
+                return False
+            raise
+        os.replace(temp_path, bundle_path)
+        return True
+
+
+def restore(directory: Path, repository_path: Path) -> int:
+    """
+    Restore a mirror by replaying the snapshots exported from it.
+
+    :param directory: the export directory of the mirror
+    :param repository_path: the path of the mirror to create
+    :return: the sequence number of the last snapshot replayed
+    :raises subprocess.CalledProcessError: If any of the git processes
+        failed
+    :raises ValueError: If a bundle does not match its index
+    """
+    subprocess.check_output(['git', 'init', '-q', '--bare',
+                             repository_path], stderr=subprocess.STDOUT)
+    sequence = 0
+    for index in snapshots(directory):
+        if index['bundle'] is not None:
+            bundle_path = os.path.join(directory, index['bundle'])
+            if _sha256(bundle_path) != index['sha256']:
+                raise ValueError('{0} does not match its index'.format(
+                    bundle_path))
+            subprocess.check_output(
+                ['git', '-C', repository_path, 'bundle', 'unbundle',
+                 os.path.abspath(bundle_path)], stderr=subprocess.STDOUT)
+        current = list_refs(repository_path)
+        commands = ['delete {0}'.format(name) for name in current
+                    if name not in index['refs']]
+        commands += ['update {0} {1}'.format(name, object_id)
+                     for name, object_id in sorted(index['refs'].items())]
+        _communicate(['git', '-C', repository_path, 'update-ref', '--stdin'],
+                     commands)
+        if index.get('head'):
+            subprocess.check_output(['git', '-C', repository_path,
+                                     'symbolic-ref', 'HEAD', index['head']],
+                                    stderr=subprocess.STDOUT)
+        sequence = index['sequence']
+    logging.info(M('Restored {0} from {1} snapshots in {2}',
+                   repository_path, sequence, directory))
+    return sequence
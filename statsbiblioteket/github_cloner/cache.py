@@ -0,0 +1,146 @@
+"""An on-disk cache of github API responses, using conditional requests."""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+import typing
+
+import requests
+
+from statsbiblioteket.github_cloner.messages import M
+from statsbiblioteket.github_cloner.myTypes import Path, Url
+
+# Only the headers we need to replay a listing page are kept
+_CACHED_HEADERS = ('ETag', 'Last-Modified', 'Link', 'Content-Type')
+
+
+class HttpCache(object):
+    """
+    A cache of github API responses, keyed by url and query parameters.
+
+    Each response is stored with its ETag and Last-Modified headers. When the
+    same page is requested again, the request is made conditional with
+    If-None-Match/If-Modified-Since, and if github answers 304 Not Modified,
+    the cached body is replayed. Conditional requests answered with 304 do not
+    count against the github rate limit.
+
+    Entries older than max_age seconds are evicted, and the least recently
+    used entries are evicted when the cache grows beyond max_size bytes.
+    """
+
+    def __init__(self, directory: Path,
+                 max_age: float = 7 * 24 * 60 * 60,
+                 max_size: int = 100 * 1024 * 1024):
+        """
+        An on-disk cache of github API responses.
+
+        :param directory: the directory to store the cached responses in
+        :param max_age: the maximum age of a cached response, in seconds
+        :param max_size: the maximum total size of the cache, in bytes
+        """
+        self.directory = directory
+        self.max_age = max_age
+        self.max_size = max_size
+        os.makedirs(directory, exist_ok=True)
+        self.evict()
+
+    def _entry_path(self, url: Url, params: dict) -> Path:
+        key = json.dumps([url, sorted((params or {}).items())])
+        digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, digest + '.json')
+
+    def _load(self, path: Path) -> typing.Optional[dict]:
+        try:
+            with open(path, encoding='utf-8') as entry_file:
+                return json.load(entry_file)
+        except (OSError, ValueError):
+            return None
+
+    def _store(self, path: Path, response: requests.Response):
+        entry = {'url': response.url,
+                 'headers': {name: response.headers[name]
+                             for name in _CACHED_HEADERS
+                             if name in response.headers},
+                 'body': response.text}
+        # Write to a temporary file and rename, so concurrent readers never
+        # see a partially written entry
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as entry_file:
+            json.dump(entry, entry_file)
+        os.replace(temp_path, path)
+
+    @staticmethod
+    def _replay(entry: dict, url: Url) -> requests.Response:
+        response = requests.Response()
+        response.status_code = 200
+        response.url = entry.get('url', url)
+        response.headers.update(entry['headers'])
+        response.encoding = 'utf-8'
+        response._content = entry['body'].encode('utf-8')
+        return response
+
+    def get(self, url: Url, params: dict = None,
+            get: typing.Callable = requests.get,
+            **kwargs) -> requests.Response:
+        """
+        Perform a GET request, conditional on the cached response if there is
+        one.
+
+        :param url: the url to get
+        :param params: the query parameters
+        :param get: the function performing the actual request
+        :param kwargs: further arguments for get
+        :return: the response from github, or the cached response if github
+            answered 304 Not Modified
+        """
+        path = self._entry_path(url, params)
+        entry = self._load(path)
+        headers = dict(kwargs.pop('headers', None) or {})
+        if entry is not None:
+            if 'ETag' in entry['headers']:
+                headers['If-None-Match'] = entry['headers']['ETag']
+            if 'Last-Modified' in entry['headers']:
+                headers['If-Modified-Since'] = \
+                    entry['headers']['Last-Modified']
+
+        response = get(url, params=params, headers=headers, **kwargs)
+
+        if response.status_code == 304 and entry is not None:
+            logging.debug(M('Not modified, using cached {0}', url))
+            os.utime(path)
+            return self._replay(entry, url)
+        if response.status_code == 200 and (
+                'ETag' in response.headers or
+                'Last-Modified' in response.headers):
+            self._store(path, response)
+        return response
+
+    def evict(self):
+        """
+        Remove the entries older than max_age, and then the least recently
+        used entries until the cache is no larger than max_size.
+        """
+        now = time.time()
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if now - stat.st_mtime > self.max_age:
+                logging.debug(M('Evicting expired {0}', path))
+                os.remove(path)
+            else:
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        size = sum(entry[1] for entry in entries)
+        for mtime, entry_size, path in sorted(entries):
+            if size <= self.max_size:
+                break
+            logging.debug(M('Evicting {0} to reduce the cache size', path))
+            os.remove(path)
+            size -= entry_size
@@ -0,0 +1,234 @@
+"""Adaptive concurrency of the clones and fetches, so the backup uses the
+bandwidth a fast link offers and backs off when github or the disk
+struggles."""
+
+import logging
+import os
+import threading
+import time
+import typing
+
+from statsbiblioteket.github_cloner.messages import M
+from statsbiblioteket.github_cloner.myTypes import Path
+
+
+def _median(values: typing.Sequence[float]) -> float:
+    """The median of values, as statistics.median, which Python 3.3 lacks"""
+    ordered = sorted(values)
+    middle = len(ordered) // 2
+    if len(ordered) % 2:
+        return ordered[middle]
+    return (ordered[middle - 1] + ordered[middle]) / 2
+
+
+class DiskUtilisation(object):
+    """
+    The utilisation of the block device holding a directory, from the time
+    the device spent doing I/O, as in the %util column of iostat.
+
+    Network filesystems such as NFS have no block device, in which case no
+    utilisation is known.
+    """
+
+    def __init__(self, path: Path = '.', clock: typing.Callable = None):
+        """
+        The utilisation of the block device holding a directory.
+
+        :param path: the directory
+        :param clock: the monotonic clock, in seconds
+        """
+        device = os.stat(path).st_dev
+        self.stat_file = '/sys/dev/block/{0}:{1}/stat'.format(
+            os.major(device), os.minor(device))
+        self.clock = clock or time.monotonic
+        self._last = self._read()
+
+    def _read(self) -> typing.Optional[typing.Tuple[float, int]]:
+        try:
+            with open(self.stat_file) as stat_file:
+                fields = stat_file.read().split()
+        except OSError:
+            return None
+        # The tenth field is the milliseconds spent doing I/O
+        return self.clock(), int(fields[9])
+
+    def sample(self) -> typing.Optional[float]:
+        """
+        :return: the fraction of the time since the previous sample the
+            device was busy, or None if it is not known
+        """
+        current = self._read()
+        last, self._last = self._last, current
+        if current is None or last is None or current[0] <= last[0]:
+            return None
+        return min((current[1] - last[1]) / 1000 / (current[0] - last[0]),
+                   1.0)
+
+
+class ConcurrencyController(object):
+    """
+    An AIMD (additive increase, multiplicative decrease) controller of the
+    number of concurrent clones and fetches, like TCP congestion control.
+
+    The operations are observed in rounds of as many operations as the
+    current limit. After a round
+
+    - the limit is raised by one if the throughput improved over the
+      previous round,
+    - the limit is halved if the latency of the round spiked, or the disk
+      was busier than max_disk_busy,
+    - and otherwise the limit is kept.
+
+    As repositories differ wildly in size, the latency of an operation is
+    compared with the duration of the previous backup of its repository
+    when that is known, and the round spiked if the median operation took
+    more than latency_factor times as long as before. The operations with
+    no previous duration are compared with the usual latency, a moving
+    average of the median latencies of all rounds, spikes included, so the
+    usual latency follows a lasting change in the mix of repositories.
+
+    A failed operation halves the limit at once. Failures of operations
+    started before the last decrease do not decrease it again, so a burst of
+    failures backs off only once.
+
+    The limit stays within min_workers and max_workers, and every change is
+    logged with the reason for it.
+    """
+
+    def __init__(self, min_workers: int = 1, max_workers: int = 16,
+                 initial: int = None, latency_factor: float = 3.0,
+                 max_disk_busy: float = 0.9, improvement: float = 0.05,
+                 disk: DiskUtilisation = None,
+                 clock: typing.Callable = None):
+        """
+        An adaptive concurrency limit.
+
+        :param min_workers: the lowest concurrency
+        :param max_workers: the highest concurrency
+        :param initial: the concurrency to start with, min_workers if None
+        :param latency_factor: how many times slower than usual the median
+            operation of a round must be to count as a spike
+        :param max_disk_busy: the fraction of time the disk may be busy
+            before backing off
+        :param improvement: the relative increase in throughput that counts
+            as an improvement
+        :param disk: the utilisation of the disk the mirrors are on, or None
+            to ignore the disk
+        :param clock: the monotonic clock, in seconds
+        """
+        if not 1 <= min_workers <= max_workers:
+            raise ValueError('Need 1 <= min_workers <= max_workers, got {0} '
+                             'and {1}'.format(min_workers, max_workers))
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.latency_factor = latency_factor
+        self.max_disk_busy = max_disk_busy
+        self.improvement = improvement
+        self.disk = disk
+        self.clock = clock or time.monotonic
+        self.limit = min(max(initial or min_workers, min_workers),
+                         max_workers)
+        self.usual_latency = None
+        self._previous_throughput = None
+        self._last_decrease = None
+        self._lock = threading.Lock()
+        self._start_round()
+
+    def _start_round(self):
+        self._round_started = self.clock()
+        self._latencies = []
+        self._slowdowns = []
+        self._bytes = 0
+
+    def _set_limit(self, limit: int, reason: str):
+        limit = min(max(limit, self.min_workers), self.max_workers)
+        if limit < self.limit:
+            self._last_decrease = self.clock()
+            # The throughput of the new limit is not comparable
+            self._previous_throughput = None
+        if limit != self.limit:
+            logging.info(M('Concurrency {0} -> {1}: {2}', self.limit, limit,
+                           reason))
+        else:
+            logging.debug(M('Concurrency stays at {0}: {1}', limit, reason))
+        self.limit = limit
+        self._start_round()
+
+    def record(self, seconds: float, bytes_received: int = 0,
+               ok: bool = True, expected: float = None):
+        """
+        Record a finished clone or fetch, adjusting the limit.
+
+        :param seconds: how long the operation took
+        :param bytes_received: what the operation received
+        :param ok: False if the operation failed
+        :param expected: how long the previous backup of the repository
+            took, or None if it is not known
+        """
+        with self._lock:
+            now = self.clock()
+            if not ok:
+                started = now - seconds
+                if self._last_decrease is None or \
+                        started >= self._last_decrease:
+                    self._set_limit(self.limit // 2, 'an operation failed')
+                return
+            if expected:
+                self._slowdowns.append(seconds / expected)
+            else:
+                self._latencies.append(seconds)
+            self._bytes += bytes_received
+            if len(self._latencies) + len(self._slowdowns) >= self.limit:
+                self._end_round(now)
+
+    def _spike(self) -> typing.Optional[str]:
+        """The latency spike of the round, or None"""
+        if len(self._slowdowns) >= len(self._latencies):
+            slowdown = _median(self._slowdowns)
+            if slowdown > self.latency_factor:
+                return 'operations took {0:.1f} times as long as ' \
+                       'before'.format(slowdown)
+            return None
+        latency = _median(self._latencies)
+        usual = self.usual_latency
+        if usual is None:
+            self.usual_latency = latency
+        else:
+            # Spikes count too, so a lasting change becomes the usual
+            self.usual_latency = 0.8 * usual + 0.2 * latency
+        if usual is not None and latency > self.latency_factor * usual:
+            return 'latency spiked to {0:.1f}s, usually {1:.1f}s'.format(
+                latency, usual)
+        return None
+
+    def _end_round(self, now: float):
+        operations = len(self._latencies) + len(self._slowdowns)
+        elapsed = max(now - self._round_started, 1e-6)
+        # Fetches of unchanged mirrors receive nothing, so fall back to the
+        # rate of operations
+        throughput = (self._bytes / elapsed, operations / elapsed)
+        disk_busy = self.disk.sample() if self.disk is not None else None
+
+        spike = self._spike()
+        if spike is not None:
+            self._set_limit(self.limit // 2, spike)
+            return
+        if disk_busy is not None and disk_busy > self.max_disk_busy:
+            self._set_limit(self.limit // 2,
+                            'the disk is {0:.0%} busy'.format(disk_busy))
+            return
+
+        previous, self._previous_throughput = \
+            self._previous_throughput, throughput
+        if previous is None or self._improved(previous, throughput):
+            self._set_limit(self.limit + 1,
+                            'throughput is {0:.0f} bytes/s, {1:.2f} '
+                            'operations/s'.format(*throughput))
+        else:
+            self._set_limit(self.limit,
+                            'throughput did not improve')
+
+    def _improved(self, previous: typing.Tuple[float, float],
+                  current: typing.Tuple[float, float]) -> bool:
+        index = 0 if previous[0] or current[0] else 1
+        return current[index] > previous[index] * (1 + self.improvement)
@@ -0,0 +1,164 @@
+"""Classification of the failures of git, bounded retries of the transient
+ones, and the summary of what failed in a run."""
+
+import logging
+import subprocess
+import time
+import typing
+
+from statsbiblioteket.github_cloner.gitprocess import GitStalled
+from statsbiblioteket.github_cloner.messages import M
+from statsbiblioteket.github_cloner.myTypes import BackupResult
+
+# The failure classes
+TRANSIENT = 'transient'
+PERMANENT = 'permanent'
+TIMEOUT = 'timeout'
+UNKNOWN = 'unknown'
+
+# What git says when the network or github had a hiccup
+_TRANSIENT_MESSAGES = (
+    'could not resolve host',
+    'temporary failure in name resolution',
+    'connection timed out',
+    'connection reset',
+    'connection refused',
+    'operation timed out',
+    'the remote end hung up unexpectedly',
+    'early eof',
+    'rpc failed',
+    'gnutls_handshake',
+    'ssl_error',
+    'the requested url returned error: 429',
+    'the requested url returned error: 5',
+    'unexpected disconnect',
+)
+
+# What git says when retrying cannot help, as with bad credentials or a
+# repository that is gone
+_PERMANENT_MESSAGES = (
+    'authentication failed',
+    'permission denied',
+    'could not read username',
+    'repository not found',
+    'does not appear to be a git repository',
+    'the requested url returned error: 401',
+    'the requested url returned error: 403',
+    'the requested url returned error: 404',
+)
+
+
+def error_output(error: Exception) -> str:
+    """
+    The output of the git process that failed with error.
+
+    :param error: the exception the git process failed with
+    :return: the decoded output, empty if there is none
+    """
+    output = getattr(error, 'output', None) or b''
+    if isinstance(output, bytes):
+        output = output.decode('utf-8', errors='replace')
+    return output
+
+
+def classify_failure(error: Exception) -> str:
+    """
+    Classify the failure of a git process.
+
+    Permanent messages are checked first, as git can follow an
+    authentication failure with transient sounding messages like 'the remote
+    end hung up unexpectedly'.
+
+    :param error: the exception the git process failed with
+    :return: TRANSIENT, PERMANENT, TIMEOUT or UNKNOWN
+    """
+    if isinstance(error, GitStalled):
+        # A hung transfer is a network problem
+        return TRANSIENT
+    if isinstance(error, subprocess.TimeoutExpired):
+        return TIMEOUT
+    output = error_output(error).lower()
+    if any(message in output for message in _PERMANENT_MESSAGES):
+        return PERMANENT
+    if any(message in output for message in _TRANSIENT_MESSAGES):
+        return TRANSIENT
+    return UNKNOWN
+
+
+class RetryPolicy(object):
+    """
+    Retries of the git operations of a repository, with exponential backoff.
+
+    Only transient failures, including stalled transfers, are retried.
+    Permanent failures would fail again, and a repository that timed out
+    would most likely time out again, holding a worker for another timeout.
+    Unknown failures are not retried either, but are reported like every
+    other failure.
+    """
+
+    def __init__(self, max_retries: int = 2, backoff: float = 10.0,
+                 max_backoff: float = 300.0,
+                 sleep: typing.Callable[[float], None] = time.sleep):
+        """
+        Retries of the git operations of a repository.
+
+        :param max_retries: the number of times to retry a transient failure
+        :param backoff: the delay before the first retry, in seconds. It
+            doubles with every retry
+        :param max_backoff: the longest delay between retries, in seconds
+        :param sleep: the function to sleep with
+        """
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.sleep = sleep
+
+    def call(self, function: typing.Callable, description: str):
+        """
+        Call function, retrying it on transient failures.
+
+        :param function: the git operation
+        :param description: what the operation works on, for the log
+        :return: what function returns
+        :raises subprocess.CalledProcessError: If the git process failed
+            permanently, or still failed after the retries
+        :raises subprocess.TimeoutExpired: If the git process timed out
+        """
+        retries = 0
+        while True:
+            try:
+                return function()
+            except (subprocess.CalledProcessError,
+                    subprocess.TimeoutExpired) as error:
+                failure = classify_failure(error)
+                if failure != TRANSIENT or retries >= self.max_retries:
+                    raise
+                delay = min(self.backoff * 2 ** retries, self.max_backoff)
+                retries += 1
+                logging.warning(M('Transient failure of {0}, retry {1} of {2} '
+                                  'in {3:.0f}s: {4}', description, retries,
+                                  self.max_retries, delay,
+                                  error_output(error).strip()))
+                self.sleep(delay)
+
+
+def summarise_failures(results: typing.Iterable[BackupResult]) -> \
+        typing.List[str]:
+    """
+    Describe the failed backups of a run, one line each.
+
+    :param results: the results of the run
+    :return: the lines, empty if nothing failed
+    """
+    lines = []
+    for result in results:
+        if result.ok:
+            continue
+        output = error_output(result.error).strip().splitlines()
+        lines.append('{0}: {1} failure{2}: {3}'.format(
+            result.path, classify_failure(result.error),
+            ' after {0} attempts'.format(result.metrics.attempts)
+            if result.metrics is not None and result.metrics.attempts > 1
+            else '',
+            output[-1] if output else result.error))
+    return lines
@@ -0,0 +1,216 @@
+"""Filtering of the listed repositories by the metadata github reports, so
+repositories that need no backup are dropped before any git process runs."""
+
+import calendar
+import collections
+import fnmatch
+import json
+import logging
+import threading
+import time
+import typing
+
+from statsbiblioteket.github_cloner.messages import M
+from statsbiblioteket.github_cloner.myTypes import Path, Repository
+
+# What to do with forks: back them up, leave them out, back up only forks,
+# or back up only the forks that have been pushed to since they were made
+FORK_MODES = ('include', 'exclude', 'only', 'modified')
+
+# What to do with archived repositories
+ARCHIVED_MODES = ('include', 'exclude', 'only')
+
+# The settings of a filter, as the keys of a filter config file
+SETTINGS = ('include', 'exclude', 'forks', 'archived', 'min_size',
+            'max_size', 'max_pushed_age', 'visibility')
+
+
+def _timestamp(text: str) -> typing.Optional[float]:
+    """The seconds since the epoch of a github timestamp, or None"""
+    if not text:
+        return None
+    return calendar.timegm(time.strptime(text, '%Y-%m-%dT%H:%M:%SZ'))
+
+
+class RepositoryFilter(object):
+    """
+    A filter of the listed repositories by their metadata.
+
+    A repository is skipped if its name matches none of the include globs
+    or any of the exclude globs, if it is a fork or archived and the filter
+    says so, if its size is outside the size limits, if it has not been
+    pushed to for max_pushed_age days, or if its visibility is not one of
+    the visibilities given. A glob containing a / is matched against
+    'account/name' instead of the name. Metadata github did not report does
+    not cause a repository to be skipped.
+
+    The repositories skipped are counted by the reason they were skipped,
+    until the counts are taken with take_skipped.
+    """
+
+    def __init__(self, include: typing.Iterable[str] = None,
+                 exclude: typing.Iterable[str] = None,
+                 forks: str = 'include',
+                 archived: str = 'include',
+                 min_size: int = None,
+                 max_size: int = None,
+                 max_pushed_age: float = None,
+                 visibility: typing.Iterable[str] = None,
+                 clock: typing.Callable[[], float] = time.time):
+        """
+        A repository filter.
+
+        :param include: the globs of the names to backup, or None for all
+        :param exclude: the globs of the names not to backup
+        :param forks: one of FORK_MODES
+        :param archived: one of ARCHIVED_MODES
+        :param min_size: skip repositories smaller than this, in KB as
+            reported by github
+        :param max_size: skip repositories larger than this, in KB
+        :param max_pushed_age: skip repositories not pushed to for this many
+            days
+        :param visibility: the visibilities to backup, e.g. ['public'], or
+            None for all
+        :param clock: the wall clock, in seconds since the epoch
+        :raises ValueError: If forks or archived is not a known mode
+        """
+        if forks not in FORK_MODES:
+            raise ValueError('forks must be one of {0}, not {1}'.format(
+                ', '.join(FORK_MODES), forks))
+        if archived not in ARCHIVED_MODES:
+            raise ValueError('archived must be one of {0}, not {1}'.format(
+                ', '.join(ARCHIVED_MODES), archived))
+        self.include = list(include) if include else None
+        self.exclude = list(exclude or [])
+        self.forks = forks
+        self.archived = archived
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_pushed_age = max_pushed_age
+        self.visibility = set(visibility) if visibility else None
+        self.clock = clock
+        self._skipped = collections.Counter()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls, config: Path = None,
+                      **overrides) -> 'RepositoryFilter':
+        """
+        A filter from a JSON config file, with settings given on the command
+        line taking precedence. The config file is an object with any of the
+        keys of SETTINGS, e.g.::
+
+            {"exclude": ["*-archive"], "forks": "modified",
+             "max_size": 1048576, "visibility": ["public"]}
+
+        :param config: the path of the config file, or None
+        :param overrides: the settings that override the config file. Those
+            that are None are ignored
+        :return: the filter
+        :raises ValueError: If the config file has an unknown setting, or a
+            setting is invalid
+        """
+        settings = {}
+        if config is not None:
+            with open(config, encoding='utf-8') as config_file:
+                settings = json.load(config_file)
+            if not isinstance(settings, dict):
+                raise ValueError('{0} must contain a JSON object'.format(
+                    config))
+        unknown = set(settings) - set(SETTINGS)
+        if unknown:
+            raise ValueError('Unknown filter settings in {0}: {1}'.format(
+                config, ', '.join(sorted(unknown))))
+        settings.update((key, value) for key, value in overrides.items()
+                        if value is not None)
+        return cls(**settings)
+
+    @property
+    def is_empty(self) -> bool:
+        """True if the filter skips no repositories"""
+        return self.include is None and not self.exclude and \
+            self.forks == 'include' and self.archived == 'include' and \
+            self.min_size is None and self.max_size is None and \
+            self.max_pushed_age is None and self.visibility is None
+
+    def _name_matches(self, account: str, name: str,
+                      globs: typing.Iterable[str]) -> bool:
+        full_name = '{0}/{1}'.format(account, name)
+        return any(fnmatch.fnmatchcase(full_name if '/' in glob else name,
+                                       glob) for glob in globs)
+
+    def reason(self, repository: Repository,
+               account: str = '') -> typing.Optional[str]:
+        """
+        :param repository: the repository
+        :param account: the github user/org the repository was listed for
+        :return: why the repository is skipped, 'name', 'fork', 'archived',
+            'size', 'pushed' or 'visibility', or None if it is backed up
+        """
+        name = str(repository.name)
+        if self.include is not None and \
+                not self._name_matches(account, name, self.include):
+            return 'name'
+        if self._name_matches(account, name, self.exclude):
+            return 'name'
+        if repository.fork is not None:
+            if (self.forks == 'exclude' and repository.fork) or \
+                    (self.forks == 'only' and not repository.fork):
+                return 'fork'
+            if self.forks == 'modified' and repository.fork:
+                # github sets the push time of a fork to that of its parent
+                # when it is made, so an unmodified fork was pushed to before
+                # it was created
+                pushed = _timestamp(repository.pushed_at)
+                created = _timestamp(repository.created_at)
+                if pushed is not None and created is not None and \
+                        pushed <= created:
+                    return 'fork'
+        if repository.archived is not None:
+            if (self.archived == 'exclude' and repository.archived) or \
+                    (self.archived == 'only' and not repository.archived):
+                return 'archived'
+        if repository.size is not None:
+            if self.min_size is not None and repository.size < self.min_size:
+                return 'size'
+            if self.max_size is not None and repository.size > self.max_size:
+                return 'size'
+        if self.max_pushed_age is not None:
+            pushed = _timestamp(repository.pushed_at)
+            if pushed is not None and \
+                    self.clock() - pushed > self.max_pushed_age * 24 * 60 * 60:
+                return 'pushed'
+        if self.visibility is not None and repository.visibility is not None \
+                and repository.visibility not in self.visibility:
+            return 'visibility'
+        return None
+
+    def filter(self, repositories: typing.Iterable[Repository],
+               account: str = '') -> typing.Iterator[Repository]:
+        """
+        Stream the repositories the filter does not skip.
+
+        :param repositories: the repositories listed for an account
+        :param account: the github user/org
+        :return: an iterator of the repositories to backup
+        """
+        for repository in repositories:
+            reason = self.reason(repository, account)
+            if reason is None:
+                yield repository
+                continue
+            logging.debug(M('Skipping {0} of {1} by its {2}',
+                            repository.name, account, reason))
+            with self._lock:
+                self._skipped[reason] += 1
+
+    def take_skipped(self) -> typing.Dict[str, int]:
+        """
+        Take the counts of the repositories skipped since the last call.
+
+        :return: the number of repositories skipped for each reason
+        """
+        with self._lock:
+            skipped = dict(self._skipped)
+            self._skipped.clear()
+        return skipped
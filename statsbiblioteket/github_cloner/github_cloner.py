@@ -1,50 +1,133 @@
 """The Github cloner."""
 
 import argparse
+import collections
+import concurrent.futures
+import functools
 import logging
+import shutil
+import signal
 import subprocess
 import sys
+import tempfile
+import time
 import typing
+import urllib.parse
 
 import os
+import re
 import requests
 
-from statsbiblioteket.github_cloner.myTypes import Path, Repository, \
-    RepoType, Url, UserType
+from statsbiblioteket.github_cloner.bundle import BundleExporter
+from statsbiblioteket.github_cloner.cache import HttpCache
+from statsbiblioteket.github_cloner.concurrency import \
+    ConcurrencyController, DiskUtilisation
+from statsbiblioteket.github_cloner.failures import PERMANENT, \
+    RetryPolicy, classify_failure, error_output, summarise_failures
+from statsbiblioteket.github_cloner.filters import ARCHIVED_MODES, \
+    FORK_MODES, RepositoryFilter
+from statsbiblioteket.github_cloner.gitprocess import GitProgress, run_git
+from statsbiblioteket.github_cloner.graphql import GraphQLError, \
+    iter_graphql_repositories
+from statsbiblioteket.github_cloner.journal import RunJournal
+from statsbiblioteket.github_cloner.maintenance import Maintenance
+from statsbiblioteket.github_cloner.layout import MAX_FANOUT, Layout
+from statsbiblioteket.github_cloner.manifest import Manifest
+# BraceMessage used to be defined here, and is still importable from here
+from statsbiblioteket.github_cloner.messages import BraceMessage  # noqa: F401
+from statsbiblioteket.github_cloner.messages import M
+from statsbiblioteket.github_cloner.metrics import RepositoryMetrics, \
+    RunMetrics, directory_size
+from statsbiblioteket.github_cloner.myTypes import BackupResult, Path, \
+    Repository, RepoType, Url, UserType
+from statsbiblioteket.github_cloner.objectpool import ObjectPool
+from statsbiblioteket.github_cloner.partial import Hydration, is_complete
+from statsbiblioteket.github_cloner.ratelimit import RateLimiter
+from statsbiblioteket.github_cloner.refs import MIRROR_REFSPEC, RefFilters, \
+    configure_refspecs
+from statsbiblioteket.github_cloner.scheduling import expected_duration, \
+    order_jobs, seconds_per_kb, select_shard, shard_file, shard_owner
+from statsbiblioteket.github_cloner.session import GithubSession
+from statsbiblioteket.github_cloner.watch import EventPoller, Watcher, \
+    WebhookServer
+from statsbiblioteket.github_cloner.workqueue import MAX_QUEUED_JOBS, Job, \
+    WorkQueue
 
 API_GITHUB_COM = 'https://api.github.com'
 
+# The backends that can list the repositories of an account
+LISTING_BACKENDS = ('rest', 'graphql')
 
-class BraceMessage(object):
-    """Utility class for {} formatting of messages for logging."""
 
-    def __init__(self, fmt: str, *args, **kwargs):
-        """
-        A formatted version of fmt, using substitutions from args and kwargs.
-        The substitutions are identified by braces ('{' and '}').
-        """
-        self.fmt = fmt
-        self.args = args
-        self.kwargs = kwargs
+def _last_page(response: requests.Response) -> typing.Optional[int]:
+    """
+    Find the number of the last page from the Link header of a github
+    response.
 
-    def __str__(self) -> str:
-        return self.fmt.format(*self.args, **self.kwargs)
+    :param response: the response for a page of a github listing
+    :return: the number of the last page, 1 if there is no Link header, or
+        None if there are more pages but no rel="last" link
+    """
+    if 'last' in response.links:
+        query = urllib.parse.urlparse(response.links['last']['url']).query
+        return int(urllib.parse.parse_qs(query)['page'][0])
+    if 'next' in response.links:
+        return None
+    return 1
 
 
-M = BraceMessage
+def _bounded_map(executor: concurrent.futures.Executor,
+                 function: typing.Callable,
+                 iterable: typing.Iterable,
+                 window: int) -> typing.Iterator:
+    """
+    Like executor.map, but with at most window calls submitted ahead of the
+    results that have been consumed, so memory stays bounded however long the
+    iterable is. Results are yielded in the order of the iterable.
 
+    :param executor: the executor to run function on
+    :param function: the function to apply to each item
+    :param iterable: the items
+    :param window: the maximum number of outstanding calls
+    :return: an iterator of the results of function
+    """
+    pending = collections.deque()
+    for item in iterable:
+        pending.append(executor.submit(function, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
 
-def get_github_repositories(github_name: str,
-                            user_type: UserType,
-                            repo_type: RepoType,
-                            batch_size: int = 100) -> typing.List[Repository]:
+
+def iter_github_repositories(github_name: str,
+                             user_type: UserType,
+                             repo_type: RepoType,
+                             batch_size: int = 100,
+                             max_workers: int = 4,
+                             cache: HttpCache = None,
+                             session: requests.Session = None,
+                             rate_limiter: RateLimiter = None,
+                             api_url: Url = API_GITHUB_COM) -> \
+        typing.Iterator[Repository]:
     """
-    :rtype: typing.List(Repository)
-    :param github_name:
-    :param user_type:
-    :param repo_type:
-    :param batch_size:
-    :return:
+    Iterate over the repositories of a github user/org, yielding each page of
+    repositories as soon as it has arrived.
+
+    :param github_name: The name of the organisation/user on github
+    :param user_type: enum USER or ORG
+    :param repo_type: enum REPO or GIST
+    :param batch_size: the number of repositories per page
+    :param max_workers: the number of pages to request concurrently
+    :param cache: the cache of github responses, or None to always download
+        every page
+    :param session: the session to make the requests with, or None to use a
+        new connection for every request
+    :param rate_limiter: the scheduler keeping the requests within the github
+        rate limit, or None to make the requests right away
+    :param api_url: the base url of the github API
+    :return: an iterator of Repository objects
+    :raises requests.HTTPError: If github refused to list the repositories
 
     Format of the JSON is documented at
      http://developer.github.com/v3/repos/#list-organization-repositories
@@ -55,26 +138,92 @@ def get_github_repositories(github_name: str,
         Link: <https://api.github.com/resource?page=2>; rel="next",
               <https://api.github.com/resource?page=5>; rel="last"
 
+    When the first page carries a rel="last" link, the remaining pages are
+    requested concurrently, at most max_workers ahead of the consumer, and
+    yielded in page order. Otherwise the pages are followed one rel="next" at
+    a time.
     """
     # API documented at http://developer.github.com/v3/#pagination
     github_url = '{github}/{userType}/{name}/{repoType}'.format(
-        github=API_GITHUB_COM, userType=user_type.value, name=github_name,
+        github=api_url, userType=user_type.value, name=github_name,
         repoType=repo_type.value)
 
-    r = requests.get(github_url, params={"per_page": batch_size})
-    repositories = r.json()
-    logging.debug(M('Found {0} repositories on github', len(repositories)))
+    get = session.get if session is not None else requests.get
+    if rate_limiter is not None:
+        get = functools.partial(rate_limiter.get, get=get)
+
+    def _get(params: dict) -> requests.Response:
+        if cache is None:
+            response = get(github_url, params=params)
+        else:
+            response = cache.get(github_url, params=params, get=get)
+        response.raise_for_status()
+        return response
+
+    def _get_page(page: int) -> requests.Response:
+        logging.debug(M('Requesting page {0} of {1}', page, github_url))
+        return _get({"page": page, "per_page": batch_size})
+
+    r = _get({"per_page": batch_size})
+    page_repositories = r.json()
+    logging.debug(M('Found {0} repositories on github',
+                    len(page_repositories)))
+    yield from parse_github_repositories(page_repositories, repo_type)
+
+    last_page = _last_page(r)
+    if last_page is None:
+        page = 1
+        while 'rel="next"' in r.headers.get('Link', ''):
+            logging.debug(M('More repositories to be had'))
+            page += 1
+            r = _get_page(page)
+            yield from parse_github_repositories(r.json(), repo_type)
+    elif last_page > 1:
+        logging.debug(M('Requesting the remaining {0} pages',
+                        last_page - 1))
+        with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+            for r in _bounded_map(executor, _get_page,
+                                  range(2, last_page + 1), max_workers):
+                yield from parse_github_repositories(r.json(), repo_type)
 
-    page = 1
-    while 'rel="next"' in r.headers.get('Link', ''):
-        logging.debug(M('More repositories to be had'))
-        page += 1
-        r = requests.get(github_url, params={"page": page,
-                                             "per_page": batch_size})
-        repositories += r.json()
-        logging.debug(M('We now have {0} repositories', len(repositories)))
-    result = parse_github_repositories(repositories, repo_type)
 
+def get_github_repositories(github_name: str,
+                            user_type: UserType,
+                            repo_type: RepoType,
+                            batch_size: int = 100,
+                            max_workers: int = 4,
+                            cache: HttpCache = None,
+                            session: requests.Session = None,
+                            rate_limiter: RateLimiter = None,
+                            api_url: Url = API_GITHUB_COM) -> \
+        typing.List[Repository]:
+    """
+    List all the repositories of a github user/org.
+    See iter_github_repositories for the details.
+
+    :rtype: typing.List(Repository)
+    :param github_name: The name of the organisation/user on github
+    :param user_type: enum USER or ORG
+    :param repo_type: enum REPO or GIST
+    :param batch_size: the number of repositories per page
+    :param max_workers: the number of pages to request concurrently
+    :param cache: the cache of github responses, or None to always download
+        every page
+    :param session: the session to make the requests with, or None to use a
+        new connection for every request
+    :param rate_limiter: the scheduler keeping the requests within the github
+        rate limit, or None to make the requests right away
+    :param api_url: the base url of the github API
+    :return: A list of Repository objects
+    :raises requests.HTTPError: If github refused to list the repositories
+    """
+    result = list(iter_github_repositories(github_name, user_type, repo_type,
+                                           batch_size=batch_size,
+                                           max_workers=max_workers,
+                                           cache=cache, session=session,
+                                           rate_limiter=rate_limiter,
+                                           api_url=api_url))
+    logging.debug(M('Found {0} repositories in total', len(result)))
     return result
 
 
@@ -94,6 +243,23 @@ def parse_github_repositories(repositories: dict, repo_type: RepoType) -> \
         else:
             return repository['ssh_url']
 
+    def _get_repository_source(repository: dict):
+        source = repository.get('source') or repository.get('parent')
+        return source['full_name'] if source else None
+
+    def _get_repository_visibility(repository: dict):
+        if repo_type is RepoType.GIST:
+            public = repository.get('public')
+            if public is None:
+                return None
+            return 'public' if public else 'secret'
+        if repository.get('visibility'):
+            return repository['visibility']
+        private = repository.get('private')
+        if private is None:
+            return None
+        return 'private' if private else 'public'
+
     def _get_repository_name(repository: dict):
         if repo_type is RepoType.GIST:
             return repository['id']
@@ -103,69 +269,1049 @@ def parse_github_repositories(repositories: dict, repo_type: RepoType) -> \
     result = [Repository(name=_get_repository_name(repository),
                          description=repository[
                                          'description'] or "(no description)",
-                         url=_get_repository_url(repository)) for
-              repository in repositories]
+                         url=_get_repository_url(repository),
+                         size=repository.get('size'),
+                         pushed_at=repository.get('pushed_at'),
+                         updated_at=repository.get('updated_at'),
+                         fork=repository.get('fork'),
+                         archived=repository.get('archived'),
+                         source=_get_repository_source(repository),
+                         id=repository.get('id'),
+                         created_at=repository.get('created_at'),
+                         visibility=_get_repository_visibility(repository))
+              for repository in repositories]
     return result
 
 
-def fetch_or_clone(git_url: Url, repository_path: Path):
+def get_source_url(full_name: str,
+                   cache: HttpCache = None,
+                   session: requests.Session = None,
+                   rate_limiter: RateLimiter = None,
+                   api_url: Url = API_GITHUB_COM) -> typing.Optional[Url]:
+    """
+    The url of the root of the fork network of a fork, which github only
+    reports when the fork is requested on its own, not in the listings.
+
+    :param full_name: the full name of the fork, 'owner/name'
+    :param cache: the cache of github responses, or None
+    :param session: the session to make the request with, or None
+    :param rate_limiter: the scheduler keeping the request within the github
+        rate limit, or None
+    :param api_url: the base url of the github API
+    :return: the url the root is backed up from, or None if github did not
+        report it or the request failed
+    """
+    url = '{0}/repos/{1}'.format(api_url, full_name)
+    get = session.get if session is not None else requests.get
+    if rate_limiter is not None:
+        get = functools.partial(rate_limiter.get, get=get)
+    try:
+        if cache is None:
+            response = get(url, params={})
+        else:
+            response = cache.get(url, params={}, get=get)
+        response.raise_for_status()
+        repository = response.json()
+    except (requests.RequestException, ValueError) as error:
+        logging.warning(M('Failed to find the fork network of {0}: {1}',
+                          full_name, error))
+        return None
+    source = repository.get('source') or repository.get('parent')
+    if not source:
+        return None
+    return parse_github_repositories([source], RepoType.REPO)[0].url
+
+
+def _run_git(command: typing.List[str],
+             metrics: RepositoryMetrics = None,
+             timeout: float = None,
+             stall_timeout: float = None,
+             description: str = None) -> bytes:
+    """
+    Run a git command with its output streamed, adding the time it took and
+    the objects it received to the metrics.
+
+    :param command: the git command line, as a list of arguments so paths
+        with spaces are passed intact
+    :param metrics: the metrics of the repository, or None
+    :param timeout: kill git after this many seconds, or None to wait for it
+    :param stall_timeout: kill git when it has written nothing for this
+        many seconds, or None to wait for it
+    :param description: what git works on, for the progress log
+    :return: the last lines of the combined stdout and stderr of git
+    :raises subprocess.CalledProcessError: If the git process failed
+    :raises subprocess.TimeoutExpired: If the git process timed out
+    :raises GitStalled: If the git process stalled
+    """
+    started = time.monotonic()
+    progress = GitProgress()
+    try:
+        return run_git(command, description=description,
+                       timeout=timeout, stall_timeout=stall_timeout,
+                       progress=progress)
+    finally:
+        if metrics is not None:
+            metrics.git_time += time.monotonic() - started
+            metrics.objects_received += progress.received_objects
+
+
+# Clones in progress are made in hidden directories next to their target,
+# named .<name>.git.<random>.tmp, or .<name>.git.<owner>.<random>.tmp when
+# several hosts share the directories, where <owner> is e.g. shard-1-of-4
+_PARTIAL_CLONE_SUFFIX = '.tmp'
+_PARTIAL_CLONE_PATTERN = re.compile(
+    r'^\..+\.git\.(?:(?P<owner>[A-Za-z0-9]+(?:-[A-Za-z0-9]+)+)\.)?'
+    r'[A-Za-z0-9_]+\.tmp$')
+
+
+def _is_mirror(repository_path: Path) -> bool:
+    """
+    :param repository_path: the path of a mirror
+    :return: True if the path looks like a bare git repository
+    """
+    return all(os.path.exists(os.path.join(repository_path, name))
+               for name in ('HEAD', 'config', 'objects', 'refs'))
+
+
+def remove_partial_clones(directory: Path = '.', layout: Layout = None,
+                          owner: str = None):
+    """
+    Remove the temporary directories of clones that were interrupted.
+
+    Only the directories named like a clone in progress of this owner,
+    .<name>.git.<owner>.<random>.tmp, are removed, so the clones other hosts
+    have in progress in shared directories are left alone. Only the
+    directories the mirrors are stored in are searched, not the directories
+    below them.
+
+    :param directory: the directory the mirrors are in, when there is no
+        layout
+    :param layout: the layout the mirrors are stored in. Its root, namespaces
+        and fan-out directories are searched instead of directory
+    :param owner: the owner of the clones, see shard_owner, or None for the
+        clones of an unsharded backup
+    """
+    directories = layout.directories() if layout is not None \
+        else [directory]
+    for parent in directories:
+        for name in os.listdir(parent):
+            path = os.path.join(parent, name)
+            match = _PARTIAL_CLONE_PATTERN.match(name)
+            if match and match.group('owner') == owner and \
+                    os.path.isdir(path):
+                logging.info(M('Removing interrupted clone {0}', path))
+                shutil.rmtree(path, ignore_errors=True)
+
+
+def _clone_refs(git_url: Url, path: Path, refspecs: typing.List[str],
+                metrics: RepositoryMetrics = None,
+                reference: Path = None,
+                partial_filter: str = None,
+                timeout: float = None,
+                stall_timeout: float = None,
+                description: str = None):
+    """
+    Clone a mirror of only some of the refs of a repository, by configuring
+    an empty bare repository like git clone --mirror would, but with the
+    given refspecs, and fetching into it. See fetch_or_clone for the
+    parameters.
+    """
+    def _git(*arguments: str) -> bytes:
+        return _run_git(['git', '-C', path] + list(arguments), metrics,
+                        timeout, stall_timeout, description)
+
+    _git('init', '-q', '--bare')
+    _git('config', 'remote.origin.url', git_url)
+    for refspec in refspecs:
+        _git('config', '--add', 'remote.origin.fetch', refspec)
+    _git('config', 'remote.origin.mirror', 'true')
+    if reference is not None:
+        with open(os.path.join(path, 'objects', 'info', 'alternates'),
+                  'w') as alternates:
+            alternates.write(os.path.join(os.path.abspath(reference),
+                                          'objects') + '\n')
+    fetch = ['fetch', '--progress', 'origin']
+    if partial_filter is not None:
+        # git fetch --filter makes origin a promisor remote, like git clone
+        fetch.append('--filter=' + partial_filter)
+    output = _git(*fetch)
+    logging.debug(M('Fetched {0} with refspecs {1}\n{2}', git_url,
+                    ' '.join(refspecs), output.decode('utf-8')))
+    # Point HEAD at the default branch of the remote, as git clone does
+    head = _git('ls-remote', '--symref', 'origin', 'HEAD').decode('utf-8')
+    for line in head.splitlines():
+        if line.startswith('ref: ') and line.endswith('\tHEAD'):
+            _git('symbolic-ref', 'HEAD',
+                 line[len('ref: '):-len('\tHEAD')])
+
+
+def fetch_or_clone(git_url: Url, repository_path: Path,
+                   metrics: RepositoryMetrics = None,
+                   reference: Path = None,
+                   partial_filter: str = None,
+                   timeout: float = None,
+                   stall_timeout: float = None,
+                   refspecs: typing.List[str] = None,
+                   owner: str = None):
     """
     If the repository already exists, perform a fetch. Otherwise perform a
     clone.
     The repository is cloned 'bare' i.e. with the --mirror flag
 
+    The clone is made in a temporary directory next to repository_path, and
+    renamed into place when it has succeeded, so an interrupted clone never
+    leaves a half-populated mirror behind.
+
     :param git_url: The git url to clone/fetch from
     :param repository_path: The path to clone the repository to
+    :param metrics: the metrics to record the operation, the git time and
+        the bytes received in, or None
+    :param reference: a repository to borrow objects from when cloning, see
+        git clone --reference
+    :param partial_filter: make the clone a partial clone with this filter,
+        e.g. 'blob:none', see git clone --filter
+    :param timeout: kill each git process after this many seconds, or None
+        to wait for it
+    :param stall_timeout: kill a git process when it has written nothing,
+        not even progress, for this many seconds, or None to wait for it
     :returns: None
     :raises subprocess.CalledProcessError: If any of the git processes failed
+    :raises subprocess.TimeoutExpired: If any of the git processes timed out
+    :param refspecs: the refspecs to fetch, see refs.RefFilter. They are
+        set on an existing mirror before it is fetched. If None, a new
+        mirror fetches every ref and an existing one keeps its refspecs
+    :param owner: the owner to name the temporary directory of a clone
+        after, see remove_partial_clones, or None
+    :raises GitStalled: If any of the git processes stalled
     """
     abspath = os.path.abspath(repository_path)
+    objects = os.path.join(abspath, 'objects')
+
+    if os.path.isdir(abspath) and not _is_mirror(abspath):
+        logging.warning(M('{0} is not a complete mirror, cloning it again',
+                          repository_path))
+        shutil.rmtree(abspath)
 
     should_fetch = os.path.isdir(repository_path)
+    size_before = directory_size(objects) if metrics is not None else 0
 
     if should_fetch:
         logging.info(M('Fetching updates to repository {0}', repository_path))
-        remote = 'git -C {abspath} remote set-url origin {git_url}'.format(
-            abspath=abspath, git_url=git_url)
-        output = subprocess.check_output(remote.split(),
-                                         stderr=subprocess.STDOUT)
+        if metrics is not None:
+            metrics.operation = 'fetch'
+        remote = ['git', '-C', abspath, 'remote', 'set-url', 'origin',
+                  git_url]
+        _run_git(remote, metrics, timeout, stall_timeout, repository_path)
         logging.debug(
-            M('Running command "{0}"', remote))
+            M('Running command "{0}"', ' '.join(remote)))
 
-        fetch = 'git -C {abspath} --bare fetch --all'.format(
-            abspath=abspath)
-        output = subprocess.check_output(fetch.split(),
-                                         stderr=subprocess.STDOUT)
+        if refspecs is not None:
+            configure_refspecs(abspath, refspecs)
+        fetch = ['git', '-C', abspath, '--bare', 'fetch', '--progress',
+                 '--all']
+        output = _run_git(fetch, metrics, timeout, stall_timeout,
+                          repository_path)
         logging.debug(
-            M('Running command "{0}"\n{1}', fetch, output.decode("utf-8")))
+            M('Running command "{0}"\n{1}', ' '.join(fetch),
+              output.decode("utf-8")))
     else:
         logging.info(M('Cloning repository {0}', repository_path))
-        os.makedirs(abspath, exist_ok=True)
+        if metrics is not None:
+            metrics.operation = 'clone'
+        parent = os.path.dirname(abspath)
+        os.makedirs(parent, exist_ok=True)
+        prefix = '.' + os.path.basename(abspath) + '.'
+        if owner is not None:
+            prefix += owner + '.'
+        temppath = tempfile.mkdtemp(dir=parent, prefix=prefix,
+                                    suffix=_PARTIAL_CLONE_SUFFIX)
+        try:
+            if refspecs is None or refspecs == [MIRROR_REFSPEC]:
+                clone = ['git', '-C', temppath, 'clone', '--progress',
+                         '--mirror']
+                if reference is not None:
+                    clone += ['--reference', reference]
+                if partial_filter is not None:
+                    clone.append('--filter=' + partial_filter)
+                clone += [git_url, '.']
+                output = _run_git(clone, metrics, timeout, stall_timeout,
+                                  repository_path)
+                logging.debug(
+                    M('Running command "{0}"\n{1}', ' '.join(clone),
+                      output.decode("utf-8")))
+            else:
+                _clone_refs(git_url, temppath, refspecs, metrics=metrics,
+                            reference=reference,
+                            partial_filter=partial_filter, timeout=timeout,
+                            stall_timeout=stall_timeout,
+                            description=repository_path)
+            os.rename(temppath, abspath)
+        except BaseException:
+            shutil.rmtree(temppath, ignore_errors=True)
+            raise
+
+    if metrics is not None:
+        metrics.bytes_received = max(directory_size(objects) - size_before,
+                                     0)
+
+
+def _aftercare(step: str, path: Path, function: typing.Callable, *args,
+               **kwargs) -> typing.Any:
+    """
+    Run a step following the fetch or clone of a mirror, e.g. its
+    maintenance, logging its failure instead of raising it.
+
+    :param step: what the step does to the mirror, for the log
+    :param path: the path of the mirror
+    :param function: the step
+    :return: what the step returned, or None if it failed
+    """
+    try:
+        return function(*args, **kwargs)
+    except Exception as error:
+        logging.error(M('Failed to {0} {1} after backing it up: {2}\n{3}',
+                        step, path, error, error_output(error)))
+        return None
+
+
+def _backup_repository(repository: Repository,
+                       manifest: Manifest = None,
+                       force: bool = False,
+                       account: str = None,
+                       repo_type: RepoType = None,
+                       object_pool: ObjectPool = None,
+                       journal: RunJournal = None,
+                       maintenance: Maintenance = None,
+                       partial_filter: str = None,
+                       hydration: Hydration = None,
+                       retry: RetryPolicy = None,
+                       timeout: float = None,
+                       stall_timeout: float = None,
+                       refs: RefFilters = None,
+                       layout: Layout = None,
+                       owner: str = None) -> BackupResult:
+    """
+    Fetch or clone a single repository, capturing any failure in the result
+    rather than raising it.
+
+    :param repository: the repository to backup
+    :param manifest: the manifest of previous backups, or None to always fetch
+    :param force: fetch the repository even if the manifest says it is
+        unchanged
+    :param account: the github user/org the repository belongs to
+    :param repo_type: enum REPO or GIST
+    :param object_pool: the pool to share objects within fork networks
+        through, or None
+    :param journal: the journal of the run, or None
+    :param maintenance: the maintenance to perform on the mirror after it
+        has been fetched, or None
+    :param partial_filter: the partial clone filter for new clones, or None
+        to clone completely
+    :param hydration: the hydration of partial mirrors, or None
+    :param retry: the policy for retrying transient failures of the fetch or
+        clone, or None to not retry
+    :param timeout: kill each git process of the fetch or clone after this
+        many seconds, or None to wait for it
+    :param stall_timeout: kill a git process of the fetch or clone when it
+        has written nothing for this many seconds, or None to wait for it
+    :param refs: the refs to fetch for each account, or None to fetch every
+        ref into new mirrors and leave the refspecs of existing ones alone
+    :param layout: where to store the mirror, or None to store it in the
+        current working dir. A mirror an earlier layout put elsewhere is
+        moved to its place
+    :param owner: the shard cloning the repository, see shard_owner, or
+        None
+    :return: the BackupResult for the repository, with its metrics
+    """
+    metrics = RepositoryMetrics(repository.name, account,
+                                repo_type.value if repo_type else None)
+    started = time.monotonic()
+    if layout is None:
+        path = repository.name + '.git'
+    else:
+        try:
+            path = layout.migrate(repository, account, repo_type)
+        except OSError as error:
+            path = layout.path(repository, account, repo_type)
+            logging.error(M('Failed to move the mirror of {0} to {1}: {2}',
+                            repository.url, path, error))
+            metrics.failure = PERMANENT
+            metrics.outcome = 'failed'
+            metrics.wall_time = time.monotonic() - started
+            return BackupResult(repository, path, error, metrics=metrics)
+    if journal is not None and journal.is_done(repository.url):
+        logging.info(M('Repository {0} was done before the run was '
+                       'interrupted, skipping', path))
+        metrics.operation = 'skip'
+        metrics.outcome = 'skipped'
+        return BackupResult(repository, path, skipped=True, metrics=metrics)
+    try:
+        if journal is not None:
+            journal.started(repository.url)
+        state = None
+        if manifest is not None:
+            unchanged, state = manifest.unchanged(repository, path)
+            if unchanged and not force:
+                logging.info(M('Repository {0} is unchanged, skipping',
+                               path))
+                manifest.record(repository, state)
+                if hydration is not None:
+                    # Partial mirrors keep hydrating while unchanged
+                    hydrated = _aftercare('hydrate', path, hydration.hydrate,
+                                          path)
+                    if hydrated is not None:
+                        metrics.hydrated_objects, metrics.complete = hydrated
+                    if object_pool is not None and metrics.complete and \
+                            metrics.hydrated_objects:
+                        # Hydrated in this run, so it can join the pool now
+                        _aftercare('pool the objects of', path,
+                                   object_pool.add, repository, path)
+                if journal is not None:
+                    journal.finished(repository.url)
+                metrics.operation = 'skip'
+                metrics.outcome = 'skipped'
+                return BackupResult(repository, path, skipped=True,
+                                    metrics=metrics)
+        if manifest is not None:
+            metrics.expected_time = manifest.duration(repository)
+        refspecs = None
+        if refs is not None:
+            refspecs = refs.for_account(account).refspecs()
+        reference = None
+        if object_pool is not None and not os.path.isdir(path):
+            # Only a clone borrows from the pool
+            reference = object_pool.reference_for(repository, account)
+
+        def _fetch_or_clone():
+            metrics.attempts += 1
+            fetch_or_clone(repository.url, path, metrics=metrics,
+                           reference=reference,
+                           partial_filter=partial_filter, timeout=timeout,
+                           stall_timeout=stall_timeout, refspecs=refspecs,
+                           owner=owner)
+
+        if retry is not None:
+            retry.call(_fetch_or_clone, path)
+        else:
+            _fetch_or_clone()
+        # The mirror is backed up now, so a failure of the steps after the
+        # fetch is logged but does not fail it
+        hydrated = None
+        if hydration is not None:
+            hydrated = _aftercare('hydrate', path, hydration.hydrate, path)
+        if hydrated is not None:
+            metrics.hydrated_objects, metrics.complete = hydrated
+        else:
+            metrics.complete = is_complete(path)
+        if object_pool is not None:
+            if metrics.complete:
+                _aftercare('pool the objects of', path, object_pool.add,
+                           repository, path)
+            else:
+                # The pool would fetch the missing objects from the mirror,
+                # which cannot send them
+                logging.info(M('{0} is a partial mirror, it joins the object '
+                               'pool when it is complete', path))
+        if maintenance is not None:
+            maintenance_started = time.monotonic()
+            _aftercare('maintain', path, maintenance.maintain, path,
+                       changed=metrics.operation == 'clone' or
+                       metrics.bytes_received > 0)
+            metrics.maintenance_time = \
+                time.monotonic() - maintenance_started
+        if manifest is not None:
+            state['duration'] = time.monotonic() - started
+            manifest.record(repository, state)
+        if journal is not None:
+            journal.finished(repository.url)
+    except Exception as error:
+        # Whatever fails, e.g. git, a full disk or a permission problem, only
+        # fails this repository, the others are still backed up
+        metrics.failure = classify_failure(error)
+        logging.error(M('Failed to backup repository {0} ({1} failure): '
+                        '{2}\n{3}', path, metrics.failure, error,
+                        error_output(error)))
+        metrics.outcome = 'failed'
+        return BackupResult(repository, path, error, metrics=metrics)
+    finally:
+        metrics.wall_time = time.monotonic() - started
+    metrics.outcome = 'ok'
+    return BackupResult(repository, path, metrics=metrics)
+
+
+def _timed(iterable: typing.Iterable,
+           on_done: typing.Callable[[float, int], None]) -> typing.Iterator:
+    """
+    Iterate over iterable, measuring the time spent waiting for its items.
+
+    :param iterable: the iterable to time
+    :param on_done: called with the seconds spent and the number of items
+        when the iterable is exhausted
+    :return: an iterator over the items of iterable
+    """
+    seconds = 0.0
+    count = 0
+    iterator = iter(iterable)
+    while True:
+        started = time.monotonic()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            seconds += time.monotonic() - started
+            on_done(seconds, count)
+            return
+        seconds += time.monotonic() - started
+        count += 1
+        yield item
+
+
+def _noted(iterable: typing.Iterable,
+           on_item: typing.Callable[[typing.Any], None]) -> typing.Iterator:
+    """Iterate over iterable, calling on_item with every item first"""
+    for item in iterable:
+        on_item(item)
+        yield item
 
-        clone = 'git -C {abspath} clone --mirror {git_url} .'.format(
-            abspath=abspath, git_url=git_url)
-        output = subprocess.check_output(clone.split(),
-                                         stderr=subprocess.STDOUT)
-        logging.debug(
-            M('Running command "{0}"\n{1}', clone, output.decode("utf-8")))
+
+def _observe(concurrency: ConcurrencyController, result: BackupResult):
+    """Let the concurrency controller observe a finished backup"""
+    metrics = result.metrics
+    if not result.ok:
+        # A missing repository or bad credentials say nothing about the load
+        if metrics.failure != PERMANENT:
+            concurrency.record(metrics.wall_time, ok=False)
+    elif metrics.operation in ('clone', 'fetch'):
+        concurrency.record(metrics.git_time, metrics.bytes_received,
+                           expected=metrics.expected_time)
+
+
+def _list_repositories(github_name: str,
+                       user_type: UserType,
+                       repo_type: RepoType,
+                       cache: HttpCache = None,
+                       session: requests.Session = None,
+                       rate_limiter: RateLimiter = None,
+                       api_url: Url = API_GITHUB_COM,
+                       run_metrics: RunMetrics = None,
+                       shard_index: int = 0,
+                       shard_count: int = 1,
+                       listing: str = 'rest',
+                       repository_filter: RepositoryFilter = None,
+                       on_listed: typing.Callable[[str, Repository],
+                                                  None] = None) -> \
+        typing.Iterator[Repository]:
+    """
+    Stream the repositories of an account that belong to this shard and pass
+    the filter, with the backend chosen by listing. on_listed, if given, is
+    called with the account and every repository listed, before the shard
+    and the filter are applied. See github_backup for the other parameters.
+    """
+    if listing == 'graphql' and repo_type is RepoType.REPO:
+        post = session.post if session is not None else requests.post
+        if rate_limiter is not None:
+            post = functools.partial(rate_limiter.post, post=post)
+        repositories = iter_graphql_repositories(github_name, api_url,
+                                                 post=post)
+    else:
+        repositories = iter_github_repositories(github_name, user_type,
+                                                repo_type, cache=cache,
+                                                session=session,
+                                                rate_limiter=rate_limiter,
+                                                api_url=api_url)
+    if run_metrics is not None:
+        repositories = _timed(
+            repositories,
+            functools.partial(run_metrics.add_listing, github_name,
+                              repo_type.value))
+    if on_listed is not None:
+        repositories = _noted(repositories,
+                              functools.partial(on_listed, github_name))
+    if shard_count > 1:
+        repositories = select_shard(repositories, shard_index, shard_count)
+    if repository_filter is not None:
+        repositories = repository_filter.filter(repositories, github_name)
+    return repositories
+
+
+def _report_skipped(repository_filter: typing.Optional[RepositoryFilter],
+                    run_metrics: RunMetrics = None):
+    """Log and record the repositories the filter skipped"""
+    if repository_filter is None:
+        return
+    skipped = repository_filter.take_skipped()
+    if skipped:
+        logging.info(M('Skipped {0} repositories by their metadata: {1}',
+                       sum(skipped.values()),
+                       ', '.join('{0} by {1}'.format(count, reason)
+                                 for reason, count in
+                                 sorted(skipped.items()))))
+    if run_metrics is not None:
+        run_metrics.add_filtered(skipped)
+
+
+def _run_backups(jobs: typing.Iterable,
+                 backup: typing.Callable[[typing.Any], BackupResult],
+                 max_workers: int = 1,
+                 concurrency: ConcurrencyController = None) -> \
+        typing.List[BackupResult]:
+    """
+    Run the backup of every job, max_workers or as many as the concurrency
+    controller allows at a time.
+
+    :param jobs: the jobs, taken one at a time as workers become free
+    :param backup: the function backing up a job
+    :param max_workers: the number of jobs to run concurrently
+    :param concurrency: the controller adapting the number of concurrent
+        jobs, or None. The controller replaces max_workers
+    :return: the results of the jobs, in the order they finished
+    """
+    if concurrency is not None:
+        max_workers = concurrency.max_workers
+
+    def _in_flight() -> int:
+        # Queue a few repositories ahead of a fixed pool, but only run as
+        # many as the controller allows
+        if concurrency is not None:
+            return concurrency.limit
+        return 2 * max_workers
+
+    results = []
+    pending = set()
+
+    def _collect(done: typing.Iterable[concurrent.futures.Future]):
+        for future in done:
+            results.append(future.result())
+            if concurrency is not None:
+                _observe(concurrency, results[-1])
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+        for job in jobs:
+            pending.add(executor.submit(backup, job))
+            while len(pending) >= _in_flight():
+                done, pending = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                _collect(done)
+        _collect(concurrent.futures.as_completed(pending))
+    return results
+
+
+def _save_state(results: typing.List[BackupResult],
+                manifest: Manifest = None,
+                object_pool: ObjectPool = None,
+                run_metrics: RunMetrics = None):
+    """Save the state of the backups, and record their metrics"""
+    if manifest is not None:
+        manifest.save()
+    if object_pool is not None:
+        object_pool.save()
+    if run_metrics is not None:
+        for result in results:
+            run_metrics.add(result.metrics)
 
 
 def github_backup(github_name: str,
                   user_type: UserType = UserType.USER,
-                  repo_type: RepoType = RepoType.REPO):
+                  repo_type: RepoType = RepoType.REPO,
+                  max_workers: int = 1,
+                  cache: HttpCache = None,
+                  session: requests.Session = None,
+                  rate_limiter: RateLimiter = None,
+                  manifest: Manifest = None,
+                  force: bool = False,
+                  largest_first: bool = False,
+                  api_url: Url = API_GITHUB_COM,
+                  run_metrics: RunMetrics = None,
+                  object_pool: ObjectPool = None,
+                  journal: RunJournal = None,
+                  maintenance: Maintenance = None,
+                  partial_filter: str = None,
+                  hydration: Hydration = None,
+                  shard_index: int = 0,
+                  shard_count: int = 1,
+                  listing: str = 'rest',
+                  concurrency: ConcurrencyController = None,
+                  retry: RetryPolicy = None,
+                  timeout: float = None,
+                  stall_timeout: float = None,
+                  refs: RefFilters = None,
+                  repository_filter: RepositoryFilter = None,
+                  layout: Layout = None) -> typing.List[BackupResult]:
     """
     Backup all repositories from a specific user/org on github to current
-    working dir
+    working dir, or to where the layout says
+
+    The repositories are backed up while the listing is still being fetched,
+    with up to max_workers repositories fetched or cloned concurrently. A
+    repository that fails does not stop the others.
 
     :param github_name: The name of the organisation/user on github
     :param user_type: enum USER or ORG
     :param repo_type: enum REPO or GIST
-    :return: None
-    :raises CalledProcessError: If any of the git processes failed
+    :param max_workers: the number of repositories to backup concurrently
+    :param cache: the cache of github responses, or None to always download
+        the full listing
+    :param session: the session to list the repositories with, or None to
+        use a new connection for every request
+    :param rate_limiter: the scheduler keeping the listing within the github
+        rate limit, or None to make the requests right away
+    :param manifest: the manifest of previous backups. Repositories that are
+        unchanged since their last backup are skipped. The manifest is saved
+        when the backup is done. If None, every repository is fetched
+    :param force: fetch every repository, even the unchanged ones
+    :param largest_first: list all the repositories before starting, and
+        backup the ones expected to take the longest first, judged by their
+        size and the durations recorded in the manifest
+    :param api_url: the base url of the github API
+    :param run_metrics: the metrics to record the listing time and the
+        metrics of every repository in, or None
+    :param object_pool: the pool to share objects within fork networks
+        through, or None to store the objects of every mirror separately
+    :param journal: the journal of the run. Repositories it records as done
+        are skipped, so an interrupted run can be resumed
+    :param maintenance: the maintenance to perform on every mirror after it
+        has been fetched, or None
+    :param partial_filter: clone new repositories as partial clones with
+        this filter, e.g. 'blob:none', or None to clone completely
+    :param hydration: the hydration backfilling the objects of partial
+        mirrors, or None
+    :param shard_index: the shard of the repositories to backup, from 0 to
+        shard_count - 1
+    :param shard_count: the number of shards the repositories are split in,
+        e.g. one per backup host
+    :param listing: the backend listing the repositories, 'rest' or
+        'graphql'. GraphQL fetches only the fields the cloner needs, but
+        requires a session with a token. Gists are always listed with REST
+    :param concurrency: the controller adapting the number of concurrent
+        clones and fetches, or None to run max_workers at a time. The
+        controller replaces max_workers
+    :param retry: the policy for retrying transient failures of the fetches
+        and clones, or None to not retry
+    :param timeout: kill each git process of a fetch or clone after this
+        many seconds, or None to wait for it
+    :param stall_timeout: kill a git process of a fetch or clone when it has
+        written nothing for this many seconds, or None to wait for it
+    :param refs: the refs to fetch for each account, or None to fetch every
+        ref into new mirrors and leave the refspecs of existing ones alone
+    :param repository_filter: the filter of the listed repositories by their
+        metadata, or None to backup every repository. The repositories it
+        skips are counted in run_metrics
+    :param layout: where to store the mirrors, or None to store them in the
+        current working dir
+    :return: A list of BackupResult, one for each repository. A repository
+        that failed does not stop the others, its result has the error
+    :raises GraphQLError: If github answered the GraphQL listing with errors
+    """
+    repositories = _list_repositories(github_name, user_type, repo_type,
+                                      cache=cache, session=session,
+                                      rate_limiter=rate_limiter,
+                                      api_url=api_url,
+                                      run_metrics=run_metrics,
+                                      shard_index=shard_index,
+                                      shard_count=shard_count,
+                                      listing=listing,
+                                      repository_filter=repository_filter)
+    if largest_first:
+        repositories = order_jobs(repositories, manifest)
+    backup_repository = functools.partial(_backup_repository,
+                                          manifest=manifest, force=force,
+                                          account=github_name,
+                                          repo_type=repo_type,
+                                          object_pool=object_pool,
+                                          journal=journal,
+                                          maintenance=maintenance,
+                                          partial_filter=partial_filter,
+                                          hydration=hydration,
+                                          retry=retry, timeout=timeout,
+                                          stall_timeout=stall_timeout,
+                                          refs=refs, layout=layout,
+                                          owner=shard_owner(shard_index,
+                                                            shard_count))
+    results = []
+    try:
+        results = _run_backups(repositories, backup_repository,
+                               max_workers=max_workers,
+                               concurrency=concurrency)
+    finally:
+        # Keep the progress of the repositories done, even if interrupted
+        _save_state(results, manifest, object_pool, run_metrics)
+    _report_skipped(repository_filter, run_metrics)
+    failed = sum(1 for result in results if not result.ok)
+    if failed:
+        logging.warning(M('{0} of {1} {2} of {3} failed', failed,
+                          len(results), repo_type.value, github_name))
+    return results
+
+
+def backup_jobs(jobs: typing.Iterable[Job],
+                max_workers: int = 1,
+                concurrency: ConcurrencyController = None,
+                manifest: Manifest = None,
+                force: bool = False,
+                object_pool: ObjectPool = None,
+                journal: RunJournal = None,
+                maintenance: Maintenance = None,
+                partial_filter: str = None,
+                hydration: Hydration = None,
+                retry: RetryPolicy = None,
+                timeout: float = None,
+                stall_timeout: float = None,
+                refs: RefFilters = None,
+                layout: Layout = None,
+                owner: str = None,
+                run_metrics: RunMetrics = None) -> typing.List[BackupResult]:
+    """
+    Backup the repositories of jobs to current working dir, or to where the
+    layout says, and save the state of the backups.
+
+    :param jobs: the jobs, taken one at a time as workers become free
+    :param owner: the shard backing up the jobs, see shard_owner, or None
+    :return: the results of the jobs, in the order they finished
+
+    See github_backup for the other parameters.
+    """
+    def _backup(job: Job) -> BackupResult:
+        return _backup_repository(job.repository, manifest=manifest,
+                                  force=force, account=job.account,
+                                  repo_type=job.repo_type,
+                                  object_pool=object_pool, journal=journal,
+                                  maintenance=maintenance,
+                                  partial_filter=partial_filter,
+                                  hydration=hydration, retry=retry,
+                                  timeout=timeout,
+                                  stall_timeout=stall_timeout, refs=refs,
+                                  layout=layout, owner=owner)
+
+    results = []
+    try:
+        results = _run_backups(jobs, _backup, max_workers=max_workers,
+                               concurrency=concurrency)
+    finally:
+        # Keep the progress of the repositories done, even if interrupted
+        _save_state(results, manifest, object_pool, run_metrics)
+    return results
+
+
+def _url_owner(git_url: Url) -> typing.Optional[str]:
+    """
+    The owner in a github clone url, e.g. kb-dk in
+    git@github.com:kb-dk/github_cloner.git or
+    https://github.com/kb-dk/github_cloner.git, or None if it has none
+    """
+    match = re.match(r'^[^@/]+@[^:/]+:([^/]+)/[^/]+$', git_url)
+    if match:
+        return match.group(1)
+    parsed = urllib.parse.urlparse(git_url)
+    parts = parsed.path.strip('/').split('/')
+    if parsed.scheme in ('http', 'https', 'ssh', 'git') and len(parts) == 2:
+        return parts[0]
+    return None
+
+
+def _owning_account(repository: Repository, github_name: str,
+                    names: typing.Iterable[str]) -> str:
+    """
+    The account to backup a listed repository for: the account owning it by
+    its clone url if it is one of the accounts backed up, otherwise the
+    account that listed it.
+    """
+    owner = (_url_owner(repository.url) or '').lower()
+    for name in names:
+        if name.lower() == owner:
+            return name
+    return github_name
+
+
+def backup_accounts(accounts: typing.List[typing.Tuple[str, UserType]],
+                    repo_types: typing.Iterable[RepoType] = tuple(RepoType),
+                    priorities: typing.Dict[str, int] = None,
+                    listing_workers: int = 4,
+                    max_workers: int = 1,
+                    cache: HttpCache = None,
+                    session: requests.Session = None,
+                    rate_limiter: RateLimiter = None,
+                    manifest: Manifest = None,
+                    force: bool = False,
+                    largest_first: bool = False,
+                    api_url: Url = API_GITHUB_COM,
+                    run_metrics: RunMetrics = None,
+                    object_pool: ObjectPool = None,
+                    journal: RunJournal = None,
+                    maintenance: Maintenance = None,
+                    partial_filter: str = None,
+                    hydration: Hydration = None,
+                    shard_index: int = 0,
+                    shard_count: int = 1,
+                    listing: str = 'rest',
+                    concurrency: ConcurrencyController = None,
+                    retry: RetryPolicy = None,
+                    timeout: float = None,
+                    stall_timeout: float = None,
+                    refs: RefFilters = None,
+                    repository_filter: RepositoryFilter = None,
+                    layout: Layout = None,
+                    on_listed: typing.Callable[[str, Repository],
+                                               None] = None) -> \
+        typing.Tuple[typing.List[BackupResult], typing.List[str]]:
+    """
+    Backup the repositories of several github users/orgs to current working
+    dir, or to where the layout says, as one pipeline.
+
+    The accounts are listed concurrently, and every repository is put into
+    a single work queue as soon as it is listed. A repository listed by
+    several accounts is backed up once, for the account owning it by its
+    clone url, or else for the first of them in accounts that listed it
+    before it was started, so it is stored in the same place in every run.
+    A mirror an earlier run stored for another account is moved, not
+    cloned again. Repositories of accounts with a
+    higher priority are started first, and within a priority the accounts
+    take turns, so the git work is spread over all of them. An account
+    whose listing fails does not stop the others.
+
+    :param accounts: the github users/orgs to backup, with their UserType
+    :param repo_types: the types of repositories to backup of every account
+    :param priorities: the priority of each account, higher first. Accounts
+        not in it have priority 0
+    :param listing_workers: the number of listings to run concurrently
+    :param largest_first: list all the repositories before starting, and
+        backup the ones expected to take the longest first within each
+        priority, judged by their size and the durations recorded in the
+        manifest
+    :param on_listed: called with the account and every repository listed,
+        including those of other shards and those the filter skips, or None
+    :return: the results of every repository, and a line describing each
+        listing that failed
+
+    See github_backup for the other parameters.
     """
-    repositories = get_github_repositories(github_name, user_type, repo_type)
-    for repository in repositories:
-        fetch_or_clone(repository.url, repository.name + '.git')
+    priorities = priorities or {}
+    listed = []
+    rate = []
+
+    def largest_first_key(job: Job) -> float:
+        # The queue holds the jobs until every listing is done, so the rate
+        # is calibrated on all of them
+        if not rate:
+            rate.append(seconds_per_kb(listed, manifest))
+        return -expected_duration(job.repository, manifest, rate[0])
+
+    names = [github_name for github_name, _ in accounts]
+    queue = WorkQueue(key=largest_first_key if largest_first else None,
+                      hold=largest_first, max_size=MAX_QUEUED_JOBS,
+                      accounts=names)
+    failed_listings = []
+
+    def _list(github_name: str, user_type: UserType, repo_type: RepoType):
+        try:
+            for repository in _list_repositories(
+                    github_name, user_type, repo_type, cache=cache,
+                    session=session, rate_limiter=rate_limiter,
+                    api_url=api_url, run_metrics=run_metrics,
+                    shard_index=shard_index, shard_count=shard_count,
+                    listing=listing, repository_filter=repository_filter,
+                    on_listed=on_listed):
+                account = _owning_account(repository, github_name, names)
+                if queue.put(Job(repository, account, repo_type,
+                                 priorities.get(account, 0))):
+                    listed.append(repository)
+        except (requests.RequestException, GraphQLError) as error:
+            logging.error(M('Failed to list the {0} of {1}: {2}',
+                            repo_type.value, github_name, error))
+            failed_listings.append('{0} of {1}: listing failed: {2}'.format(
+                repo_type.value, github_name, error))
+        finally:
+            queue.producer_done()
+
+    with concurrent.futures.ThreadPoolExecutor(listing_workers) as listings:
+        futures = []
+        for github_name, user_type in accounts:
+            for repo_type in repo_types:
+                queue.add_producer()
+                futures.append(listings.submit(_list, github_name, user_type,
+                                               repo_type))
+        try:
+            results = backup_jobs(
+                queue, max_workers=max_workers, concurrency=concurrency,
+                manifest=manifest, force=force, object_pool=object_pool,
+                journal=journal, maintenance=maintenance,
+                partial_filter=partial_filter, hydration=hydration,
+                retry=retry, timeout=timeout, stall_timeout=stall_timeout,
+                refs=refs, layout=layout,
+                owner=shard_owner(shard_index, shard_count),
+                run_metrics=run_metrics)
+        finally:
+            # Listings blocked on a full queue would keep the executor from
+            # shutting down if the backup stopped early
+            queue.close()
+        for future in futures:
+            # Raise anything but the listing failures handled in _list
+            future.result()
+    _report_skipped(repository_filter, run_metrics)
+    logging.info(M('Backed up {0} repositories of {1} accounts, {2} failed, '
+                   '{3} duplicates skipped', len(results), len(accounts),
+                   sum(1 for result in results if not result.ok),
+                   queue.duplicates))
+    return results, failed_listings
+
+
+def export_bundles(results: typing.Iterable[BackupResult],
+                   exporter: BundleExporter,
+                   layout: Layout = None) -> typing.List[str]:
+    """
+    Export the mirrors that were backed up as incremental bundles. Mirrors
+    whose refs did not change since their last export are left out, and so
+    are partial mirrors until they are complete, as bundling them would
+    fetch the objects they are missing from origin. Mirrors that were
+    skipped as unchanged are only looked at by git if their refs changed
+    after their last snapshot, e.g. when a run was interrupted before the
+    export.
+
+    :param results: the results of the backup
+    :param exporter: the exporter to export with
+    :param layout: the layout the mirrors are stored in. The exports are
+        named by the account, type and name of the mirror, so they do not
+        collide across accounts or move with the fan-out, and exports named
+        by the name of the mirror alone are moved there. If None, they are
+        named by the name of the mirror
+    :return: a line describing each mirror that failed to export
+    """
+    failures = []
+    for result in results:
+        if not result.ok or not os.path.isdir(result.path):
+            continue
+        if not is_complete(result.path):
+            logging.info(M('{0} is a partial mirror, it is exported when it '
+                           'is complete', result.path))
+            continue
+        name = None
+        try:
+            if layout is not None and result.metrics is not None:
+                name = layout.key(result.repository, result.metrics.account,
+                                  RepoType(result.metrics.repo_type))
+                exporter.migrate(result.path, name,
+                                 os.path.basename(result.path))
+            if result.skipped and exporter.is_current(result.path, name):
+                continue
+            exporter.export(result.path, name=name)
+        except OSError as error:
+            logging.error(M('Failed to export {0}: {1}', result.path, error))
+            failures.append('{0}: export failed: {1}'.format(
+                result.path, error))
+        except subprocess.CalledProcessError as error:
+            logging.error(M('Failed to export {0}: {1}\n{2}', result.path,
+                            error, (error.output or b'').decode('utf-8')))
+            failures.append('{0}: export failed: {1}'.format(
+                result.path, error))
+    return failures
+
+
+def _priority(text: str) -> typing.Tuple[str, int]:
+    """Parse an ACCOUNT=PRIORITY command line argument"""
+    account, _, priority = text.rpartition('=')
+    try:
+        return account, int(priority)
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            'expected ACCOUNT=PRIORITY, got {0}'.format(text))
 
 
 def create_parser():
@@ -179,35 +1325,440 @@ def create_parser():
                         help='the log level', dest='loglevel')
     parser.add_argument('--logFile', default='log.log',
                         help='the log file', dest='logfile')
+    parser.add_argument('--output-dir',
+                        help='store the mirrors in <output-dir>/<account>/'
+                             '<repos|gists>/<name>.git instead of <name>.git '
+                             'in the working directory. Mirrors in the old '
+                             'places are moved there', dest='output_dir')
+    parser.add_argument('--fanout', default=0, type=int,
+                        choices=range(MAX_FANOUT + 1),
+                        help='spread the mirrors of an account over this '
+                             'many levels of hashed directories below '
+                             '--output-dir, 256 directories per level',
+                        dest='fanout')
+    parser.add_argument('--jobs', default=1, type=int,
+                        help='the number of repositories to fetch or clone '
+                             'concurrently', dest='jobs')
+    parser.add_argument('--listing-jobs', default=4, type=int,
+                        help='the number of accounts to list concurrently',
+                        dest='listing_jobs')
+    parser.add_argument('--priority', action='append', type=_priority,
+                        metavar='ACCOUNT=PRIORITY',
+                        help='backup the repositories of an account before '
+                             'those of accounts with a lower priority. The '
+                             'default priority is 0', dest='priorities')
+    parser.add_argument('--min-jobs', default=1, type=int,
+                        help='the lowest number of concurrent repositories '
+                             'with --max-jobs', dest='min_jobs')
+    parser.add_argument('--max-jobs', type=int,
+                        help='adapt the number of concurrent repositories to '
+                             'the throughput, latency, failures and disk load '
+                             'between --min-jobs and this, starting at --jobs',
+                        dest='max_jobs')
+    parser.add_argument('--git-timeout', type=float,
+                        help='kill a git clone or fetch after this many '
+                             'seconds', dest='git_timeout')
+    parser.add_argument('--git-stall-timeout', default=600.0, type=float,
+                        help='kill a git clone or fetch that has reported no '
+                             'progress for this many seconds',
+                        dest='git_stall_timeout')
+    parser.add_argument('--include-refs', action='append',
+                        metavar='[ACCOUNT=]PATTERN',
+                        help='fetch only the refs matching this pattern, '
+                             'e.g. refs/heads/*, for all accounts or one '
+                             'account. Defaults to every ref, like git clone '
+                             '--mirror', dest='include_refs')
+    parser.add_argument('--exclude-refs', action='append',
+                        metavar='[ACCOUNT=]PATTERN',
+                        help='do not fetch the refs matching this pattern, '
+                             'e.g. refs/pull/*, for all accounts or one '
+                             'account. Existing mirrors are changed in place',
+                        dest='exclude_refs')
+    parser.add_argument('--filter-config',
+                        help='a JSON file with the filters of the '
+                             'repositories to backup, with the keys include, '
+                             'exclude, forks, archived, min_size, max_size, '
+                             'max_pushed_age and visibility. The options '
+                             'below override it', dest='filter_config')
+    parser.add_argument('--include', action='append', metavar='GLOB',
+                        help='backup only the repositories whose name, or '
+                             'ACCOUNT/NAME if the glob has a /, matches this',
+                        dest='include')
+    parser.add_argument('--exclude', action='append', metavar='GLOB',
+                        help='do not backup the repositories whose name, or '
+                             'ACCOUNT/NAME if the glob has a /, matches this',
+                        dest='exclude')
+    parser.add_argument('--forks', choices=FORK_MODES,
+                        help='backup forks (include), no forks (exclude), '
+                             'only forks, or only the forks pushed to since '
+                             'they were made (modified)', dest='forks')
+    parser.add_argument('--archived', choices=ARCHIVED_MODES,
+                        help='backup archived repositories (include), no '
+                             'archived repositories (exclude) or only them',
+                        dest='archived')
+    parser.add_argument('--min-size', type=int, metavar='KB',
+                        help='do not backup repositories smaller than this, '
+                             'as reported by github', dest='min_size')
+    parser.add_argument('--max-size', type=int, metavar='KB',
+                        help='do not backup repositories larger than this, '
+                             'as reported by github', dest='max_size')
+    parser.add_argument('--max-pushed-age', type=float, metavar='DAYS',
+                        help='do not backup repositories that have not been '
+                             'pushed to for this many days',
+                        dest='max_pushed_age')
+    parser.add_argument('--visibility', action='append',
+                        choices=('public', 'private', 'internal', 'secret'),
+                        help='backup only the repositories and gists with '
+                             'this visibility', dest='visibility')
+    parser.add_argument('--git-retries', default=2, type=int,
+                        help='the number of times to retry a clone or fetch '
+                             'that failed on a network error',
+                        dest='git_retries')
+    parser.add_argument('--git-retry-backoff', default=10.0, type=float,
+                        help='the seconds to wait before the first retry of '
+                             'a clone or fetch, doubling with every retry',
+                        dest='git_retry_backoff')
+    parser.add_argument('--manifest',
+                        help='the file recording the state of previous '
+                             'backups, used to skip unchanged repositories. '
+                             'Defaults to github_cloner_manifest.json, with '
+                             'the shard in the name when sharded',
+                        dest='manifest')
+    parser.add_argument('--ls-remote', action='store_true',
+                        help='compare the refs with git ls-remote when github '
+                             'does not tell if a repository has changed',
+                        dest='ls_remote')
+    parser.add_argument('--force-full', action='store_true',
+                        help='fetch every repository, even the unchanged ones',
+                        dest='force_full')
+    parser.add_argument('--largest-first', action='store_true',
+                        help='list all repositories before starting, and '
+                             'backup the largest and slowest ones first',
+                        dest='largest_first')
+    parser.add_argument('--api-url', default=API_GITHUB_COM,
+                        help='the base url of the github API',
+                        dest='api_url')
+    parser.add_argument('--object-pool',
+                        help='share the objects of forks of the same '
+                             'upstream through pool repositories in this '
+                             'directory', dest='object_pool')
+    parser.add_argument('--journal',
+                        help='the journal of the run. If a run is '
+                             'interrupted, the next run resumes from it. '
+                             'Defaults to github_cloner_journal.jsonl, with '
+                             'the shard in the name when sharded',
+                        dest='journal')
+    parser.add_argument('--no-resume', action='store_true',
+                        help='start over instead of resuming an interrupted '
+                             'run', dest='no_resume')
+    parser.add_argument('--maintenance-budget', default=600.0, type=float,
+                        help='the time to spend repacking and writing '
+                             'commit-graphs after fetching, in seconds per '
+                             'run. 0 disables maintenance',
+                        dest='maintenance_budget')
+    parser.add_argument('--max-packs', default=50, type=int,
+                        help='the number of packs in a mirror that triggers '
+                             'a repack', dest='max_packs')
+    parser.add_argument('--max-loose-objects', default=1000, type=int,
+                        help='the number of loose objects in a mirror that '
+                             'triggers packing them', dest='max_loose_objects')
+    parser.add_argument('--partial-clone', metavar='FILTER',
+                        help='seed new mirrors as partial clones with this '
+                             'filter, e.g. blob:none or blob:limit=1m',
+                        dest='partial_clone')
+    parser.add_argument('--hydration-budget', default=600.0, type=float,
+                        help='the time to spend fetching the objects partial '
+                             'mirrors are missing, in seconds per run, with '
+                             '--partial-clone',
+                        dest='hydration_budget')
+    parser.add_argument('--hydration-batch', default=1000, type=int,
+                        help='the number of missing objects to fetch at a '
+                             'time', dest='hydration_batch')
+    parser.add_argument('--export-dir',
+                        help='after the backup, export the changes to every '
+                             'mirror as an incremental git bundle with an '
+                             'index in this directory', dest='export_dir')
+    parser.add_argument('--watch', action='store_true',
+                        help='keep running, fetching the repositories the '
+                             'events feeds or webhooks report as pushed to, '
+                             'with a full sweep every --sweep-interval',
+                        dest='watch')
+    parser.add_argument('--sweep-interval', default=6 * 60 * 60, type=float,
+                        help='the seconds between full sweeps in watch mode',
+                        dest='sweep_interval')
+    parser.add_argument('--poll-interval', default=60.0, type=float,
+                        help='the fewest seconds between polls of the events '
+                             'feeds, github may ask for more',
+                        dest='poll_interval')
+    parser.add_argument('--debounce', default=30.0, type=float,
+                        help='the seconds a repository must be quiet before '
+                             'it is fetched in watch mode', dest='debounce')
+    parser.add_argument('--webhook-port', type=int,
+                        help='listen for github push webhooks on this port '
+                             'in watch mode', dest='webhook_port')
+    parser.add_argument('--webhook-host', default='127.0.0.1',
+                        help='the address to listen for webhooks on',
+                        dest='webhook_host')
+    parser.add_argument('--webhook-secret',
+                        default=os.environ.get('GITHUB_WEBHOOK_SECRET'),
+                        help='the secret the webhooks are signed with, '
+                             'defaults to $GITHUB_WEBHOOK_SECRET',
+                        dest='webhook_secret')
+    parser.add_argument('--report',
+                        help='write a JSON report of the run to this file',
+                        dest='report')
+    parser.add_argument('--prometheus-textfile',
+                        help='write the metrics of the run to this file, for '
+                             'the node exporter textfile collector',
+                        dest='prometheus_textfile')
+    parser.add_argument('--shard-index', default=0, type=int,
+                        help='the shard of the repositories this host backs '
+                             'up, from 0 to shard-count - 1',
+                        dest='shard_index')
+    parser.add_argument('--shard-count', default=1, type=int,
+                        help='the number of hosts sharing the backup',
+                        dest='shard_count')
+    parser.add_argument('--listing', default='rest',
+                        choices=LISTING_BACKENDS,
+                        help='the github API to list repositories with. '
+                             'graphql needs a token, and gists are always '
+                             'listed with rest', dest='listing')
+    parser.add_argument('--token', default=os.environ.get('GITHUB_TOKEN'),
+                        help='the github token to authenticate with, '
+                             'defaults to $GITHUB_TOKEN', dest='token')
+    parser.add_argument('--pool-size', default=10, type=int,
+                        help='the number of HTTP connections to keep open to '
+                             'the github API', dest='pool_size')
+    parser.add_argument('--timeout', default=30.0, type=float,
+                        help='the timeout of github API requests, in seconds',
+                        dest='timeout')
+    parser.add_argument('--max-retries', default=5, type=int,
+                        help='the number of times a rate limited github API '
+                             'request is retried', dest='max_retries')
+    parser.add_argument('--cache-dir',
+                        default=os.path.join(os.path.expanduser('~'),
+                                             '.cache', 'github_cloner'),
+                        help='the directory to cache github API responses in',
+                        dest='cache_dir')
+    parser.add_argument('--cache-max-age', default=7 * 24 * 60 * 60,
+                        type=float,
+                        help='the maximum age of a cached response, in '
+                             'seconds', dest='cache_max_age')
+    parser.add_argument('--cache-max-size', default=100 * 1024 * 1024,
+                        type=int,
+                        help='the maximum size of the response cache, in '
+                             'bytes', dest='cache_max_size')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='bypass the response cache and download every '
+                             'page', dest='no_cache')
     return parser
 
 
+def _watch(args: argparse.Namespace,
+           accounts: typing.List[typing.Tuple[str, UserType]],
+           sweep: typing.Callable, fetch: typing.Callable,
+           exporter: typing.Optional[BundleExporter],
+           get: typing.Callable,
+           layout: Layout = None) -> int:
+    """
+    Run the watch mode until SIGTERM or SIGINT.
+
+    :param args: the command line arguments
+    :param accounts: the github users/orgs to watch, with their UserType
+    :param sweep: backs up all the accounts, see backup_accounts
+    :param fetch: backs up a list of jobs, see backup_jobs
+    :param exporter: the exporter of the changed mirrors, or None
+    :param get: the function polling the events feeds
+    :param layout: the layout the mirrors are stored in, or None
+    :return: the exit status
+    """
+    def _backed_up(results: typing.List[BackupResult],
+                   failed_listings: typing.List[str] = ()):
+        failures = list(failed_listings) + summarise_failures(results)
+        if exporter is not None:
+            failures += export_bundles(results, exporter, layout)
+        if failures:
+            logging.error(M('{0} failures:\n{1}', len(failures),
+                            '\n'.join(failures)))
+
+    def _sweep() -> typing.List[BackupResult]:
+        results, failed_listings = sweep(on_listed=watcher.listed)
+        _backed_up(results, failed_listings)
+        return results
+
+    def _fetch(jobs: typing.List[Job]) -> typing.List[BackupResult]:
+        results = fetch(jobs)
+        _backed_up(results)
+        return results
+
+    pollers = [EventPoller(github_name, user_type, args.api_url, get=get)
+               for github_name, user_type in accounts]
+    watcher = Watcher(_sweep, _fetch, pollers,
+                      sweep_interval=args.sweep_interval,
+                      min_poll_interval=args.poll_interval,
+                      debounce=args.debounce)
+    webhook = None
+    if args.webhook_port is not None:
+        webhook = WebhookServer(watcher.changed, host=args.webhook_host,
+                                port=args.webhook_port,
+                                secret=args.webhook_secret).start()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: watcher.stop())
+    try:
+        watcher.run()
+    finally:
+        if webhook is not None:
+            webhook.stop()
+    logging.info('Stopped watching')
+    return 0
+
+
 def main():
     """
     Parse command line args and backup the github repos
 
-    :param argv: the command line arguments
-    :return: None
+    Every repository is attempted, even when some fail, and the failures
+    are summarised in the log at the end.
+
+    :return: the exit status, 1 if any repository or listing failed
     """
     parser = create_parser()
 
     args = parser.parse_args(sys.argv[1:])
+    if not 0 <= args.shard_index < args.shard_count:
+        parser.error('--shard-index must be between 0 and --shard-count - 1')
+    if args.max_jobs is not None and \
+            not 1 <= args.min_jobs <= args.max_jobs:
+        parser.error('--min-jobs must be between 1 and --max-jobs')
+    if args.fanout and args.output_dir is None:
+        parser.error('--fanout needs --output-dir')
 
     logging.basicConfig(filename=args.logfile,
-                        level=getattr(logging, args.loglevel.upper()))
+                        level=getattr(logging, args.loglevel.upper()),
+                        format='%(asctime)s %(threadName)s %(levelname)s '
+                               '%(name)s: %(message)s')
+
+    cache = None
+    if not args.no_cache:
+        cache = HttpCache(args.cache_dir, max_age=args.cache_max_age,
+                          max_size=args.cache_max_size)
+    session = GithubSession(token=args.token, pool_size=args.pool_size,
+                            timeout=args.timeout)
+    rate_limiter = RateLimiter(max_retries=args.max_retries)
+    # Hosts sharing the directories each keep their own manifest and journal
+    owner = shard_owner(args.shard_index, args.shard_count)
+    manifest_path = args.manifest or shard_file(
+        'github_cloner_manifest.json', args.shard_index, args.shard_count)
+    journal_path = args.journal or shard_file(
+        'github_cloner_journal.jsonl', args.shard_index, args.shard_count)
+    manifest = Manifest(manifest_path, ls_remote=args.ls_remote)
+    run_metrics = RunMetrics()
+    layout = None
+    output_dir = '.'
+    if args.output_dir is not None:
+        layout = Layout(args.output_dir, fanout=args.fanout)
+        output_dir = layout.root
+        os.makedirs(output_dir, exist_ok=True)
+    remove_partial_clones(layout=layout, owner=owner)
+    hydration = None
+    if args.partial_clone and args.hydration_budget > 0:
+        hydration = Hydration(budget=args.hydration_budget,
+                              batch_size=args.hydration_batch)
+    maintenance = None
+    if args.maintenance_budget > 0:
+        maintenance = Maintenance(budget=args.maintenance_budget,
+                                  max_packs=args.max_packs,
+                                  max_loose=args.max_loose_objects)
+    object_pool = None
+    if args.object_pool:
+        find_source = functools.partial(
+            get_source_url, cache=cache, session=session,
+            rate_limiter=rate_limiter, api_url=args.api_url)
+        object_pool = ObjectPool(args.object_pool, find_source=find_source)
+    concurrency = None
+    if args.max_jobs is not None:
+        concurrency = ConcurrencyController(min_workers=args.min_jobs,
+                                            max_workers=args.max_jobs,
+                                            initial=args.jobs,
+                                            disk=DiskUtilisation(output_dir))
+
+    try:
+        refs = RefFilters.parse(args.include_refs, args.exclude_refs)
+    except ValueError as error:
+        parser.error(str(error))
+    try:
+        repository_filter = RepositoryFilter.from_settings(
+            args.filter_config, include=args.include, exclude=args.exclude,
+            forks=args.forks, archived=args.archived,
+            min_size=args.min_size, max_size=args.max_size,
+            max_pushed_age=args.max_pushed_age, visibility=args.visibility)
+    except (OSError, ValueError, TypeError) as error:
+        parser.error('Invalid repository filters: {0}'.format(error))
+    if repository_filter.is_empty:
+        repository_filter = None
+    retry = RetryPolicy(max_retries=args.git_retries,
+                        backoff=args.git_retry_backoff)
+
+    accounts = [(org, UserType.ORG) for org in args.orgs or []] + \
+               [(user, UserType.USER) for user in args.users or []]
+    exporter = BundleExporter(args.export_dir) if args.export_dir else None
+    sweep = functools.partial(
+        backup_accounts, accounts, priorities=dict(args.priorities or []),
+        listing_workers=args.listing_jobs, max_workers=args.jobs,
+        cache=cache, session=session, rate_limiter=rate_limiter,
+        manifest=manifest, force=args.force_full,
+        largest_first=args.largest_first, api_url=args.api_url,
+        object_pool=object_pool, maintenance=maintenance,
+        partial_filter=args.partial_clone, hydration=hydration,
+        shard_index=args.shard_index, shard_count=args.shard_count,
+        listing=args.listing, concurrency=concurrency, retry=retry,
+        timeout=args.git_timeout, stall_timeout=args.git_stall_timeout,
+        refs=refs, repository_filter=repository_filter, layout=layout)
+
+    if args.watch:
+        # The events name the repositories pushed to, so fetch them whatever
+        # the manifest says
+        fetch = functools.partial(
+            backup_jobs, max_workers=args.jobs, concurrency=concurrency,
+            manifest=manifest, force=True, object_pool=object_pool,
+            maintenance=maintenance, partial_filter=args.partial_clone,
+            hydration=hydration, retry=retry, timeout=args.git_timeout,
+            stall_timeout=args.git_stall_timeout, refs=refs, layout=layout,
+            owner=owner)
+        status = _watch(args, accounts, sweep, fetch, exporter,
+                        functools.partial(rate_limiter.get, get=session.get),
+                        layout=layout)
+        session.close()
+        logging.shutdown()
+        return status
+
+    journal = RunJournal(journal_path, resume=not args.no_resume)
+    results, failed_listings = sweep(journal=journal,
+                                     run_metrics=run_metrics)
+
+    export_failures = []
+    if exporter is not None:
+        export_failures = export_bundles(results, exporter, layout)
 
-    for org in args.orgs or []:
-        for repoType in RepoType:
-            github_backup(github_name=org, user_type=UserType.ORG,
-                          repo_type=repoType)
-    for user in args.users or []:
-        for repoType in RepoType:
-            github_backup(github_name=user, user_type=UserType.USER,
-                          repo_type=repoType)
+    journal.complete()
+    run_metrics.finish()
+    if args.report:
+        run_metrics.write_json(args.report)
+    if args.prometheus_textfile:
+        run_metrics.write_prometheus(args.prometheus_textfile)
+    rate_limiter.log_report()
+    session.log_connection_stats()
+    session.close()
 
+    failures = failed_listings + summarise_failures(results) + \
+        export_failures
+    if failures:
+        logging.error(M('{0} failures in the run:\n{1}', len(failures),
+                        '\n'.join(failures)))
     logging.shutdown()
+    return 1 if failures else 0
 
 
 # action
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
@@ -0,0 +1,221 @@
+"""Running git with its output streamed: progress is parsed and logged while
+git runs, hung transfers are killed, and only the tail of the output is
+kept for error reports."""
+
+import collections
+import logging
+import os
+import re
+import signal
+import subprocess
+import threading
+import time
+import typing
+
+from statsbiblioteket.github_cloner.messages import M
+
+# A progress line of git, e.g.
+# Receiving objects:  45% (450/1000), 1.20 MiB | 600.00 KiB/s
+_PROGRESS = re.compile(
+    r'^(?:remote: )?(?P<phase>[A-Za-z ]+):\s+(?P<percent>\d+)% '
+    r'\((?P<done>\d+)/(?P<total>\d+)\)'
+    r'(?:, (?P<size>[\d.]+) (?P<unit>bytes|[KMGT]iB)'
+    r'(?: \| (?P<rate>[\d.]+) (?P<rate_unit>bytes|[KMGT]iB)/s)?)?')
+
+_UNITS = {'bytes': 1, 'KiB': 1024, 'MiB': 1024 ** 2, 'GiB': 1024 ** 3,
+          'TiB': 1024 ** 4}
+
+
+class GitStalled(subprocess.TimeoutExpired):
+    """git wrote nothing for the stall timeout, and was killed"""
+
+    def __str__(self):
+        return 'Command {0!r} stalled for {1} seconds'.format(self.cmd,
+                                                              self.timeout)
+
+
+class GitProgress(object):
+    """
+    The progress of a git transfer, parsed from the progress lines of git.
+
+    phase is the phase of the last progress line, e.g. 'Receiving objects',
+    with its percent and objects done out of total_objects.
+    received_objects, received_bytes and rate (in bytes/s) are from the
+    'Receiving objects' phase.
+    """
+
+    def __init__(self):
+        self.phase = None
+        self.percent = None
+        self.objects = None
+        self.total_objects = None
+        self.received_objects = 0
+        self.received_bytes = 0
+        self.rate = None
+
+    def update(self, line: str) -> bool:
+        """
+        Update the progress from a line of git output.
+
+        :param line: the line
+        :return: False if the line was not a progress line
+        """
+        match = _PROGRESS.match(line.strip())
+        if match is None:
+            return False
+        self.phase = match.group('phase')
+        self.percent = int(match.group('percent'))
+        self.objects = int(match.group('done'))
+        self.total_objects = int(match.group('total'))
+        if self.phase == 'Receiving objects':
+            self.received_objects = self.objects
+            if match.group('size'):
+                self.received_bytes = int(float(match.group('size')) *
+                                          _UNITS[match.group('unit')])
+            if match.group('rate'):
+                self.rate = float(match.group('rate')) * \
+                    _UNITS[match.group('rate_unit')]
+        return True
+
+    def __str__(self):
+        if self.phase is None:
+            return 'no progress yet'
+        text = '{0} {1}% ({2}/{3})'.format(self.phase, self.percent,
+                                           self.objects, self.total_objects)
+        if self.received_bytes:
+            text += ', {0:.1f} MiB received'.format(
+                self.received_bytes / 1024 ** 2)
+        if self.rate is not None:
+            text += ' at {0:.1f} KiB/s'.format(self.rate / 1024)
+        return text
+
+
+class _OutputBuffer(object):
+    """The last lines of the output of git, with progress lines collapsed"""
+
+    def __init__(self, max_lines: int):
+        self.lines = collections.deque(maxlen=max_lines)
+        self._partial = b''
+        self._last_was_progress = False
+
+    def feed(self, data: bytes) -> typing.List[str]:
+        """
+        :param data: the next output of git
+        :return: the lines completed by data
+        """
+        data = self._partial + data
+        completed = []
+        start = 0
+        for match in re.finditer(b'[\r\n]', data):
+            line = data[start:match.start()]
+            start = match.end()
+            # Progress is redrawn in place with \r, keep only its last state
+            if self._last_was_progress and self.lines:
+                self.lines.pop()
+            self.lines.append(line)
+            self._last_was_progress = match.group() == b'\r'
+            completed.append(line.decode('utf-8', errors='replace'))
+        self._partial = data[start:]
+        return completed
+
+    def output(self) -> bytes:
+        lines = list(self.lines)
+        if self._partial:
+            lines.append(self._partial)
+        return b'\n'.join(lines)
+
+
+def _kill(process: subprocess.Popen):
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+def run_git(command: typing.List[str], description: str = None,
+            timeout: float = None, stall_timeout: float = None,
+            progress_interval: float = 60.0, max_lines: int = 100,
+            progress: GitProgress = None) -> bytes:
+    """
+    Run git, streaming its output.
+
+    The progress lines are parsed as they arrive, and the progress is
+    logged every progress_interval seconds. Only the last max_lines lines of
+    the output are kept.
+
+    :param command: the git command line. Add --progress to make git report
+        progress when it is not writing to a terminal
+    :param description: what git works on, for the log
+    :param timeout: kill git after this many seconds, or None to wait for it
+    :param stall_timeout: kill git when it has written nothing for this
+        many seconds, or None to wait for it
+    :param progress_interval: the seconds between progress logs
+    :param max_lines: the number of lines of output to keep
+    :param progress: the progress to update, or None
+    :return: the last lines of the combined stdout and stderr of git
+    :raises subprocess.CalledProcessError: If the git process failed
+    :raises subprocess.TimeoutExpired: If the git process timed out
+    :raises GitStalled: If the git process stalled
+    """
+    description = description or ' '.join(command)
+    progress = progress if progress is not None else GitProgress()
+    buffer = _OutputBuffer(max_lines)
+    # In its own process group, so the helpers git starts, like
+    # git-remote-https, are killed with it and release the output pipe
+    process = subprocess.Popen(command, stdout=subprocess.PIPE,
+                               stderr=subprocess.STDOUT,
+                               start_new_session=True)
+    started = time.monotonic()
+    state = {'last_output': started, 'killed': None}
+    finished = threading.Event()
+
+    def _watch():
+        next_log = started + progress_interval
+        interval = min([1.0] + [limit for limit in (timeout, stall_timeout)
+                                if limit is not None])
+        while not finished.wait(interval):
+            now = time.monotonic()
+            if timeout is not None and now - started > timeout:
+                state['killed'] = 'timeout'
+            elif stall_timeout is not None and \
+                    now - state['last_output'] > stall_timeout:
+                state['killed'] = 'stalled'
+            if state['killed']:
+                logging.warning(M('Killing git for {0}, it {1}', description,
+                                  'timed out' if state['killed'] ==
+                                  'timeout' else 'stalled'))
+                _kill(process)
+                return
+            if now >= next_log:
+                logging.info(M('{0}: {1}', description, progress))
+                next_log = now + progress_interval
+
+    watcher = threading.Thread(target=_watch, daemon=True,
+                               name=threading.current_thread().name +
+                               '-watch')
+    watcher.start()
+    try:
+        while True:
+            data = process.stdout.read1(64 * 1024)
+            if not data:
+                break
+            state['last_output'] = time.monotonic()
+            for line in buffer.feed(data):
+                progress.update(line)
+        returncode = process.wait()
+    finally:
+        finished.set()
+        if process.poll() is None:
+            _kill(process)
+            process.wait()
+        process.stdout.close()
+        watcher.join()
+
+    output = buffer.output()
+    if state['killed'] == 'timeout':
+        raise subprocess.TimeoutExpired(command, timeout, output=output)
+    if state['killed'] == 'stalled':
+        raise GitStalled(command, stall_timeout, output=output)
+    if returncode:
+        raise subprocess.CalledProcessError(returncode, command, output)
+    return output
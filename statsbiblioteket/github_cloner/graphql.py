@@ -0,0 +1,105 @@
+"""A listing backend using the github GraphQL API, which fetches only the
+fields the cloner needs."""
+
+import logging
+import typing
+
+import requests
+
+from statsbiblioteket.github_cloner.messages import M
+from statsbiblioteket.github_cloner.myTypes import Repository, Url
+
+REPOSITORIES_QUERY = '''
+query($login: String!, $first: Int!, $cursor: String) {
+  repositoryOwner(login: $login) {
+    repositories(first: $first, after: $cursor,
+                 ownerAffiliations: [OWNER]) {
+      pageInfo { hasNextPage endCursor }
+      nodes {
+        databaseId name description sshUrl diskUsage pushedAt updatedAt
+        isFork isArchived parent { nameWithOwner } createdAt visibility
+      }
+    }
+  }
+}
+'''
+
+
+class GraphQLError(Exception):
+    """The github GraphQL API answered with errors"""
+
+    def __init__(self, errors: typing.List[dict]):
+        super().__init__('; '.join(error.get('message', str(error))
+                                   for error in errors))
+        self.errors = errors
+
+
+def parse_graphql_repository(node: dict) -> Repository:
+    """
+    Parse a repository node from the GraphQL API into a Repository.
+
+    :param node: the repository node
+    :return: the Repository
+    """
+    parent = node.get('parent')
+    visibility = node.get('visibility')
+    return Repository(name=node['name'],
+                      description=node['description'] or "(no description)",
+                      url=node['sshUrl'],
+                      size=node.get('diskUsage'),
+                      pushed_at=node.get('pushedAt'),
+                      updated_at=node.get('updatedAt'),
+                      fork=node.get('isFork'),
+                      archived=node.get('isArchived'),
+                      source=parent['nameWithOwner'] if parent else None,
+                      id=node.get('databaseId'),
+                      created_at=node.get('createdAt'),
+                      visibility=visibility.lower() if visibility else None)
+
+
+def iter_graphql_repositories(github_name: str, api_url: Url,
+                              batch_size: int = 100,
+                              post: typing.Callable = requests.post) -> \
+        typing.Iterator[Repository]:
+    """
+    Iterate over the repositories of a github user/org using the GraphQL
+    API, yielding each page of repositories as soon as it has arrived.
+
+    The GraphQL API requires authentication, so post should come from a
+    session with a token.
+
+    :param github_name: The name of the organisation/user on github
+    :param api_url: the base url of the github API. The GraphQL endpoint is
+        api_url + '/graphql'
+    :param batch_size: the number of repositories per page, at most 100
+    :param post: the function performing the POST requests
+    :return: an iterator of Repository objects
+    :raises requests.HTTPError: If github refused the query
+    :raises GraphQLError: If github answered the query with errors
+    """
+    graphql_url = api_url + '/graphql'
+    cursor = None
+    count = 0
+    while True:
+        response = post(graphql_url,
+                        json={'query': REPOSITORIES_QUERY,
+                              'variables': {'login': github_name,
+                                            'first': batch_size,
+                                            'cursor': cursor}})
+        response.raise_for_status()
+        body = response.json()
+        if body.get('errors'):
+            raise GraphQLError(body['errors'])
+        owner = body['data']['repositoryOwner']
+        if owner is None:
+            raise GraphQLError([{'message': 'Could not resolve to a '
+                                            'repository owner with the '
+                                            'login of ' + github_name}])
+        repositories = owner['repositories']
+        count += len(repositories['nodes'])
+        logging.debug(M('We now have {0} repositories from GraphQL', count))
+        for node in repositories['nodes']:
+            yield parse_graphql_repository(node)
+        if not repositories['pageInfo']['hasNextPage']:
+            return
+        cursor = repositories['pageInfo']['endCursor']
@@ -0,0 +1,97 @@
+"""A journal of the repositories finished in a backup run, so an interrupted
+run can be resumed."""
+
+import json
+import logging
+import os
+import threading
+
+from statsbiblioteket.github_cloner.messages import M
+from statsbiblioteket.github_cloner.myTypes import Path, Url
+
+
+class RunJournal(object):
+    """
+    An append-only journal of a backup run.
+
+    Every repository is journaled when its backup starts and when it is
+    done. The journal is flushed to disk after every entry, and removed when
+    the run completes. If a run is killed, the journal is left behind, and
+    the next run skips the repositories the journal records as done.
+    """
+
+    def __init__(self, path: Path, resume: bool = True):
+        """
+        The journal of a backup run.
+
+        :param path: the file to journal to
+        :param resume: resume the run recorded in an existing journal. If
+            False, an existing journal is discarded
+        """
+        self.path = path
+        self.done = set()
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            if resume:
+                self._load()
+                logging.info(M('Resuming the interrupted run in {0}, {1} '
+                               'repositories are already done', path,
+                               len(self.done)))
+            else:
+                os.remove(path)
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def _load(self):
+        with open(self.path, encoding='utf-8') as journal_file:
+            for line in journal_file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # The last line may be torn if the run was killed
+                    continue
+                if entry.get('event') == 'done':
+                    self.done.add(entry['url'])
+
+    def _append(self, event: str, url: Url):
+        with self._lock:
+            self._file.write(json.dumps({'event': event, 'url': url}) + '\n')
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def is_done(self, url: Url) -> bool:
+        """
+        :param url: the clone url of a repository
+        :return: True if the repository was finished earlier in this run
+        """
+        with self._lock:
+            return url in self.done
+
+    def started(self, url: Url):
+        """
+        Journal that the backup of a repository has started.
+
+        :param url: the clone url of the repository
+        """
+        self._append('started', url)
+
+    def finished(self, url: Url):
+        """
+        Journal that the backup of a repository is done.
+
+        :param url: the clone url of the repository
+        """
+        self._append('done', url)
+        with self._lock:
+            self.done.add(url)
+
+    def complete(self):
+        """Mark the run as complete, removing the journal"""
+        with self._lock:
+            self._file.close()
+            os.remove(self.path)
+        logging.debug(M('Run complete, removed the journal {0}', self.path))
+
+    def close(self):
+        """Close the journal, keeping it for the next run to resume"""
+        with self._lock:
+            self._file.close()
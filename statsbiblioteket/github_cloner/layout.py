@@ -0,0 +1,173 @@
+"""The layout of the mirrors on disk: a namespace per account and type below
+an output root, optionally spread over hashed fan-out directories so no
+directory holds tens of thousands of mirrors."""
+
+import hashlib
+import logging
+import os
+import re
+import subprocess
+import threading
+import typing
+
+from statsbiblioteket.github_cloner.messages import M
+from statsbiblioteket.github_cloner.myTypes import Path, RepoType, Repository
+
+# The most fan-out levels, each level is two hex digits, 256 directories
+MAX_FANOUT = 3
+
+_FANOUT_PATTERN = re.compile(r'^[0-9a-f]{2}$')
+
+
+def _origin_url(repository_path: Path) -> typing.Optional[str]:
+    """The url of the origin remote of a mirror, or None"""
+    try:
+        output = subprocess.check_output(
+            ['git', '-C', repository_path, 'config', '--get',
+             'remote.origin.url'], stderr=subprocess.DEVNULL)
+    except subprocess.CalledProcessError:
+        return None
+    return output.decode('utf-8').strip()
+
+
+class Layout(object):
+    """
+    Where the mirrors are stored.
+
+    A mirror is stored in root/<account>/<type>/<name>.git, e.g.
+    root/kb-dk/repos/github_cloner.git, or with fan-out levels below the
+    type, root/kb-dk/repos/3f/github_cloner.git, where 3f are the first hex
+    digits of the sha1 of the name.
+
+    Mirrors found where an earlier layout put them, flat in the root or in
+    the working directory, or with another number of fan-out levels, or in
+    the namespace of another account that listed the same repository, are
+    moved to their place by renaming, never by cloning them again. A mirror
+    is only moved if its origin is the url of the repository, so a mirror of
+    another account's repository of the same name is left alone.
+    """
+
+    def __init__(self, root: Path = '.', fanout: int = 0):
+        """
+        A layout of the mirrors.
+
+        :param root: the directory the mirrors are stored below
+        :param fanout: the number of hashed directory levels below the
+            account and type, from 0 to MAX_FANOUT
+        :raises ValueError: If fanout is out of range
+        """
+        if not 0 <= fanout <= MAX_FANOUT:
+            raise ValueError('fanout must be between 0 and {0}, not '
+                             '{1}'.format(MAX_FANOUT, fanout))
+        self.root = os.path.abspath(root)
+        self.fanout = fanout
+        self._lock = threading.Lock()
+
+    def key(self, repository: Repository, account: str,
+            repo_type: RepoType) -> Path:
+        """
+        The name of a mirror that does not change with the fan-out.
+
+        :param repository: the repository
+        :param account: the github user/org the repository was listed for
+        :param repo_type: enum REPO or GIST
+        :return: the relative path <account>/<type>/<name>.git
+        """
+        return os.path.join(account, repo_type.value,
+                            str(repository.name) + '.git')
+
+    def _path(self, repository: Repository, account: str,
+              repo_type: RepoType, fanout: int) -> Path:
+        name = str(repository.name)
+        digest = hashlib.sha1(name.encode('utf-8')).hexdigest()
+        levels = [digest[2 * level:2 * level + 2] for level in range(fanout)]
+        return os.path.join(self.root, account, repo_type.value,
+                            *(levels + [name + '.git']))
+
+    def path(self, repository: Repository, account: str,
+             repo_type: RepoType) -> Path:
+        """
+        :param repository: the repository
+        :param account: the github user/org the repository was listed for
+        :param repo_type: enum REPO or GIST
+        :return: the path of the mirror of the repository
+        """
+        return self._path(repository, account, repo_type, self.fanout)
+
+    def directories(self) -> typing.Iterator[Path]:
+        """
+        The directories mirrors can be stored in: the root, for the flat
+        layout, the namespaces of the accounts and types, and their fan-out
+        directories at any depth.
+
+        :return: an iterator of the directories that exist
+        """
+        def _fanout(directory: Path, depth: int) -> typing.Iterator[Path]:
+            yield directory
+            if depth == 0:
+                return
+            for name in sorted(os.listdir(directory)):
+                path = os.path.join(directory, name)
+                if _FANOUT_PATTERN.match(name) and os.path.isdir(path):
+                    for below in _fanout(path, depth - 1):
+                        yield below
+
+        if not os.path.isdir(self.root):
+            return
+        yield self.root
+        for account in sorted(os.listdir(self.root)):
+            if account.startswith('.') or account.endswith('.git'):
+                continue
+            for repo_type in RepoType:
+                namespace = os.path.join(self.root, account, repo_type.value)
+                if os.path.isdir(namespace):
+                    for directory in _fanout(namespace, MAX_FANOUT):
+                        yield directory
+
+    def _old_paths(self, repository: Repository, account: str,
+                   repo_type: RepoType) -> typing.List[Path]:
+        flat = str(repository.name) + '.git'
+        paths = [os.path.join(self.root, flat), os.path.abspath(flat)]
+        paths += [self._path(repository, account, repo_type, fanout)
+                  for fanout in range(MAX_FANOUT + 1)
+                  if fanout != self.fanout]
+        if os.path.isdir(self.root):
+            for other in sorted(os.listdir(self.root)):
+                if other == account or other.startswith('.') or \
+                        other.endswith('.git') or not os.path.isdir(
+                            os.path.join(self.root, other, repo_type.value)):
+                    continue
+                paths += [self._path(repository, other, repo_type, fanout)
+                          for fanout in range(MAX_FANOUT + 1)]
+        return paths
+
+    def migrate(self, repository: Repository, account: str,
+                repo_type: RepoType) -> Path:
+        """
+        Move the mirror of a repository from where an earlier layout put it,
+        if it is not in its place already.
+
+        :param repository: the repository
+        :param account: the github user/org the repository was listed for
+        :param repo_type: enum REPO or GIST
+        :return: the path of the mirror of the repository
+        :raises OSError: If the mirror could not be moved
+        """
+        path = self.path(repository, account, repo_type)
+        if os.path.exists(path):
+            return path
+        # The flat layouts are shared by all accounts, so two accounts must
+        # not move the same mirror at once
+        with self._lock:
+            for old_path in self._old_paths(repository, account, repo_type):
+                if old_path == path or not os.path.isdir(old_path):
+                    continue
+                if _origin_url(old_path) != repository.url:
+                    logging.debug(M('{0} is not a mirror of {1}, leaving it',
+                                    old_path, repository.url))
+                    continue
+                logging.info(M('Moving {0} to {1}', old_path, path))
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.rename(old_path, path)
+                break
+        return path
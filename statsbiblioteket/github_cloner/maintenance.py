@@ -0,0 +1,127 @@
+"""Maintenance of the mirrors after they have been fetched, so repeated
+fetches do not pile up packs and loose objects."""
+
+import logging
+import os
+import subprocess
+import threading
+import time
+import typing
+
+from statsbiblioteket.github_cloner.messages import M
+from statsbiblioteket.github_cloner.myTypes import Path
+
+
+def count_objects(repository_path: Path) -> typing.Dict[str, int]:
+    """
+    The object statistics of a repository, from git count-objects -v.
+
+    :param repository_path: the path of the repository
+    :return: a dict with the keys of git count-objects -v, e.g. 'count' (the
+        number of loose objects) and 'packs'
+    :raises subprocess.CalledProcessError: If git count-objects failed
+    """
+    output = subprocess.check_output(
+        ['git', '-C', repository_path, 'count-objects', '-v'],
+        stderr=subprocess.STDOUT)
+    stats = {}
+    for line in output.decode('utf-8').splitlines():
+        key, _, value = line.partition(':')
+        if value.strip().isdigit():
+            stats[key.strip()] = int(value)
+    return stats
+
+
+class Maintenance(object):
+    """
+    Incremental maintenance of the mirrors, within a time budget per run.
+
+    After a mirror has been fetched, its loose objects and packs are counted.
+
+    - More than max_loose loose objects are packed into a new pack.
+    - More than max_packs packs are combined with a geometric repack, and a
+      multi-pack-index is written over the remaining packs.
+    - The commit-graph is updated incrementally when the mirror changed or
+      has none.
+
+    No maintenance starts once the budget is used up, so maintenance never
+    starves the backup itself. The budget is shared between concurrent
+    backup workers.
+    """
+
+    def __init__(self, budget: float = 600.0, max_packs: int = 50,
+                 max_loose: int = 1000):
+        """
+        Maintenance of the mirrors.
+
+        :param budget: the time to spend on maintenance in a run, in seconds
+        :param max_packs: the number of packs that triggers a repack
+        :param max_loose: the number of loose objects that triggers packing
+            them
+        """
+        self.budget = budget
+        self.max_packs = max_packs
+        self.max_loose = max_loose
+        self.used = 0.0
+        self._lock = threading.Lock()
+
+    def remaining(self) -> float:
+        """
+        :return: the remaining maintenance budget, in seconds
+        """
+        with self._lock:
+            return max(self.budget - self.used, 0.0)
+
+    def _git(self, repository_path: Path, *args: str):
+        started = time.monotonic()
+        try:
+            subprocess.check_output(('git', '-C', repository_path) + args,
+                                    stderr=subprocess.STDOUT)
+        finally:
+            with self._lock:
+                self.used += time.monotonic() - started
+
+    def maintain(self, repository_path: Path,
+                 changed: bool = True) -> typing.List[str]:
+        """
+        Maintain a mirror, if the budget allows it.
+
+        :param repository_path: the path of the mirror
+        :param changed: False if the last fetch received nothing, in which
+            case an existing commit-graph is left alone
+        :return: the maintenance tasks that were performed
+        :raises subprocess.CalledProcessError: If any of the git processes
+            failed
+        """
+        tasks = []
+        if self.remaining() <= 0:
+            logging.debug(M('Maintenance budget used up, not maintaining {0}',
+                            repository_path))
+            return tasks
+
+        stats = count_objects(repository_path)
+        logging.debug(M('{0} has {1} loose objects in {2} packs',
+                        repository_path, stats.get('count', 0),
+                        stats.get('packs', 0)))
+
+        if stats.get('count', 0) > self.max_loose and self.remaining() > 0:
+            self._git(repository_path, 'repack', '-d', '-l', '-q')
+            tasks.append('pack-loose')
+        if stats.get('packs', 0) > self.max_packs and self.remaining() > 0:
+            self._git(repository_path, 'repack', '-d', '-l', '-q',
+                      '--geometric=2')
+            self._git(repository_path, 'multi-pack-index', 'write')
+            tasks.append('repack')
+
+        graph = os.path.join(repository_path, 'objects', 'info')
+        has_graph = os.path.exists(os.path.join(graph, 'commit-graph')) or \
+            os.path.isdir(os.path.join(graph, 'commit-graphs'))
+        if (changed or not has_graph) and self.remaining() > 0:
+            self._git(repository_path, 'commit-graph', 'write', '--reachable',
+                      '--split')
+            tasks.append('commit-graph')
+
+        if tasks:
+            logging.info(M('Maintained {0}: {1}', repository_path,
+                           ', '.join(tasks)))
+        return tasks
@@ -0,0 +1,130 @@
+"""The persistent state of previous backups, used to skip unchanged
+repositories."""
+
+import hashlib
+import json
+import logging
+import os
+import subprocess
+import tempfile
+import threading
+import typing
+
+from statsbiblioteket.github_cloner.messages import M
+from statsbiblioteket.github_cloner.myTypes import Path, Repository, Url
+
+
+def ls_remote_hash(git_url: Url) -> str:
+    """
+    Hash the refs of a remote repository.
+
+    :param git_url: the git url of the repository
+    :return: the sha256 of the output of git ls-remote
+    :raises subprocess.CalledProcessError: If git ls-remote failed
+    """
+    output = subprocess.check_output(['git', 'ls-remote', git_url],
+                                     stderr=subprocess.DEVNULL)
+    return hashlib.sha256(output).hexdigest()
+
+
+class Manifest(object):
+    """
+    The last seen state of every backed up repository, keyed by clone url.
+
+    The state is the pushed_at and updated_at timestamps reported by github,
+    and optionally a hash of the output of git ls-remote. A repository whose
+    state is unchanged since the last successful backup does not need to be
+    fetched again. The duration of the last fetch or clone is recorded too,
+    for scheduling.
+
+    The manifest is safe to use from concurrent backup workers.
+    """
+
+    def __init__(self, path: Path, ls_remote: bool = False):
+        """
+        The manifest of previous backups, loaded from path if it exists.
+
+        :param path: the file the manifest is stored in
+        :param ls_remote: also compare a hash of git ls-remote when the
+            github timestamps have changed or are missing
+        """
+        self.path = path
+        self.ls_remote = ls_remote
+        self._lock = threading.Lock()
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as manifest_file:
+                self.entries = json.load(manifest_file)
+
+    @staticmethod
+    def _stamps(repository: Repository) -> dict:
+        return {'pushed_at': repository.pushed_at,
+                'updated_at': repository.updated_at}
+
+    def get(self, repository: Repository) -> dict:
+        """
+        The recorded state of a repository.
+
+        :param repository: the repository
+        :return: the recorded state, or None if there is none
+        """
+        with self._lock:
+            entry = self.entries.get(repository.url)
+            return dict(entry) if entry is not None else None
+
+    def duration(self, repository: Repository) -> typing.Optional[float]:
+        """
+        The duration of the last fetch or clone of a repository.
+
+        :param repository: the repository
+        :return: the duration in seconds, or None if it is not known
+        """
+        return (self.get(repository) or {}).get('duration')
+
+    def unchanged(self, repository: Repository,
+                  repository_path: Path) -> typing.Tuple[bool, dict]:
+        """
+        Determine if a repository is unchanged since it was last backed up.
+
+        :param repository: the repository as listed by github
+        :param repository_path: the path of the local mirror
+        :return: a tuple of whether the repository is unchanged, and the
+            state to record once the repository has been backed up
+        :raises subprocess.CalledProcessError: If git ls-remote failed
+        """
+        state = self._stamps(repository)
+        entry = self.get(repository)
+        if entry is None or not os.path.isdir(repository_path):
+            return False, state
+        has_stamps = any(value is not None for value in state.values())
+        if has_stamps and all(entry.get(key) == value
+                              for key, value in state.items()):
+            entry.update(state)
+            return True, entry
+        if self.ls_remote:
+            state['ls_remote'] = ls_remote_hash(repository.url)
+            if entry.get('ls_remote') == state['ls_remote']:
+                return True, state
+        return False, state
+
+    def record(self, repository: Repository, state: dict):
+        """
+        Record the state of a repository that has been backed up.
+
+        :param repository: the repository
+        :param state: the state, as returned by unchanged
+        """
+        with self._lock:
+            self.entries[repository.url] = dict(state)
+
+    def save(self):
+        """Write the manifest to its file, replacing it atomically"""
+        directory = os.path.dirname(os.path.abspath(self.path))
+        with self._lock:
+            fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as manifest_file:
+                json.dump(self.entries, manifest_file, indent=1,
+                          sort_keys=True)
+            os.replace(temp_path, self.path)
+        logging.debug(M('Saved the state of {0} repositories to {1}',
+                        len(self.entries), self.path))
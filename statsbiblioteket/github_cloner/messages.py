@@ -0,0 +1,20 @@
+"""Logging helpers shared by the github cloner modules."""
+
+
+class BraceMessage(object):
+    """Utility class for {} formatting of messages for logging."""
+
+    def __init__(self, fmt: str, *args, **kwargs):
+        """
+        A formatted version of fmt, using substitutions from args and kwargs.
+        The substitutions are identified by braces ('{' and '}').
+        """
+        self.fmt = fmt
+        self.args = args
+        self.kwargs = kwargs
+
+    def __str__(self) -> str:
+        return self.fmt.format(*self.args, **self.kwargs)
+
+
+M = BraceMessage
@@ -0,0 +1,263 @@
+"""Performance metrics of a backup run, and the reports written from them."""
+
+import json
+import os
+import tempfile
+import threading
+import time
+import typing
+
+from statsbiblioteket.github_cloner.myTypes import Path
+
+
+def directory_size(path: Path) -> int:
+    """
+    The total size of the files below a directory.
+
+    :param path: the directory
+    :return: the size in bytes, 0 if the directory does not exist
+    """
+    size = 0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return size
+
+
+class RepositoryMetrics(object):
+    """
+    The performance metrics of backing up a single repository.
+
+    operation is 'clone', 'fetch' or 'skip', and outcome is 'ok', 'failed'
+    or 'skipped'. bytes_received is the growth of the object store of the
+    mirror, which is what git received. maintenance_time is the time spent
+    maintaining the mirror after the fetch, and objects_received the number
+    of objects git reported receiving. complete is False for a partial
+    mirror that is still missing objects, and hydrated_objects is the number
+    of missing objects fetched into it in this run. attempts is the number
+    of times the fetch or clone was attempted, and failure the class of the
+    failure of a failed backup. expected_time is the duration of the
+    previous backup of the repository, if the manifest recorded one.
+    """
+
+    def __init__(self, repository: str, account: str = None,
+                 repo_type: str = None):
+        """
+        The performance metrics of backing up a single repository.
+
+        :param repository: the name of the repository
+        :param account: the github user/org the repository belongs to
+        :param repo_type: 'repos' or 'gists'
+        """
+        self.repository = repository
+        self.account = account
+        self.repo_type = repo_type
+        self.operation = None
+        self.outcome = None
+        self.wall_time = 0.0
+        self.git_time = 0.0
+        self.bytes_received = 0
+        self.objects_received = 0
+        self.maintenance_time = 0.0
+        self.complete = True
+        self.hydrated_objects = 0
+        self.attempts = 0
+        self.failure = None
+        self.expected_time = None
+
+    def as_dict(self) -> dict:
+        return dict(self.__dict__)
+
+
+class RunMetrics(object):
+    """
+    The performance metrics of a whole backup run: the time spent listing
+    each account, and the metrics of every repository.
+
+    The metrics are safe to record from concurrent backup workers.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.finished = None
+        self.listings = []
+        self.repositories = []
+        self.filtered = {}
+        self._lock = threading.Lock()
+
+    def add_listing(self, account: str, repo_type: str, seconds: float,
+                    count: int):
+        """
+        Record the time spent listing the repositories of an account.
+
+        :param account: the github user/org
+        :param repo_type: 'repos' or 'gists'
+        :param seconds: the time spent waiting for the listing
+        :param count: the number of repositories listed
+        """
+        with self._lock:
+            self.listings.append({'account': account,
+                                  'repo_type': repo_type,
+                                  'seconds': seconds,
+                                  'repositories': count})
+
+    def add_filtered(self, skipped: typing.Dict[str, int]):
+        """
+        Record the repositories skipped by the filters.
+
+        :param skipped: the number of repositories skipped for each reason
+        """
+        with self._lock:
+            for reason, count in skipped.items():
+                self.filtered[reason] = self.filtered.get(reason, 0) + count
+
+    def add(self, metrics: RepositoryMetrics):
+        """
+        Record the metrics of a repository.
+
+        :param metrics: the metrics of the repository
+        """
+        with self._lock:
+            self.repositories.append(metrics)
+
+    def finish(self):
+        """Mark the run as finished"""
+        self.finished = time.time()
+
+    def summary(self) -> dict:
+        """
+        :return: the totals of the run, per operation and outcome
+        """
+        finished = self.finished or time.time()
+        summary = {'started': self.started,
+                   'duration': finished - self.started,
+                   'listing_seconds': sum(listing['seconds']
+                                          for listing in self.listings),
+                   'operations': {},
+                   'outcomes': {},
+                   'failures': {},
+                   'filtered': dict(self.filtered),
+                   'partial_mirrors': sum(1 for metrics in self.repositories
+                                          if not metrics.complete),
+                   'hydrated_objects': sum(metrics.hydrated_objects
+                                           for metrics in
+                                           self.repositories)}
+        for metrics in self.repositories:
+            operation = summary['operations'].setdefault(
+                metrics.operation, {'count': 0, 'seconds': 0.0,
+                                    'git_seconds': 0.0,
+                                    'maintenance_seconds': 0.0,
+                                    'bytes_received': 0})
+            operation['count'] += 1
+            operation['seconds'] += metrics.wall_time
+            operation['git_seconds'] += metrics.git_time
+            operation['maintenance_seconds'] += metrics.maintenance_time
+            operation['bytes_received'] += metrics.bytes_received
+            summary['outcomes'][metrics.outcome] = \
+                summary['outcomes'].get(metrics.outcome, 0) + 1
+            if metrics.failure is not None:
+                summary['failures'][metrics.failure] = \
+                    summary['failures'].get(metrics.failure, 0) + 1
+        return summary
+
+    def as_dict(self) -> dict:
+        return {'summary': self.summary(),
+                'listings': list(self.listings),
+                'repositories': [metrics.as_dict()
+                                 for metrics in self.repositories]}
+
+    def write_json(self, path: Path):
+        """
+        Write the run report as JSON.
+
+        :param path: the file to write
+        """
+        _write_atomically(path, json.dumps(self.as_dict(), indent=1))
+
+    def write_prometheus(self, path: Path):
+        """
+        Write the metrics in the Prometheus text format, for the node
+        exporter textfile collector. The file is replaced atomically, so the
+        collector never reads a partial file.
+
+        :param path: the file to write, which should end in .prom
+        """
+        summary = self.summary()
+        lines = []
+
+        def _metric(name: str, kind: str, help_text: str,
+                    samples: typing.Iterable[typing.Tuple[dict, float]]):
+            lines.append('# HELP github_cloner_{0} {1}'.format(name,
+                                                               help_text))
+            lines.append('# TYPE github_cloner_{0} {1}'.format(name, kind))
+            for labels, value in samples:
+                label_text = ','.join(
+                    '{0}="{1}"'.format(key, _escape(str(label)))
+                    for key, label in sorted(labels.items()))
+                lines.append('github_cloner_{0}{1} {2}'.format(
+                    name, '{' + label_text + '}' if label_text else '',
+                    repr(float(value))))
+
+        def _repository_labels(metrics: RepositoryMetrics) -> dict:
+            return {'account': metrics.account or '',
+                    'type': metrics.repo_type or '',
+                    'repository': metrics.repository,
+                    'operation': metrics.operation or '',
+                    'outcome': metrics.outcome or ''}
+
+        _metric('last_run_timestamp_seconds', 'gauge',
+                'When the last backup run started',
+                [({}, summary['started'])])
+        _metric('run_duration_seconds', 'gauge',
+                'The duration of the last backup run',
+                [({}, summary['duration'])])
+        _metric('listing_duration_seconds', 'gauge',
+                'The time spent listing the repositories of an account',
+                [({'account': listing['account'],
+                   'type': listing['repo_type']}, listing['seconds'])
+                 for listing in self.listings])
+        _metric('repositories', 'gauge',
+                'The number of repositories by outcome',
+                [({'outcome': outcome}, count)
+                 for outcome, count in sorted(summary['outcomes'].items())])
+        _metric('failures', 'gauge',
+                'The number of failed repositories by class of failure',
+                [({'class': failure}, count)
+                 for failure, count in sorted(summary['failures'].items())])
+        _metric('filtered_repositories', 'gauge',
+                'The number of repositories skipped by the filters, by the '
+                'reason they were skipped',
+                [({'reason': reason}, count)
+                 for reason, count in sorted(summary['filtered'].items())])
+        _metric('partial_mirrors', 'gauge',
+                'The number of mirrors still missing objects after a partial '
+                'clone', [({}, summary['partial_mirrors'])])
+        _metric('repository_duration_seconds', 'gauge',
+                'The wall time of backing up a repository',
+                [(_repository_labels(metrics), metrics.wall_time)
+                 for metrics in self.repositories])
+        _metric('repository_git_seconds', 'gauge',
+                'The time spent in git subprocesses for a repository',
+                [(_repository_labels(metrics), metrics.git_time)
+                 for metrics in self.repositories])
+        _metric('repository_received_bytes', 'gauge',
+                'The growth of the object store of a repository',
+                [(_repository_labels(metrics), metrics.bytes_received)
+                 for metrics in self.repositories])
+        _write_atomically(path, '\n'.join(lines) + '\n')
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"') \
+        .replace('\n', '\\n')
+
+
+def _write_atomically(path: Path, content: str):
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'w', encoding='utf-8') as report_file:
+        report_file.write(content)
+    os.replace(temp_path, path)
@@ -1,4 +1,5 @@
 import enum
+import typing
 
 Url = str
 Path = str
@@ -7,20 +8,85 @@ Path = str
 class Repository(object):
     """
     The repository definition for the github cloner.
-    It has just three fields, name, description, url
+    It has the fields name, description, url, and the metadata github reports
+    about the size, creation, last push and update, whether the repository is
+    a fork or archived, its visibility, and the root of its fork network.
+    The metadata is None when github did not report it.
     """
 
-    def __init__(self, name: str, description: str, url: Url):
+    __slots__ = ('name', 'description', 'url', 'size', 'pushed_at',
+                 'updated_at', 'fork', 'archived', 'source', 'id',
+                 'created_at', 'visibility')
+
+    def __init__(self, name: str, description: str, url: Url,
+                 size: int = None, pushed_at: str = None,
+                 updated_at: str = None, fork: bool = None,
+                 archived: bool = None, source: str = None,
+                 id: typing.Union[int, str] = None,
+                 created_at: str = None,
+                 visibility: str = None):
         """
         The repository definition for the github cloner.
 
         :param name: the name of the repository
         :param description:  the description from github
         :param url: the url to clone/fetch from
+        :param size: the size of the repository in KB, as reported by github
+        :param pushed_at: when the repository was last pushed to, in ISO 8601
+        :param updated_at: when the repository was last updated, in ISO 8601
+        :param fork: True if the repository is a fork
+        :param archived: True if the repository is archived
+        :param source: the full name of the root of the fork network of the
+            repository, e.g. 'kb-dk/github_cloner'
+        :param id: the github id of the repository, which does not change
+            when the repository is renamed
+        :param created_at: when the repository was created, in ISO 8601
+        :param visibility: 'public', 'private' or 'internal' for
+            repositories, 'public' or 'secret' for gists
         """
         self.name = name
         self.description = description
         self.url = url
+        self.size = size
+        self.pushed_at = pushed_at
+        self.updated_at = updated_at
+        self.fork = fork
+        self.archived = archived
+        self.source = source
+        self.id = id
+        self.created_at = created_at
+        self.visibility = visibility
+
+
+class BackupResult(object):
+    """
+    The outcome of backing up a single repository.
+    A result without an error means the repository was fetched or cloned
+    successfully.
+    """
+
+    def __init__(self, repository: Repository, path: Path,
+                 error: Exception = None, skipped: bool = False,
+                 metrics=None):
+        """
+        The outcome of backing up a single repository.
+
+        :param repository: the repository that was backed up
+        :param path: the path the repository was backed up to
+        :param error: the error that occurred, or None if the backup succeeded
+        :param skipped: True if the repository was unchanged and not fetched
+        :param metrics: the RepositoryMetrics of the backup, if recorded
+        """
+        self.repository = repository
+        self.path = path
+        self.error = error
+        self.skipped = skipped
+        self.metrics = metrics
+
+    @property
+    def ok(self) -> bool:
+        """True if the backup of the repository succeeded"""
+        return self.error is None
 
 
 class UserType(enum.Enum):
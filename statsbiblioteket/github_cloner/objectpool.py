@@ -0,0 +1,219 @@
+"""A shared object store for repositories in the same fork network."""
+
+import json
+import logging
+import os
+import re
+import subprocess
+import tempfile
+import threading
+import typing
+
+from statsbiblioteket.github_cloner.messages import M
+from statsbiblioteket.github_cloner.myTypes import Path, Repository, Url
+
+
+def root_commits(repository_path: Path) -> typing.List[str]:
+    """
+    The root commits of a repository, i.e. the commits without parents.
+
+    :param repository_path: the path of the bare repository
+    :return: the sorted root commits, empty if the repository has no commits
+    :raises subprocess.CalledProcessError: If git rev-list failed
+    """
+    output = subprocess.check_output(
+        ['git', '-C', repository_path, 'rev-list', '--max-parents=0',
+         '--all'], stderr=subprocess.STDOUT)
+    return sorted(output.decode('utf-8').split())
+
+
+class ObjectPool(object):
+    """
+    A store of git objects shared by the repositories of a fork network.
+
+    Every network gets a bare pool repository below directory. The mirrors
+    of the network borrow objects from it through git alternates, so objects
+    common to the upstream and its forks are downloaded and stored once.
+
+    A repository belongs to the network of its github source (the root of
+    its fork network) when github reports it. Otherwise it belongs to the
+    network whose mirrors share a root commit with it. A new fork is cloned
+    with its pool as reference if its source, or the parent reported by
+    the GraphQL listings, has been added to a pool. As the REST listings do
+    not report the source, find_source is used to look it up when given.
+
+    To keep the pool safe for the mirrors borrowing from it, the pool never
+    prunes: refs are fetched from every member into refs/members/<name>/*
+    without --prune, and gc.auto and gc.pruneExpire are disabled. Updates to
+    a pool repository are serialised.
+    """
+
+    def __init__(self, directory: Path,
+                 find_source: typing.Callable[[str],
+                                              typing.Optional[Url]] = None):
+        """
+        A shared object pool.
+
+        :param directory: the directory holding the pool repositories
+        :param find_source: finds the url of the source of a fork from the
+            full name of the fork, 'owner/name', returning None if it
+            cannot, or None to only use the sources the listings report
+        """
+        self.directory = os.path.abspath(directory)
+        self.find_source = find_source
+        os.makedirs(self.directory, exist_ok=True)
+        self._index_path = os.path.join(self.directory, 'networks.json')
+        self._lock = threading.Lock()
+        self._network_locks = {}
+        self.roots = {}
+        self.members = {}
+        if os.path.exists(self._index_path):
+            with open(self._index_path, encoding='utf-8') as index_file:
+                index = json.load(index_file)
+            self.roots = index.get('roots', {})
+            self.members = index.get('members', {})
+
+    @staticmethod
+    def _network_name(key: str) -> str:
+        return re.sub(r'[^A-Za-z0-9._-]', '_', key)
+
+    def pool_path(self, network: str) -> Path:
+        """
+        :param network: the key of a fork network
+        :return: the path of the pool repository of the network
+        """
+        return os.path.join(self.directory,
+                            self._network_name(network) + '.git')
+
+    def _network_lock(self, network: str) -> threading.Lock:
+        with self._lock:
+            return self._network_locks.setdefault(network, threading.Lock())
+
+    def reference_for(self, repository: Repository,
+                      account: str = None) -> typing.Optional[Path]:
+        """
+        The pool to clone a repository with, before it has been cloned.
+
+        :param repository: the repository about to be cloned
+        :param account: the github user/org owning the repository, to look
+            up the source of a fork with, or None
+        :return: the path of the pool repository, or None if the network of
+            the repository is not known yet
+        """
+        with self._lock:
+            network = self.members.get(repository.url)
+            if network is None and repository.source is not None:
+                network = self._network_of(repository.source)
+        path = self._existing_pool(network)
+        if path is None and repository.fork and account is not None and \
+                self.find_source is not None:
+            source_url = self.find_source('{0}/{1}'.format(
+                account, repository.name))
+            with self._lock:
+                path = self._existing_pool(self.members.get(source_url))
+        return path
+
+    @staticmethod
+    def _full_name(url: Url) -> str:
+        """The 'owner/name' of a repository url, scp-like or not"""
+        parts = re.split(r'[:/]', url)
+        name = parts[-1][:-len('.git')] if parts[-1].endswith('.git') \
+            else parts[-1]
+        return '{0}/{1}'.format(parts[-2], name).lower()
+
+    def _network_of(self, full_name: str) -> typing.Optional[str]:
+        """The network of the member with full_name, 'owner/name'"""
+        full_name = full_name.lower()
+        for url, network in self.members.items():
+            if self._full_name(url) == full_name:
+                return network
+        return None
+
+    def _existing_pool(self, network: str = None) -> typing.Optional[Path]:
+        if network is None:
+            return None
+        path = self.pool_path(network)
+        return path if os.path.isdir(path) else None
+
+    def _resolve_network(self, repository: Repository,
+                         roots: typing.List[str]) -> str:
+        with self._lock:
+            if repository.url in self.members:
+                return self.members[repository.url]
+            for root in roots:
+                if root in self.roots:
+                    return self.roots[root]
+        return repository.source or roots[0]
+
+    def _ensure_pool(self, path: Path):
+        if os.path.isdir(path):
+            return
+        logging.info(M('Creating object pool {0}', path))
+        subprocess.check_output(['git', 'init', '-q', '--bare', path],
+                                stderr=subprocess.STDOUT)
+        for key, value in (('gc.auto', '0'), ('gc.pruneExpire', 'never'),
+                           ('core.logAllRefUpdates', 'false')):
+            subprocess.check_output(['git', '-C', path, 'config', key, value],
+                                    stderr=subprocess.STDOUT)
+
+    @staticmethod
+    def _alternates(repository_path: Path) -> Path:
+        return os.path.join(repository_path, 'objects', 'info', 'alternates')
+
+    def _attach(self, repository_path: Path, pool: Path):
+        alternates = self._alternates(repository_path)
+        pool_objects = os.path.join(pool, 'objects')
+        if os.path.exists(alternates):
+            with open(alternates, encoding='utf-8') as alternates_file:
+                if pool_objects in alternates_file.read().split('\n'):
+                    return
+        logging.info(M('Sharing objects of {0} through {1}',
+                       repository_path, pool))
+        with open(alternates, 'a', encoding='utf-8') as alternates_file:
+            alternates_file.write(pool_objects + '\n')
+        # Drop the local copies of the objects the pool already has
+        subprocess.check_output(['git', '-C', repository_path, 'repack',
+                                 '-a', '-d', '-l', '-q'],
+                                stderr=subprocess.STDOUT)
+
+    def add(self, repository: Repository, repository_path: Path):
+        """
+        Add the objects of a freshly cloned or fetched mirror to the pool of
+        its network, and let the mirror borrow from the pool.
+
+        :param repository: the repository
+        :param repository_path: the path of its mirror
+        :raises subprocess.CalledProcessError: If any of the git processes
+            failed
+        """
+        repository_path = os.path.abspath(repository_path)
+        roots = root_commits(repository_path)
+        if not roots:
+            return
+        network = self._resolve_network(repository, roots)
+        pool = self.pool_path(network)
+        name = self._network_name(repository.url)
+        with self._network_lock(network):
+            self._ensure_pool(pool)
+            subprocess.check_output(
+                ['git', '-C', pool, 'fetch', '-q', '--no-tags',
+                 repository_path,
+                 '+refs/*:refs/members/{0}/*'.format(name)],
+                stderr=subprocess.STDOUT)
+            self._attach(repository_path, pool)
+        with self._lock:
+            self.members[repository.url] = network
+            for root in roots:
+                self.roots.setdefault(root, network)
+        logging.debug(M('Repository {0} is in the fork network {1}',
+                        repository_path, network))
+
+    def save(self):
+        """Write the network index, replacing it atomically"""
+        with self._lock:
+            fd, temp_path = tempfile.mkstemp(dir=self.directory,
+                                             suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as index_file:
+                json.dump({'roots': self.roots, 'members': self.members},
+                          index_file, indent=1, sort_keys=True)
+            os.replace(temp_path, self._index_path)
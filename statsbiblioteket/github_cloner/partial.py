@@ -0,0 +1,227 @@
+"""Partial clones for fast initial seeding of huge repositories, and their
+gradual hydration into complete mirrors."""
+
+import logging
+import os
+import re
+import subprocess
+import threading
+import time
+import typing
+
+from statsbiblioteket.github_cloner.messages import M
+from statsbiblioteket.github_cloner.myTypes import Path
+
+
+# A section header of a git config file, e.g. [remote "origin"]
+_SECTION_PATTERN = re.compile(r'^\[\s*([^\s\]"]+)(?:\s+"(.*)")?\s*\]')
+
+
+def partial_filter(repository_path: Path) -> typing.Optional[str]:
+    """
+    The partial clone filter of a mirror.
+
+    The config file of the mirror is read directly rather than through git
+    config, as this is asked of every mirror in every run.
+
+    :param repository_path: the path of the mirror
+    :return: the filter, e.g. 'blob:none', or None if the mirror is complete
+    """
+    try:
+        with open(os.path.join(repository_path, 'config'),
+                  encoding='utf-8') as config_file:
+            lines = config_file.read().splitlines()
+    except OSError:
+        return None
+    in_origin = False
+    value = None
+    for line in lines:
+        line = line.strip()
+        section = _SECTION_PATTERN.match(line)
+        if section:
+            in_origin = section.group(1).lower() == 'remote' and \
+                section.group(2) == 'origin'
+        elif in_origin and '=' in line:
+            key, _, text = line.partition('=')
+            if key.strip().lower() == 'partialclonefilter':
+                # The last value wins, as with git config --get
+                value = text.strip().strip('"')
+    return value or None
+
+
+def is_complete(repository_path: Path) -> bool:
+    """
+    :param repository_path: the path of the mirror
+    :return: True if the mirror has every object, i.e. it is not a partial
+        clone or it has been hydrated
+    """
+    return partial_filter(repository_path) is None
+
+
+def iter_missing_objects(repository_path: Path) -> typing.Iterator[str]:
+    """
+    Stream the objects reachable from the refs of a partial clone that have
+    not been fetched, from a single walk of the history. Closing the
+    iterator early stops the walk.
+
+    :param repository_path: the path of the mirror
+    :return: an iterator of the ids of the missing objects
+    :raises subprocess.CalledProcessError: If git rev-list failed
+    """
+    command = ['git', '-C', repository_path, 'rev-list', '--objects',
+               '--all', '--missing=print']
+    process = subprocess.Popen(command, stdout=subprocess.PIPE,
+                               stderr=subprocess.DEVNULL)
+    completed = False
+    try:
+        for line in process.stdout:
+            if line.startswith(b'?'):
+                yield line[1:].strip().decode('ascii')
+        completed = True
+    finally:
+        if not completed:
+            process.kill()
+        process.stdout.close()
+        returncode = process.wait()
+    if returncode:
+        raise subprocess.CalledProcessError(returncode, command)
+
+
+def missing_objects(repository_path: Path,
+                    limit: int = None) -> typing.List[str]:
+    """
+    The objects reachable from the refs of a partial clone that have not
+    been fetched.
+
+    :param repository_path: the path of the mirror
+    :param limit: stop after finding this many missing objects
+    :return: the ids of the missing objects
+    :raises subprocess.CalledProcessError: If git rev-list failed
+    """
+    missing = []
+    objects = iter_missing_objects(repository_path)
+    try:
+        for object_id in objects:
+            missing.append(object_id)
+            if limit is not None and len(missing) >= limit:
+                break
+    finally:
+        objects.close()
+    return missing
+
+
+class Hydration(object):
+    """
+    Backfilling of the objects a partial clone left out, within a time
+    budget per run.
+
+    The missing objects of a partial mirror are listed by a single walk of
+    its history, and fetched from origin in batches as the walk streams
+    them. As fetched objects can refer to more missing ones, e.g. the blobs
+    of fetched trees, the history is walked again until none are missing.
+    Then the partial clone filter is removed from the mirror, so later
+    fetches are complete. A mirror that is not finished when the budget
+    runs out continues in the next run.
+
+    The budget is shared between concurrent backup workers.
+    """
+
+    def __init__(self, budget: float = 600.0, batch_size: int = 1000):
+        """
+        Hydration of partial mirrors.
+
+        :param budget: the time to spend hydrating in a run, in seconds
+        :param batch_size: the number of objects to fetch at a time
+        """
+        self.budget = budget
+        self.batch_size = batch_size
+        self.used = 0.0
+        self._lock = threading.Lock()
+
+    def remaining(self) -> float:
+        """
+        :return: the remaining hydration budget, in seconds
+        """
+        with self._lock:
+            return max(self.budget - self.used, 0.0)
+
+    def _charge(self, started: float) -> float:
+        """Charge the time since started to the budget, and return now"""
+        now = time.monotonic()
+        with self._lock:
+            self.used += now - started
+        return now
+
+    def _fetch(self, repository_path: Path, object_ids: typing.List[str]):
+        command = ['git', '-C', repository_path,
+                   '-c', 'fetch.negotiationAlgorithm=noop',
+                   'fetch', '-q', '--no-tags', '--no-write-fetch-head',
+                   '--stdin', 'origin']
+        process = subprocess.Popen(command, stdin=subprocess.PIPE,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT)
+        output, _ = process.communicate(
+            '\n'.join(object_ids).encode('ascii'))
+        if process.returncode:
+            raise subprocess.CalledProcessError(process.returncode, command,
+                                                output)
+
+    def hydrate(self, repository_path: Path) -> typing.Tuple[int, bool]:
+        """
+        Fetch missing objects into a partial mirror, as far as the budget
+        allows.
+
+        :param repository_path: the path of the mirror
+        :return: the number of objects fetched, and whether the mirror is
+            complete
+        :raises subprocess.CalledProcessError: If any of the git processes
+            failed
+        """
+        if partial_filter(repository_path) is None:
+            return 0, True
+        fetched = 0
+        requested = set()
+
+        def _fetch(batch: typing.List[str]):
+            nonlocal fetched
+            self._fetch(repository_path, batch)
+            fetched += len(batch)
+            requested.update(batch)
+
+        while self.remaining() > 0:
+            found = 0
+            batch = []
+            started = time.monotonic()
+            objects = iter_missing_objects(repository_path)
+            try:
+                for object_id in objects:
+                    if object_id in requested:
+                        logging.warning(M('origin did not send the missing '
+                                          'objects of {0}, giving up for '
+                                          'this run', repository_path))
+                        return fetched, False
+                    found += 1
+                    batch.append(object_id)
+                    if len(batch) >= self.batch_size:
+                        _fetch(batch)
+                        batch = []
+                        started = self._charge(started)
+                        if self.remaining() <= 0:
+                            break
+                if batch and self.remaining() > 0:
+                    _fetch(batch)
+            finally:
+                objects.close()
+                self._charge(started)
+            if not found:
+                subprocess.check_output(
+                    ['git', '-C', repository_path, 'config', '--unset',
+                     'remote.origin.partialclonefilter'],
+                    stderr=subprocess.STDOUT)
+                logging.info(M('{0} is now a complete mirror, {1} objects '
+                               'were fetched in this run', repository_path,
+                               fetched))
+                return fetched, True
+        logging.info(M('Hydration budget used up, {0} is still partial after '
+                       'fetching {1} objects', repository_path, fetched))
+        return fetched, False
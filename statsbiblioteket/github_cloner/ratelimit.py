@@ -0,0 +1,229 @@
+"""Scheduling of github API requests within the github rate limit."""
+
+import logging
+import random
+import threading
+import time
+import typing
+import urllib.parse
+
+import requests
+
+from statsbiblioteket.github_cloner.messages import M
+from statsbiblioteket.github_cloner.myTypes import Url
+
+
+def resource_of(url: Url) -> str:
+    """
+    The rate limit resource github counts a request against, before github
+    says so in the X-RateLimit-Resource header of the response.
+
+    :param url: the url of the request
+    :return: 'graphql', 'search' or 'core'
+    """
+    path = urllib.parse.urlparse(url).path
+    if path.endswith('/graphql'):
+        return 'graphql'
+    if '/search/' in path:
+        return 'search'
+    return 'core'
+
+
+class Budget(object):
+    """
+    The rate limit budget of one resource, as github last reported it, and
+    the time the limiter last reserved for a request against it. The fields
+    are None until then.
+    """
+
+    def __init__(self):
+        self.limit = None
+        self.remaining = None
+        self.reset = None
+        self.last_request = None
+
+
+class RateLimiter(object):
+    """
+    A central scheduler for github API requests.
+
+    The limiter tracks the budget github reports in the X-RateLimit-Remaining
+    and X-RateLimit-Reset headers, separately for every resource named in
+    the X-RateLimit-Resource header, as e.g. the REST API ('core') and the
+    GraphQL API ('graphql') have budgets of their own. While plenty of
+    budget remains, the requests to a resource are only spaced by
+    min_interval. When the remaining budget of a resource drops below
+    reserve, the remaining requests to it are spread evenly until its
+    reset, and when it runs out, requests to it wait for the reset without
+    holding up the requests to other resources.
+
+    Responses that hit the secondary rate limit (403 or 429 with a
+    Retry-After header or a rate limit message) are retried with jittered
+    exponential backoff.
+
+    The limiter is safe to share between concurrent requests.
+    """
+
+    def __init__(self, min_interval: float = 0.0, reserve: int = 100,
+                 max_retries: int = 5, backoff: float = 1.0,
+                 clock: typing.Callable[[], float] = time.time,
+                 sleep: typing.Callable[[float], None] = time.sleep):
+        """
+        A scheduler for github API requests.
+
+        :param min_interval: the minimum time between requests to a
+            resource, in seconds
+        :param reserve: the remaining budget below which requests are spread
+            out until the reset
+        :param max_retries: the number of times a rate limited request is
+            retried
+        :param backoff: the initial backoff for secondary rate limits, in
+            seconds
+        :param clock: the clock, for testing
+        :param sleep: the sleep function, for testing
+        """
+        self.min_interval = min_interval
+        self.reserve = reserve
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.clock = clock
+        self.sleep = sleep
+
+        self.budgets = {}
+
+        self.requests_made = 0
+        self.not_modified = 0
+        self.retries = 0
+        self.time_waited = 0.0
+
+        self._lock = threading.Lock()
+
+    def _budget(self, resource: str) -> Budget:
+        return self.budgets.setdefault(resource, Budget())
+
+    @staticmethod
+    def _exhausted(budget: Budget, now: float) -> bool:
+        return budget.remaining is not None and budget.remaining <= 0 and \
+            budget.reset is not None and budget.reset > now
+
+    def _spacing(self, budget: Budget, now: float) -> float:
+        if budget.remaining is not None and budget.remaining < self.reserve \
+                and budget.reset is not None and budget.reset > now:
+            return (budget.reset - now) / max(budget.remaining, 1)
+        return 0.0
+
+    def _wait(self, resource: str):
+        # The slot of the request is reserved under the lock, but the wait
+        # for it is not, so a request waiting for the reset of one resource
+        # does not hold up the requests to the others
+        with self._lock:
+            budget = self._budget(resource)
+            now = self.clock()
+            wait_until = now
+            if budget.last_request is not None:
+                wait_until = max(wait_until, budget.last_request +
+                                 max(self.min_interval,
+                                     self._spacing(budget, now)))
+            if self._exhausted(budget, now):
+                logging.warning(M('Rate limit of {0} exhausted, waiting '
+                                  '{1:.0f}s for the reset', resource,
+                                  budget.reset - now))
+                wait_until = max(wait_until, budget.reset + 1)
+            budget.last_request = wait_until
+            self.requests_made += 1
+            if budget.remaining is not None:
+                budget.remaining = max(budget.remaining - 1, 0)
+            if wait_until > now:
+                self.time_waited += wait_until - now
+        if wait_until > now:
+            self.sleep(wait_until - now)
+
+    def _update(self, response: requests.Response, resource: str):
+        headers = response.headers
+        with self._lock:
+            if response.status_code == 304:
+                self.not_modified += 1
+            budget = self._budget(headers.get('X-RateLimit-Resource',
+                                              resource))
+            if 'X-RateLimit-Limit' in headers:
+                budget.limit = int(headers['X-RateLimit-Limit'])
+            if 'X-RateLimit-Remaining' in headers:
+                budget.remaining = int(headers['X-RateLimit-Remaining'])
+            if 'X-RateLimit-Reset' in headers:
+                budget.reset = float(headers['X-RateLimit-Reset'])
+
+    def _retry_delay(self, response: requests.Response,
+                     attempt: int) -> typing.Optional[float]:
+        if response.status_code not in (403, 429):
+            return None
+        backoff = self.backoff * 2 ** attempt * (1 + random.random())
+        if 'Retry-After' in response.headers:
+            return max(float(response.headers['Retry-After']), backoff)
+        if response.headers.get('X-RateLimit-Remaining') == '0':
+            # The next _wait sleeps until the reset
+            return 0.0
+        if response.status_code == 429 or \
+                'rate limit' in response.text.lower():
+            return backoff
+        # A plain 403 Forbidden is not something waiting will fix
+        return None
+
+    def get(self, url: Url, get: typing.Callable = requests.get,
+            **kwargs) -> requests.Response:
+        """
+        Perform a GET request when the rate limit allows it, retrying it if
+        it was rate limited.
+
+        :param url: the url to get
+        :param get: the function performing the actual request
+        :param kwargs: further arguments for get
+        :return: the response from github
+        """
+        resource = resource_of(url)
+        for attempt in range(self.max_retries + 1):
+            self._wait(resource)
+            response = get(url, **kwargs)
+            self._update(response, resource)
+            delay = self._retry_delay(response, attempt)
+            if delay is None or attempt == self.max_retries:
+                break
+            logging.warning(M('Rate limited on {0}, retrying in {1:.1f}s',
+                              url, delay))
+            self.retries += 1
+            if delay > 0:
+                self.time_waited += delay
+                self.sleep(delay)
+        return response
+
+    def post(self, url: Url, post: typing.Callable = requests.post,
+             **kwargs) -> requests.Response:
+        """
+        Perform a POST request, e.g. a GraphQL query, when the rate limit
+        allows it, retrying it if it was rate limited.
+
+        :param url: the url to post to
+        :param post: the function performing the actual request
+        :param kwargs: further arguments for post
+        :return: the response from github
+        """
+        return self.get(url, get=post, **kwargs)
+
+    def used(self) -> int:
+        """
+        :return: the number of requests that counted against the rate limit
+        """
+        return self.requests_made - self.not_modified
+
+    def log_report(self):
+        """Log the rate limit budget used in this run"""
+        with self._lock:
+            budgets = ', '.join(
+                '{0} {1} of {2}'.format(resource, budget.remaining,
+                                        budget.limit)
+                for resource, budget in sorted(self.budgets.items()))
+        logging.info(M('Made {0} github API requests, {1} counted against '
+                       'the rate limit, {2} were not modified. '
+                       '{3} retries, {4:.1f}s spent waiting. '
+                       'Remaining budget {5}',
+                       self.requests_made, self.used(), self.not_modified,
+                       self.retries, self.time_waited, budgets or 'unknown'))
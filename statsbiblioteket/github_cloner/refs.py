@@ -0,0 +1,165 @@
+"""Filtering of the refs a mirror fetches, so the bulk refs github publishes,
+like the refs/pull/* of every pull request, can be left out."""
+
+import logging
+import subprocess
+import typing
+
+from statsbiblioteket.github_cloner.messages import M
+from statsbiblioteket.github_cloner.myTypes import Path
+
+# The refspec of git clone --mirror, every ref as it is on the remote
+MIRROR_REFSPEC = '+refs/*:refs/*'
+
+
+class RefFilter(object):
+    """
+    The refs a mirror fetches: the refs matching an include pattern and no
+    exclude pattern.
+
+    Patterns are ref names, optionally with a single *, e.g. refs/heads/*,
+    refs/tags/* or refs/pull/*. Excludes become negative refspecs, which
+    need git 2.29 or later.
+    """
+
+    def __init__(self, include: typing.Iterable[str] = None,
+                 exclude: typing.Iterable[str] = None):
+        """
+        A ref filter.
+
+        :param include: the patterns of the refs to fetch, or None to fetch
+            all refs
+        :param exclude: the patterns of the refs not to fetch
+        :raises ValueError: If a pattern is not a valid ref pattern
+        """
+        self.include = list(include or ['refs/*'])
+        self.exclude = list(exclude or [])
+        for pattern in self.include + self.exclude:
+            if not pattern.startswith('refs/') or pattern.count('*') > 1 \
+                    or ':' in pattern or pattern.startswith('^'):
+                raise ValueError('{0} is not a ref pattern like '
+                                 'refs/heads/*'.format(pattern))
+
+    def refspecs(self) -> typing.List[str]:
+        """
+        :return: the fetch refspecs of the filter
+        """
+        return ['+{0}:{0}'.format(pattern) for pattern in self.include] + \
+               ['^' + pattern for pattern in self.exclude]
+
+    @property
+    def is_mirror(self) -> bool:
+        """True if the filter fetches every ref, like git clone --mirror"""
+        return self.refspecs() == [MIRROR_REFSPEC]
+
+
+class RefFilters(object):
+    """
+    The ref filters of the accounts.
+
+    An account with include patterns of its own fetches those instead of the
+    default includes. The exclude patterns of an account are added to the
+    default excludes.
+    """
+
+    def __init__(self, include: typing.Iterable[str] = None,
+                 exclude: typing.Iterable[str] = None,
+                 accounts_include: typing.Dict[str, typing.List[str]] = None,
+                 accounts_exclude: typing.Dict[str, typing.List[str]] = None):
+        """
+        The ref filters of the accounts.
+
+        :param include: the default include patterns, or None for all refs
+        :param exclude: the default exclude patterns
+        :param accounts_include: the include patterns of each account
+        :param accounts_exclude: the exclude patterns of each account
+        :raises ValueError: If a pattern is not a valid ref pattern
+        """
+        self.default = RefFilter(include, exclude)
+        self.accounts = {}
+        accounts_include = accounts_include or {}
+        accounts_exclude = accounts_exclude or {}
+        for account in set(accounts_include) | set(accounts_exclude):
+            self.accounts[account] = RefFilter(
+                accounts_include.get(account) or self.default.include,
+                self.default.exclude + accounts_exclude.get(account, []))
+
+    @classmethod
+    def parse(cls, include: typing.Iterable[str] = None,
+              exclude: typing.Iterable[str] = None) -> 'RefFilters':
+        """
+        The ref filters given on the command line, as patterns that apply
+        to every account, or ACCOUNT=PATTERN for a single account.
+
+        :param include: the include arguments
+        :param exclude: the exclude arguments
+        :return: the ref filters
+        :raises ValueError: If a pattern is not a valid ref pattern
+        """
+        def _split(arguments: typing.Iterable[str]) -> \
+                typing.Tuple[typing.List[str],
+                             typing.Dict[str, typing.List[str]]]:
+            patterns = []
+            accounts = {}
+            for argument in arguments or []:
+                account, _, pattern = argument.rpartition('=')
+                if account:
+                    accounts.setdefault(account, []).append(pattern)
+                else:
+                    patterns.append(pattern)
+            return patterns, accounts
+
+        include, accounts_include = _split(include)
+        exclude, accounts_exclude = _split(exclude)
+        return cls(include, exclude, accounts_include, accounts_exclude)
+
+    def for_account(self, account: str) -> RefFilter:
+        """
+        :param account: the github user/org
+        :return: the ref filter of the account
+        """
+        return self.accounts.get(account, self.default)
+
+
+def configured_refspecs(repository_path: Path) -> typing.List[str]:
+    """
+    :param repository_path: the path of a mirror
+    :return: the fetch refspecs of the origin remote of the mirror
+    """
+    try:
+        output = subprocess.check_output(
+            ['git', '-C', repository_path, 'config', '--get-all',
+             'remote.origin.fetch'], stderr=subprocess.DEVNULL)
+    except subprocess.CalledProcessError:
+        # git config exits with 1 when the key is not set
+        return []
+    return output.decode('utf-8').split()
+
+
+def configure_refspecs(repository_path: Path,
+                       refspecs: typing.List[str]) -> bool:
+    """
+    Set the fetch refspecs of the origin remote of a mirror, in place.
+
+    Refs the new refspecs exclude are left in the mirror, they are just not
+    updated any more.
+
+    :param repository_path: the path of the mirror
+    :param refspecs: the refspecs
+    :return: True if the refspecs were changed
+    :raises subprocess.CalledProcessError: If git config failed
+    """
+    current = configured_refspecs(repository_path)
+    if current == refspecs:
+        return False
+    if current:
+        subprocess.check_output(
+            ['git', '-C', repository_path, 'config', '--unset-all',
+             'remote.origin.fetch'], stderr=subprocess.STDOUT)
+    for refspec in refspecs:
+        subprocess.check_output(
+            ['git', '-C', repository_path, 'config', '--add',
+             'remote.origin.fetch', refspec], stderr=subprocess.STDOUT)
+    logging.info(M('Changed the refspecs of {0} from {1} to {2}',
+                   repository_path, ' '.join(current), ' '.join(refspecs)))
+    return True
@@ -0,0 +1,149 @@
+"""Ordering of the backup jobs, so the longest ones do not become the tail of
+a parallel run, and sharding of the jobs across backup hosts."""
+
+import hashlib
+import logging
+import os
+import typing
+
+from statsbiblioteket.github_cloner.manifest import Manifest
+from statsbiblioteket.github_cloner.messages import M
+from statsbiblioteket.github_cloner.myTypes import Path, Repository
+
+# The assumed transfer rate when no previous run tells otherwise, 10 MB/s
+DEFAULT_SECONDS_PER_KB = 1 / (10 * 1024)
+
+
+def seconds_per_kb(repositories: typing.Iterable[Repository],
+                   manifest: Manifest = None) -> float:
+    """
+    Estimate how long a KB takes to backup, from the durations recorded in
+    previous runs.
+
+    :param repositories: the repositories to estimate from
+    :param manifest: the manifest of previous backups
+    :return: the estimated seconds per KB
+    """
+    if manifest is None:
+        return DEFAULT_SECONDS_PER_KB
+    total_size = 0
+    total_duration = 0.0
+    for repository in repositories:
+        duration = manifest.duration(repository)
+        if duration is not None and repository.size:
+            total_size += repository.size
+            total_duration += duration
+    if total_size == 0:
+        return DEFAULT_SECONDS_PER_KB
+    return total_duration / total_size
+
+
+def expected_duration(repository: Repository,
+                      manifest: Manifest = None,
+                      rate: float = DEFAULT_SECONDS_PER_KB) -> float:
+    """
+    The expected duration of backing up a repository. This is the duration
+    of the previous run if it is known, otherwise an estimate from the size
+    github reports.
+
+    :param repository: the repository
+    :param manifest: the manifest of previous backups
+    :param rate: the estimated seconds per KB
+    :return: the expected duration in seconds
+    """
+    if manifest is not None:
+        duration = manifest.duration(repository)
+        if duration is not None:
+            return duration
+    return (repository.size or 0) * rate
+
+
+def order_jobs(repositories: typing.Iterable[Repository],
+               manifest: Manifest = None) -> typing.List[Repository]:
+    """
+    Order the repositories longest expected backup first.
+
+    Starting the longest jobs first keeps a few large repositories from
+    running alone at the end of a parallel run, long after every other worker
+    has gone idle.
+
+    :param repositories: the repositories to backup
+    :param manifest: the manifest of previous backups
+    :return: the repositories, longest expected backup first
+    """
+    repositories = list(repositories)
+    rate = seconds_per_kb(repositories, manifest)
+    ordered = sorted(repositories,
+                     key=lambda repository: expected_duration(repository,
+                                                              manifest,
+                                                              rate),
+                     reverse=True)
+    if ordered:
+        logging.debug(M('Scheduled {0} repositories, the longest expected '
+                        'is {1}', len(ordered), ordered[0].name))
+    return ordered
+
+
+def shard_of(repository: Repository, shard_count: int) -> int:
+    """
+    The shard a repository belongs to.
+
+    The shard is a stable hash of the github id of the repository, or of its
+    clone url if the id is unknown, so a repository stays in its shard when
+    other repositories are added or removed, and on every host.
+
+    :param repository: the repository
+    :param shard_count: the number of shards
+    :return: the shard, from 0 to shard_count - 1
+    """
+    key = repository.url if repository.id is None else str(repository.id)
+    digest = hashlib.sha1(key.encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') % shard_count
+
+
+def select_shard(repositories: typing.Iterable[Repository],
+                 shard_index: int,
+                 shard_count: int) -> typing.Iterator[Repository]:
+    """
+    Select the repositories of one shard.
+
+    :param repositories: the repositories
+    :param shard_index: the shard to select, from 0 to shard_count - 1
+    :param shard_count: the number of shards
+    :return: an iterator over the repositories in the shard
+    """
+    for repository in repositories:
+        if shard_of(repository, shard_count) == shard_index:
+            yield repository
+
+
+def shard_owner(shard_index: int, shard_count: int) -> typing.Optional[str]:
+    """
+    The name of a shard, marking the files and directories that belong to
+    it where several backup hosts share a directory.
+
+    :param shard_index: the shard, from 0 to shard_count - 1
+    :param shard_count: the number of shards
+    :return: e.g. 'shard-1-of-4', or None if the backup is not sharded
+    """
+    if shard_count <= 1:
+        return None
+    return 'shard-{0}-of-{1}'.format(shard_index, shard_count)
+
+
+def shard_file(path: Path, shard_index: int, shard_count: int) -> Path:
+    """
+    The file of a shard, e.g. github_cloner_manifest.shard-1-of-4.json for
+    github_cloner_manifest.json, so the hosts sharing a directory do not
+    overwrite each other's files.
+
+    :param path: the file of an unsharded backup
+    :param shard_index: the shard, from 0 to shard_count - 1
+    :param shard_count: the number of shards
+    :return: the file of the shard, or path if the backup is not sharded
+    """
+    owner = shard_owner(shard_index, shard_count)
+    if owner is None:
+        return path
+    base, extension = os.path.splitext(path)
+    return '{0}.{1}{2}'.format(base, owner, extension)
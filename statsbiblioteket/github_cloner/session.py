@@ -0,0 +1,71 @@
+"""A pooled HTTP session shared by all the github API calls."""
+
+import logging
+import typing
+
+import requests
+import requests.adapters
+
+from statsbiblioteket.github_cloner.messages import M
+
+
+class GithubSession(requests.Session):
+    """
+    A requests Session for the github API.
+
+    Connections are kept alive and pooled, so every listing call, including
+    concurrent ones, reuses the same TCP+TLS connections instead of opening a
+    new one per request. Every request gets the session timeout unless
+    another timeout is given.
+    """
+
+    def __init__(self, token: str = None, pool_size: int = 10,
+                 timeout: float = 30.0):
+        """
+        A pooled requests Session for the github API.
+
+        :param token: the github token to authenticate with, or None to make
+            anonymous requests
+        :param pool_size: the maximum number of connections kept open per host
+        :param timeout: the default timeout of requests, in seconds
+        """
+        super().__init__()
+        self.timeout = timeout
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size,
+                                                pool_maxsize=pool_size)
+        self.mount('https://', adapter)
+        self.mount('http://', adapter)
+        self.headers['Accept'] = 'application/vnd.github.v3+json'
+        self.headers['Connection'] = 'keep-alive'
+        if token:
+            self.headers['Authorization'] = 'token ' + token
+
+    def request(self, method, url, **kwargs) -> requests.Response:
+        kwargs.setdefault('timeout', self.timeout)
+        return super().request(method, url, **kwargs)
+
+    def connection_stats(self) -> typing.Dict[str, typing.Tuple[int, int]]:
+        """
+        The connection reuse statistics of the session.
+
+        :return: a dict from host to a tuple of the number of connections
+            opened and the number of requests made to that host
+        """
+        stats = {}
+        for adapter in set(self.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools[key]
+                connections, requests_made = stats.get(pool.host, (0, 0))
+                stats[pool.host] = (connections + pool.num_connections,
+                                    requests_made + pool.num_requests)
+        return stats
+
+    def log_connection_stats(self):
+        """Log the connection reuse statistics of the session at debug"""
+        for host, (connections, requests_made) in \
+                sorted(self.connection_stats().items()):
+            logging.debug(M('{0}: {1} requests over {2} connections, '
+                            '{3} requests reused a connection', host,
+                            requests_made, connections,
+                            max(requests_made - connections, 0)))
@@ -0,0 +1,388 @@
+"""A long running watch mode, fetching the repositories that github reports
+as pushed to, instead of checking every repository on a schedule."""
+
+import hashlib
+import hmac
+import http.server
+import json
+import logging
+import socketserver
+import threading
+import time
+import typing
+
+import requests
+
+from statsbiblioteket.github_cloner.messages import M
+from statsbiblioteket.github_cloner.myTypes import BackupResult, RepoType, \
+    Repository, UserType, Url
+from statsbiblioteket.github_cloner.workqueue import Job
+
+# The events that change the refs of a repository
+PUSH_EVENTS = ('PushEvent', 'CreateEvent', 'DeleteEvent')
+
+# The interval github asks for when it does not say otherwise
+DEFAULT_POLL_INTERVAL = 60.0
+
+
+def full_name(account: str, name: str) -> str:
+    """
+    :return: the key of a repository in the events, 'owner/name' in lower
+        case
+    """
+    return '{0}/{1}'.format(account, name).lower()
+
+
+class EventPoller(object):
+    """
+    Polling of the events feed of a github user/org for pushes.
+
+    The feed is polled with the ETag of the previous response, so an
+    unchanged feed costs a 304 that does not count against the rate limit.
+    The events of the first poll are only noted, as the watch starts with a
+    full sweep anyway.
+    """
+
+    def __init__(self, github_name: str, user_type: UserType,
+                 api_url: Url, get: typing.Callable = requests.get):
+        """
+        Polling of the events of an account.
+
+        :param github_name: the name of the organisation/user on github
+        :param user_type: enum USER or ORG
+        :param api_url: the base url of the github API
+        :param get: the function performing the GET requests
+        """
+        self.github_name = github_name
+        self.url = '{0}/{1}/{2}/events'.format(api_url, user_type.value,
+                                               github_name)
+        self.get = get
+        self.etag = None
+        self.last_event_id = None
+        self.interval = DEFAULT_POLL_INTERVAL
+
+    def poll(self) -> typing.Tuple[typing.Set[str], bool]:
+        """
+        Poll the events feed once.
+
+        :return: the full names of the repositories pushed to since the last
+            poll, and whether events may have been missed, because every
+            event in the feed was new
+        :raises requests.HTTPError: If github refused the request
+        """
+        headers = {'If-None-Match': self.etag} if self.etag else {}
+        response = self.get(self.url, params={'per_page': 100},
+                            headers=headers)
+        self.interval = float(response.headers.get('X-Poll-Interval',
+                                                   DEFAULT_POLL_INTERVAL))
+        if response.status_code == 304:
+            return set(), False
+        response.raise_for_status()
+        self.etag = response.headers.get('ETag')
+        events = response.json()
+        if self.last_event_id is None:
+            self._note(events)
+            return set(), False
+        new = [event for event in events
+               if int(event['id']) > self.last_event_id]
+        self._note(events)
+        pushed = set(event['repo']['name'].lower() for event in new
+                     if event.get('type') in PUSH_EVENTS)
+        missed = bool(events) and len(new) == len(events)
+        if pushed:
+            logging.debug(M('The events of {0} report pushes to {1}',
+                            self.github_name, ', '.join(sorted(pushed))))
+        return pushed, missed
+
+    def _note(self, events: typing.List[dict]):
+        ids = [int(event['id']) for event in events]
+        if ids:
+            self.last_event_id = max(ids + [self.last_event_id or 0])
+        elif self.last_event_id is None:
+            self.last_event_id = 0
+
+
+class Debouncer(object):
+    """
+    Collection of the changed repositories until they have been quiet for a
+    while, so a burst of pushes to a repository is fetched once.
+    """
+
+    def __init__(self, delay: float = 30.0,
+                 clock: typing.Callable[[], float] = time.monotonic):
+        """
+        An empty debouncer.
+
+        :param delay: the seconds a repository must be quiet before it is due
+        :param clock: the monotonic clock, in seconds
+        """
+        self.delay = delay
+        self.clock = clock
+        self._touched = {}
+        self._lock = threading.Lock()
+
+    def touch(self, key: str):
+        """Note that a repository changed"""
+        with self._lock:
+            self._touched[key] = self.clock()
+
+    def due(self) -> typing.List[str]:
+        """
+        Take the repositories that have been quiet for the delay.
+
+        :return: the repositories, which are forgotten until touched again
+        """
+        with self._lock:
+            now = self.clock()
+            keys = [key for key, touched in self._touched.items()
+                    if now - touched >= self.delay]
+            for key in keys:
+                del self._touched[key]
+            return sorted(keys)
+
+    def next_due(self) -> typing.Optional[float]:
+        """
+        :return: when the next repository is due, on the clock, or None if
+            none are waiting
+        """
+        with self._lock:
+            if not self._touched:
+                return None
+            return min(self._touched.values()) + self.delay
+
+
+class WebhookServer(object):
+    """
+    A local HTTP endpoint for the push webhooks of github.
+
+    Push deliveries are checked against the X-Hub-Signature-256 header when
+    a secret is given, and the repositories they name are passed on.
+    Everything else is acknowledged and ignored.
+    """
+
+    def __init__(self, on_push: typing.Callable[[str], None],
+                 host: str = '127.0.0.1', port: int = 0,
+                 secret: str = None):
+        """
+        A webhook endpoint.
+
+        :param on_push: called with the full name of every repository
+            pushed to
+        :param host: the address to listen on
+        :param port: the port to listen on, 0 for any free port
+        :param secret: the secret of the webhook, or None to accept unsigned
+            deliveries
+        """
+        self.on_push = on_push
+        self.host = host
+        self.port = port
+        self.secret = secret
+        self._server = None
+        self._thread = None
+
+    def _verify(self, body: bytes, signature: str) -> bool:
+        if self.secret is None:
+            return True
+        expected = 'sha256=' + hmac.new(self.secret.encode('utf-8'), body,
+                                        hashlib.sha256).hexdigest()
+        return hmac.compare_digest(expected, signature or '')
+
+    def start(self) -> 'WebhookServer':
+        webhook = self
+
+        class _Handler(http.server.BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                body = self.rfile.read(length)
+                if not webhook._verify(
+                        body, self.headers.get('X-Hub-Signature-256')):
+                    logging.warning(M('Rejected a webhook delivery with a '
+                                      'bad signature from {0}',
+                                      self.client_address[0]))
+                    self._reply(401)
+                    return
+                event = self.headers.get('X-GitHub-Event')
+                if event in ('push', 'create', 'delete'):
+                    try:
+                        name = json.loads(body.decode('utf-8'))[
+                            'repository']['full_name']
+                    except (ValueError, KeyError, TypeError):
+                        self._reply(400)
+                        return
+                    logging.debug(M('Webhook reports a {0} to {1}', event,
+                                    name))
+                    webhook.on_push(name.lower())
+                self._reply(204)
+
+            def _reply(self, status: int):
+                self.send_response(status)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                logging.debug('Webhook: ' + format, *args)
+
+        class _Server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+            daemon_threads = True
+
+        self._server = _Server((self.host, self.port), _Handler)
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        name='webhook', daemon=True)
+        self._thread.start()
+        logging.info(M('Listening for webhooks on {0}:{1}', self.host,
+                       self.port))
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+
+class Watcher(object):
+    """
+    The watch mode: a full sweep of all the accounts at the start and every
+    sweep_interval, and in between fetches of only the repositories the
+    events feeds or the webhooks report as pushed to.
+
+    Reported repositories are fetched once they have been quiet for the
+    debounce delay. A repository the last sweep did not list, e.g. a new
+    one, brings the next sweep forward, as does an events feed that may
+    have skipped events. Repositories of accounts that are not watched,
+    which the events of a user report when the user pushes elsewhere, are
+    ignored, and so are the repositories the last sweep listed but did not
+    backup, as they belong to another shard or the filter skipped them.
+    The sweep tells the watcher what it listed through listed.
+    """
+
+    def __init__(self,
+                 sweep: typing.Callable[[], typing.List[BackupResult]],
+                 fetch: typing.Callable[[typing.List[Job]],
+                                        typing.List[BackupResult]],
+                 pollers: typing.List[EventPoller],
+                 sweep_interval: float = 6 * 60 * 60,
+                 min_poll_interval: float = DEFAULT_POLL_INTERVAL,
+                 debounce: float = 30.0,
+                 clock: typing.Callable[[], float] = time.monotonic):
+        """
+        The watch mode.
+
+        :param sweep: backs up every repository of every account
+        :param fetch: backs up the repositories of the jobs, whatever the
+            manifest says
+        :param pollers: the pollers of the events feeds
+        :param sweep_interval: the seconds between full sweeps
+        :param min_poll_interval: the fewest seconds between polls, github
+            may ask for more
+        :param debounce: the seconds a repository must be quiet before it is
+            fetched
+        :param clock: the monotonic clock, in seconds
+        """
+        self.sweep = sweep
+        self.fetch = fetch
+        self.pollers = pollers
+        self.sweep_interval = sweep_interval
+        self.min_poll_interval = min_poll_interval
+        self.clock = clock
+        self.debouncer = Debouncer(debounce, clock)
+        self.accounts = set(poller.github_name.lower()
+                            for poller in pollers)
+        self.catalogue = {}
+        self.ignored = set()
+        self.sweep_requested = threading.Event()
+        self._stop = threading.Event()
+        self._listed = set()
+        self._lock = threading.Lock()
+
+    def changed(self, name: str):
+        """
+        Note that a repository was pushed to.
+
+        :param name: the full name of the repository, 'owner/name'
+        """
+        self.debouncer.touch(name.lower())
+
+    def listed(self, account: str, repository: Repository):
+        """
+        Note that the sweep in progress listed a repository, whether it backs
+        it up or not.
+
+        :param account: the github user/org the repository was listed for
+        :param repository: the repository
+        """
+        with self._lock:
+            self._listed.add(full_name(account, repository.name))
+
+    def stop(self):
+        """Stop watching, after the backup in progress"""
+        self._stop.set()
+
+    def _sweep(self):
+        logging.info('Starting a full sweep of all accounts')
+        self.sweep_requested.clear()
+        with self._lock:
+            self._listed = set()
+        results = self.sweep()
+        self.catalogue = {}
+        for result in results:
+            metrics = result.metrics
+            self.catalogue[full_name(metrics.account,
+                                     result.repository.name)] = Job(
+                result.repository, metrics.account,
+                RepoType(metrics.repo_type))
+        with self._lock:
+            self.ignored = self._listed - set(self.catalogue)
+
+    def _poll(self):
+        for poller in self.pollers:
+            try:
+                pushed, missed = poller.poll()
+            except requests.RequestException as error:
+                logging.warning(M('Failed to poll the events of {0}: {1}',
+                                  poller.github_name, error))
+                continue
+            for name in pushed:
+                self.changed(name)
+            if missed:
+                logging.info(M('Events of {0} may have been missed, '
+                               'sweeping early', poller.github_name))
+                self.sweep_requested.set()
+
+    def _fetch_due(self):
+        jobs = []
+        for name in self.debouncer.due():
+            job = self.catalogue.get(name)
+            if name.partition('/')[0] not in self.accounts or \
+                    name in self.ignored:
+                logging.debug(M('{0} is not backed up here, ignoring its '
+                                'push', name))
+            elif job is None:
+                logging.info(M('{0} was not in the last sweep, sweeping '
+                               'early', name))
+                self.sweep_requested.set()
+            else:
+                jobs.append(job)
+        if jobs:
+            logging.info(M('Fetching {0} pushed repositories', len(jobs)))
+            self.fetch(jobs)
+
+    def run(self):
+        """Watch until stopped"""
+        next_sweep = self.clock()
+        next_poll = self.clock()
+        while not self._stop.is_set():
+            if self.clock() >= next_sweep or self.sweep_requested.is_set():
+                self._sweep()
+                next_sweep = self.clock() + self.sweep_interval
+            if self.clock() >= next_poll:
+                self._poll()
+                next_poll = self.clock() + max(
+                    [self.min_poll_interval] +
+                    [poller.interval for poller in self.pollers])
+            self._fetch_due()
+            wake = min(next_sweep, next_poll)
+            if self.debouncer.next_due() is not None:
+                wake = min(wake, self.debouncer.next_due())
+            # Wake up regularly to notice webhooks and early sweeps
+            self._stop.wait(min(max(wake - self.clock(), 0), 1.0))
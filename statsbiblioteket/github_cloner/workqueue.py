@@ -0,0 +1,201 @@
+"""A single queue of backup jobs for all the accounts of a run, fed by their
+listings as they stream in."""
+
+import heapq
+import logging
+import threading
+import typing
+
+from statsbiblioteket.github_cloner.messages import M
+from statsbiblioteket.github_cloner.myTypes import RepoType, Repository
+
+# The jobs to queue ahead of the backup before the listings are held back
+MAX_QUEUED_JOBS = 1000
+
+
+class QueueClosed(Exception):
+    """The queue was closed, so no more jobs are taken"""
+
+
+class Job(object):
+    """The backup of a repository listed for an account"""
+    __slots__ = ('repository', 'account', 'repo_type', 'priority')
+
+    def __init__(self, repository: Repository, account: str,
+                 repo_type: RepoType, priority: int = 0):
+        """
+        The backup of a repository.
+
+        :param repository: the repository
+        :param account: the github user/org it was listed for
+        :param repo_type: enum REPO or GIST
+        :param priority: jobs with a higher priority are started first
+        """
+        self.repository = repository
+        self.account = account
+        self.repo_type = repo_type
+        self.priority = priority
+
+
+class WorkQueue(object):
+    """
+    A priority queue of backup jobs, deduplicated by clone url.
+
+    The listings put jobs into the queue from their threads while the
+    backup takes them out. A repository listed by several accounts is
+    backed up once. If the accounts are given in order of preference, it is
+    backed up for the first of them that listed it before it was taken out,
+    rather than for whichever listing came first.
+
+    Jobs with a higher priority come first. Jobs of the same priority are
+    interleaved across accounts, the first job of every account, then the
+    second job of every account and so on, so the git work is spread over
+    all the accounts instead of working through them one at a time. A key
+    function replaces this interleaving, e.g. to order by expected duration.
+    When the queue holds the jobs until every listing is done, the order is
+    only decided then, so the key can depend on all the jobs.
+
+    Unless it holds the jobs, the queue can be bounded, so listings faster
+    than the backup wait for it instead of queueing every repository of the
+    accounts.
+    """
+
+    def __init__(self, key: typing.Callable[[Job], typing.Any] = None,
+                 hold: bool = False, max_size: int = None,
+                 accounts: typing.Sequence[str] = ()):
+        """
+        An empty queue.
+
+        :param key: the order of the jobs within a priority, or None to
+            interleave the accounts
+        :param hold: hand out no jobs until every listing is done, so the
+            key orders all of them. The key is not called before then
+        :param max_size: the most jobs to queue before put waits for get,
+            or None for no bound. Ignored if hold is set
+        :param accounts: the accounts in order of preference for backing up
+            the repositories listed by several of them
+        """
+        self.key = key
+        self.hold = hold
+        self.max_size = max_size
+        self.duplicates = 0
+        self._ranks = dict((account, rank)
+                           for rank, account in enumerate(accounts))
+        self._held = []
+        self._heap = []
+        self._urls = set()
+        # The jobs not taken out yet, by clone url
+        self._queued = {}
+        self._account_counts = {}
+        self._sequence = 0
+        self._producers = 0
+        self._closed = False
+        self._condition = threading.Condition()
+
+    def add_producer(self):
+        """Register a listing that will put jobs into the queue"""
+        with self._condition:
+            self._producers += 1
+
+    def producer_done(self):
+        """Register that a listing has put all its jobs into the queue"""
+        with self._condition:
+            self._producers -= 1
+            self._condition.notify_all()
+
+    def put(self, job: Job) -> bool:
+        """
+        Put a job into the queue, unless its repository was queued before,
+        waiting while the queue is full.
+
+        :param job: the job
+        :return: False if the job was a duplicate and was dropped
+        :raises QueueClosed: If the queue was closed, also while waiting
+        """
+        with self._condition:
+            while not self._closed and not self.hold and \
+                    self.max_size is not None and \
+                    len(self._queued) >= self.max_size:
+                self._condition.wait()
+            if self._closed:
+                raise QueueClosed('the backup stopped taking jobs')
+            url = job.repository.url
+            if url in self._urls:
+                self.duplicates += 1
+                queued = self._queued.get(url)
+                if queued is not None and self._rank(job) < self._rank(queued):
+                    logging.debug(M('{0} was listed again by {1}, backing it '
+                                    'up for {1} instead of {2}', url,
+                                    job.account, queued.account))
+                    self._queued[url] = job
+                    if self.hold:
+                        self._held[self._held.index(queued)] = job
+                    else:
+                        # The entry of the queued job is dropped by get
+                        self._push(job)
+                else:
+                    logging.debug(M('{0} was listed again by {1}, skipping '
+                                    'the duplicate', url, job.account))
+                return False
+            self._urls.add(url)
+            self._queued[url] = job
+            if self.hold:
+                self._held.append(job)
+            else:
+                self._push(job)
+            self._condition.notify_all()
+            return True
+
+    def close(self):
+        """
+        Stop taking jobs, e.g. because the backup failed, waking the
+        listings waiting for room so they can stop.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def _rank(self, job: Job) -> int:
+        return self._ranks.get(job.account, len(self._ranks))
+
+    def _push(self, job: Job):
+        if self.key is not None:
+            order = self.key(job)
+        else:
+            order = self._account_counts.get(job.account, 0)
+            self._account_counts[job.account] = order + 1
+        self._sequence += 1
+        heapq.heappush(self._heap, (-job.priority, order, self._sequence, job))
+
+    def get(self) -> typing.Optional[Job]:
+        """
+        Take the next job out of the queue, waiting for the listings if the
+        queue is empty.
+
+        :return: the job, or None when every listing is done and the queue
+            is empty
+        """
+        with self._condition:
+            while (not self._queued or self.hold) and self._producers > 0:
+                self._condition.wait()
+            if self._held:
+                held, self._held = self._held, []
+                for job in held:
+                    self._push(job)
+            while self._queued:
+                job = heapq.heappop(self._heap)[-1]
+                if self._queued.get(job.repository.url) is not job:
+                    # Replaced by the job of a preferred account
+                    continue
+                del self._queued[job.repository.url]
+                # Let a listing waiting for room put its next job
+                self._condition.notify_all()
+                return job
+            return None
+
+    def __iter__(self) -> typing.Iterator[Job]:
+        while True:
+            job = self.get()
+            if job is None:
+                return
+            yield job
@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_benchmarks
+----------------------------------
+
+Tests for the offline `benchmarks` harness.
+"""
+import tempfile
+
+from benchmarks.fakegithub import FakeGithub
+from benchmarks.remotes import create_remotes, gist_entry
+from benchmarks.run import run
+from statsbiblioteket.github_cloner import RepoType, UserType
+from statsbiblioteket.github_cloner.github_cloner import \
+    get_github_repositories
+
+
+class TestBenchmarks:
+    def test_fake_github_paginates(self):
+        entries = create_remotes(tempfile.mkdtemp(), 5, commits=2)
+        gists = [gist_entry('abc', entries[0]['ssh_url'])]
+        listings = {'/orgs/bench/repos': entries,
+                    '/users/bench/gists': gists}
+        with FakeGithub(listings) as fake:
+            repositories = get_github_repositories(
+                'bench', UserType.ORG, RepoType.REPO, batch_size=2,
+                api_url=fake.url)
+            gist_repositories = get_github_repositories(
+                'bench', UserType.USER, RepoType.GIST, api_url=fake.url)
+
+        assert [repository.name for repository in repositories] == \
+            [entry['name'] for entry in entries]
+        assert len(fake.requests) == 4
+        assert gist_repositories[0].name == 'abc'
+
+    def test_run(self):
+        results = run(repositories=3, commits=2, files_per_commit=1,
+                      file_size=128, jobs=2)
+
+        scenarios = {scenario['scenario']: scenario
+                     for scenario in results['scenarios']}
+        assert sorted(scenarios) == ['cold', 'push', 'warm',
+                                     'warm-manifest']
+        assert all(scenario['failed'] == 0
+                   for scenario in scenarios.values())
+        assert scenarios['warm-manifest']['skipped'] == 3
+        assert scenarios['push']['skipped'] == 0
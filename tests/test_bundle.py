@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_bundle
+----------------------------------
+
+Tests for `bundle` module.
+"""
+import os
+import subprocess
+import tempfile
+
+import pytest
+
+from benchmarks.remotes import add_commits, create_remote
+from statsbiblioteket.github_cloner import bundle
+from statsbiblioteket.github_cloner.bundle import BundleExporter, \
+    latest_snapshot, list_refs, restore, snapshots
+from statsbiblioteket.github_cloner.github_cloner import export_bundles, \
+    fetch_or_clone
+from statsbiblioteket.github_cloner.myTypes import BackupResult, Repository
+
+
+def _age(repository_path, seconds):
+    """Move the modification times of a repository back in time"""
+    for directory, _, files in os.walk(repository_path):
+        for path in [directory] + [os.path.join(directory, name)
+                                   for name in files]:
+            modified = os.stat(path).st_mtime - seconds
+            os.utime(path, (modified, modified))
+
+
+class TestBundle:
+    @pytest.fixture()
+    def tempdir(self):
+        return tempfile.mkdtemp()
+
+    @pytest.fixture()
+    def remote(self, tempdir):
+        path = os.path.join(tempdir, 'remote.git')
+        create_remote(path, commits=3)
+        return path
+
+    def test_exports_only_changes(self, tempdir, remote):
+        mirror = os.path.join(tempdir, 'mirror.git')
+        exporter = BundleExporter(os.path.join(tempdir, 'export'))
+        fetch_or_clone('file://' + remote, mirror)
+
+        first = exporter.export(mirror)
+        assert first['sequence'] == 1
+        assert first['changed'] == ['refs/heads/master']
+        assert first['prerequisites'] == []
+        assert exporter.export(mirror) is None
+
+        add_commits(remote, commits=2)
+        fetch_or_clone('file://' + remote, mirror)
+        second = exporter.export(mirror)
+
+        assert second['sequence'] == 2
+        assert second['prerequisites'] == \
+            [first['refs']['refs/heads/master']]
+        assert 0 < second['size'] < first['size']
+        directory = os.path.join(tempdir, 'export', 'mirror.git')
+        assert sorted(os.listdir(directory)) == [
+            '00000001.bundle', '00000001.json',
+            '00000002.bundle', '00000002.json']
+
+    def test_restore_replays_the_chain(self, tempdir, remote):
+        mirror = os.path.join(tempdir, 'mirror.git')
+        exporter = BundleExporter(os.path.join(tempdir, 'export'))
+        fetch_or_clone('file://' + remote, mirror)
+        exporter.export(mirror)
+        add_commits(remote, commits=2)
+        fetch_or_clone('file://' + remote, mirror)
+        exporter.export(mirror)
+        # A new branch at an exported commit needs no bundle
+        subprocess.check_call(['git', '-C', mirror, 'branch', 'old',
+                               'master~2'])
+        exporter.export(mirror)
+        subprocess.check_call(['git', '-C', mirror, 'branch', '-D', 'old'])
+        exporter.export(mirror)
+
+        directory = os.path.join(tempdir, 'export', 'mirror.git')
+        assert [index['bundle'] is None
+                for index in snapshots(directory)] == \
+            [False, False, True, True]
+        restored = os.path.join(tempdir, 'restored.git')
+        assert restore(directory, restored) == 4
+        assert list_refs(restored) == list_refs(mirror)
+        subprocess.check_call(['git', '-C', restored, 'fsck',
+                               '--no-dangling'])
+
+    def test_restore_detects_corrupt_bundle(self, tempdir, remote):
+        mirror = os.path.join(tempdir, 'mirror.git')
+        exporter = BundleExporter(os.path.join(tempdir, 'export'))
+        fetch_or_clone('file://' + remote, mirror)
+        exporter.export(mirror)
+        directory = os.path.join(tempdir, 'export', 'mirror.git')
+        with open(os.path.join(directory, '00000001.bundle'), 'ab') as bundle:
+            bundle.write(b'garbage')
+
+        with pytest.raises(ValueError):
+            restore(directory, os.path.join(tempdir, 'restored.git'))
+
+    def test_exports_under_a_name(self, tempdir, remote):
+        mirror = os.path.join(tempdir, 'mirror.git')
+        exporter = BundleExporter(os.path.join(tempdir, 'export'))
+        fetch_or_clone('file://' + remote, mirror)
+
+        exporter.export(mirror, name=os.path.join('org', 'repos',
+                                                  'mirror.git'))
+
+        assert len(snapshots(os.path.join(tempdir, 'export', 'org', 'repos',
+                                          'mirror.git'))) == 1
+
+    def test_migrates_exports_by_renaming(self, tempdir, remote):
+        mirror = os.path.join(tempdir, 'mirror.git')
+        exporter = BundleExporter(os.path.join(tempdir, 'export'))
+        fetch_or_clone('file://' + remote, mirror)
+        exporter.export(mirror)
+        name = os.path.join('org', 'repos', 'mirror.git')
+
+        assert exporter.migrate(mirror, name, 'mirror.git')
+        add_commits(remote, commits=1)
+        fetch_or_clone('file://' + remote, mirror)
+        second = exporter.export(mirror, name=name)
+
+        assert second['sequence'] == 2
+        assert not os.path.exists(os.path.join(tempdir, 'export',
+                                               'mirror.git'))
+
+    def test_leaves_exports_of_other_mirrors(self, tempdir, remote):
+        mirror = os.path.join(tempdir, 'mirror.git')
+        exporter = BundleExporter(os.path.join(tempdir, 'export'))
+        fetch_or_clone('file://' + remote, mirror)
+        exporter.export(mirror)
+        other = os.path.join(tempdir, 'other.git')
+        create_remote(other, commits=1)
+
+        assert not exporter.migrate(other, 'org/repos/mirror.git',
+                                    'mirror.git')
+
+    def test_defers_partial_mirrors(self, tempdir, remote):
+        subprocess.check_call(['git', '-C', remote, 'config',
+                               'uploadpack.allowFilter', 'true'])
+        mirror = os.path.join(tempdir, 'mirror.git')
+        exporter = BundleExporter(os.path.join(tempdir, 'export'))
+        fetch_or_clone('file://' + remote, mirror, partial_filter='blob:none')
+        result = BackupResult(Repository(name='mirror', description='',
+                                         url='file://' + remote), mirror)
+
+        assert export_bundles([result], exporter) == []
+        assert not os.path.exists(os.path.join(tempdir, 'export'))
+
+    def test_skipped_mirrors_are_exported_only_if_changed(self, tempdir,
+                                                          remote,
+                                                          monkeypatch):
+        mirror = os.path.join(tempdir, 'mirror.git')
+        exporter = BundleExporter(os.path.join(tempdir, 'export'))
+        fetch_or_clone('file://' + remote, mirror)
+        result = BackupResult(Repository(name='mirror', description='',
+                                         url='file://' + remote), mirror,
+                              skipped=True)
+        directory = os.path.join(tempdir, 'export', 'mirror.git')
+
+        assert not exporter.is_current(mirror)
+        assert export_bundles([result], exporter) == []
+        assert latest_snapshot(directory)['sequence'] == 1
+        # Changes within the resolution of the modification times are not
+        # told apart from the export
+        assert not exporter.is_current(mirror)
+        _age(mirror, seconds=60)
+        assert exporter.is_current(mirror)
+        monkeypatch.setattr(bundle, 'list_refs', None)
+        assert export_bundles([result], exporter) == []
+        monkeypatch.undo()
+
+        # A fetch whose export was interrupted
+        add_commits(remote, commits=1)
+        fetch_or_clone('file://' + remote, mirror)
+
+        assert not exporter.is_current(mirror)
+        assert export_bundles([result], exporter) == []
+        assert latest_snapshot(directory)['sequence'] == 2
+        assert len(snapshots(directory)) == 2
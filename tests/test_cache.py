@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_cache
+----------------------------------
+
+Tests for `cache` module.
+"""
+import os
+import tempfile
+import time
+
+import pytest
+
+from statsbiblioteket.github_cloner.cache import HttpCache
+from test_github_cloner import make_response
+
+
+class TestHttpCache:
+    @pytest.fixture()
+    def cache(self):
+        return HttpCache(tempfile.mkdtemp())
+
+    def test_replays_body_on_not_modified(self, cache):
+        requests_made = []
+
+        def _get(url, params=None, headers=None):
+            requests_made.append(headers)
+            if headers.get('If-None-Match') == '"v1"':
+                return make_response(None, status_code=304)
+            return make_response([{'name': 'repo'}], headers={'ETag': '"v1"'})
+
+        first = cache.get('https://api.github.com/users/x/repos',
+                          {'page': 1}, get=_get)
+        second = cache.get('https://api.github.com/users/x/repos',
+                           {'page': 1}, get=_get)
+
+        assert first.json() == second.json() == [{'name': 'repo'}]
+        assert second.status_code == 200
+        assert requests_made == [{}, {'If-None-Match': '"v1"'}]
+
+    def test_pages_are_cached_separately(self, cache):
+        def _get(url, params=None, headers=None):
+            assert 'If-None-Match' not in headers
+            return make_response([params['page']], headers={'ETag': '"v1"'})
+
+        cache.get('https://api.github.com/users/x/repos', {'page': 1},
+                  get=_get)
+        cache.get('https://api.github.com/users/x/repos', {'page': 2},
+                  get=_get)
+
+    def test_evicts_old_and_oversized_entries(self, cache):
+        for page in range(3):
+            cache.get('https://api.github.com/users/x/repos', {'page': page},
+                      get=lambda url, params=None, headers=None:
+                      make_response(['x' * 100], headers={'ETag': '"v1"'}))
+        entries = sorted(os.listdir(cache.directory))
+        old = os.path.join(cache.directory, entries[0])
+        os.utime(old, (time.time() - 3600, time.time() - 3600))
+
+        cache.max_age = 60
+        cache.evict()
+        assert len(os.listdir(cache.directory)) == 2
+
+        cache.max_size = 1
+        cache.evict()
+        assert os.listdir(cache.directory) == []
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_concurrency
+----------------------------------
+
+Tests for `concurrency` module.
+"""
+import os
+import tempfile
+
+from benchmarks.remotes import create_remotes
+from statsbiblioteket.github_cloner import github_cloner
+from statsbiblioteket.github_cloner.concurrency import \
+    ConcurrencyController, DiskUtilisation
+from statsbiblioteket.github_cloner.github_cloner import github_backup, \
+    parse_github_repositories
+from statsbiblioteket.github_cloner.myTypes import RepoType
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeDisk(object):
+    def __init__(self, busy=None):
+        self.busy = busy
+
+    def sample(self):
+        return self.busy
+
+
+def run_round(controller, clock, seconds=1.0, bytes_received=1000):
+    """Finish a round of operations, one after the other"""
+    for _ in range(controller.limit):
+        clock.now += seconds
+        controller.record(seconds, bytes_received)
+
+
+def run_parallel_round(controller, clock, seconds=1.0, bytes_received=1000,
+                       expected=None):
+    """Finish a round of operations that all ran at the same time"""
+    clock.now += seconds
+    for _ in range(controller.limit):
+        controller.record(seconds, bytes_received, expected=expected)
+
+
+class TestConcurrencyController:
+    def test_increases_while_throughput_improves(self):
+        clock = FakeClock()
+        controller = ConcurrencyController(1, 4, clock=clock)
+
+        run_round(controller, clock)
+        assert controller.limit == 2
+        # Twice the operations in the same time
+        run_round(controller, clock, seconds=0.5)
+        assert controller.limit == 3
+        # The same throughput again
+        run_round(controller, clock, seconds=0.5)
+        assert controller.limit == 3
+
+    def test_stays_within_limits(self):
+        clock = FakeClock()
+        controller = ConcurrencyController(2, 3, initial=10, clock=clock)
+        assert controller.limit == 3
+
+        for _ in range(3):
+            run_round(controller, clock, seconds=0.1)
+        assert controller.limit == 3
+        for _ in range(3):
+            clock.now += 1
+            controller.record(1, ok=False)
+        assert controller.limit == 2
+
+    def test_backs_off_once_on_a_burst_of_failures(self):
+        clock = FakeClock()
+        controller = ConcurrencyController(1, 16, initial=8, clock=clock)
+
+        clock.now = 10
+        for _ in range(4):
+            controller.record(5, ok=False)
+        assert controller.limit == 4
+
+        clock.now = 20
+        controller.record(5, ok=False)
+        assert controller.limit == 2
+
+    def test_backs_off_on_latency_spike(self):
+        clock = FakeClock()
+        controller = ConcurrencyController(1, 16, initial=4, clock=clock)
+
+        run_round(controller, clock, seconds=1.0)
+        assert controller.limit == 5
+        run_round(controller, clock, seconds=10.0)
+        assert controller.limit == 2
+
+    def test_usual_latency_follows_a_lasting_change(self):
+        clock = FakeClock()
+        controller = ConcurrencyController(1, 16, initial=9, clock=clock)
+
+        run_parallel_round(controller, clock, seconds=0.5)
+        for _ in range(20):
+            run_parallel_round(controller, clock, seconds=5.0,
+                               bytes_received=10 ** 6)
+
+        assert controller.limit >= 8
+
+    def test_compares_latency_per_repository(self):
+        clock = FakeClock()
+        controller = ConcurrencyController(1, 16, initial=4, clock=clock)
+
+        run_parallel_round(controller, clock, seconds=0.5, expected=0.5)
+        assert controller.limit == 5
+        # Larger repositories, as slow as they were before
+        run_parallel_round(controller, clock, seconds=5.0, expected=5.0)
+        assert controller.limit == 5
+        # The same repositories, much slower than before
+        run_parallel_round(controller, clock, seconds=20.0, expected=5.0)
+        assert controller.limit == 2
+
+    def test_backs_off_on_busy_disk(self):
+        clock = FakeClock()
+        disk = FakeDisk(busy=0.99)
+        controller = ConcurrencyController(1, 16, initial=4, disk=disk,
+                                           clock=clock)
+
+        run_round(controller, clock)
+        assert controller.limit == 2
+        disk.busy = None
+        run_round(controller, clock)
+        assert controller.limit == 3
+
+    def test_disk_utilisation(self):
+        utilisation = DiskUtilisation(tempfile.gettempdir())
+        busy = utilisation.sample()
+        assert busy is None or 0 <= busy <= 1
+
+
+def test_github_backup_with_controller(monkeypatch):
+    tempdir = tempfile.mkdtemp()
+    entries = create_remotes(os.path.join(tempdir, 'remotes'), 6, commits=1)
+    repositories = parse_github_repositories(entries, RepoType.REPO)
+    monkeypatch.setattr(github_cloner, 'iter_github_repositories',
+                        lambda *args, **kwargs: repositories)
+    os.chdir(tempdir)
+    controller = ConcurrencyController(1, 4)
+
+    results = github_backup('local', concurrency=controller)
+
+    assert len(results) == 6
+    assert all(result.ok for result in results)
+    assert 1 <= controller.limit <= 4
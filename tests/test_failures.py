@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_failures
+----------------------------------
+
+Tests for `failures` module.
+"""
+import subprocess
+
+import pytest
+
+from statsbiblioteket.github_cloner.failures import PERMANENT, TIMEOUT, \
+    TRANSIENT, UNKNOWN, RetryPolicy, classify_failure, summarise_failures
+from statsbiblioteket.github_cloner.gitprocess import GitStalled
+from statsbiblioteket.github_cloner.metrics import RepositoryMetrics
+from statsbiblioteket.github_cloner.myTypes import BackupResult, Repository
+
+
+def git_error(output: bytes) -> subprocess.CalledProcessError:
+    return subprocess.CalledProcessError(128, ['git', 'fetch'], output)
+
+
+NETWORK_ERROR = git_error(b'fatal: unable to access '
+                          b"'https://github.com/kb-dk/x.git/': Could not "
+                          b'resolve host: github.com\n')
+MISSING_ERROR = git_error(b'ERROR: Repository not found.\n'
+                          b'fatal: Could not read from remote repository.\n')
+
+
+class TestFailures:
+    def test_classify(self):
+        assert classify_failure(NETWORK_ERROR) == TRANSIENT
+        assert classify_failure(MISSING_ERROR) == PERMANENT
+        assert classify_failure(git_error(
+            b'fatal: Authentication failed for x\n'
+            b'fatal: the remote end hung up unexpectedly\n')) == PERMANENT
+        assert classify_failure(
+            subprocess.TimeoutExpired(['git', 'fetch'], 10)) == TIMEOUT
+        assert classify_failure(git_error(None)) == UNKNOWN
+        assert classify_failure(
+            GitStalled(['git', 'fetch'], 600)) == TRANSIENT
+
+    def test_retries_transient_failures_with_backoff(self):
+        sleeps = []
+        errors = [NETWORK_ERROR, NETWORK_ERROR]
+
+        def _operation():
+            if errors:
+                raise errors.pop()
+            return 'done'
+
+        policy = RetryPolicy(max_retries=2, backoff=1.0, sleep=sleeps.append)
+        assert policy.call(_operation, 'x.git') == 'done'
+        assert sleeps == [1.0, 2.0]
+
+    def test_gives_up_after_max_retries(self):
+        sleeps = []
+
+        def _operation():
+            raise NETWORK_ERROR
+
+        policy = RetryPolicy(max_retries=1, backoff=1.0, sleep=sleeps.append)
+        with pytest.raises(subprocess.CalledProcessError):
+            policy.call(_operation, 'x.git')
+        assert sleeps == [1.0]
+
+    def test_does_not_retry_permanent_failures(self):
+        calls = []
+
+        def _operation():
+            calls.append(1)
+            raise MISSING_ERROR
+
+        policy = RetryPolicy(sleep=lambda seconds: None)
+        with pytest.raises(subprocess.CalledProcessError):
+            policy.call(_operation, 'x.git')
+        assert len(calls) == 1
+
+    def test_summarise_failures(self):
+        repository = Repository(name='x', description='x', url='x')
+        metrics = RepositoryMetrics('x')
+        metrics.attempts = 3
+        results = [BackupResult(repository, 'x.git', NETWORK_ERROR,
+                                metrics=metrics),
+                   BackupResult(repository, 'y.git')]
+
+        assert summarise_failures(results) == [
+            "x.git: transient failure after 3 attempts: fatal: unable to "
+            "access 'https://github.com/kb-dk/x.git/': Could not resolve "
+            "host: github.com"]
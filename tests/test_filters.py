@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_filters
+----------------------------------
+
+Tests for `filters` module.
+"""
+import json
+import os
+import tempfile
+
+import pytest
+
+from benchmarks.fakegithub import FakeGithub
+from benchmarks.remotes import create_remotes
+from statsbiblioteket.github_cloner import RepoType, Repository, UserType
+from statsbiblioteket.github_cloner.filters import RepositoryFilter
+from statsbiblioteket.github_cloner.github_cloner import backup_accounts, \
+    parse_github_repositories
+from statsbiblioteket.github_cloner.metrics import RunMetrics
+
+# 2020-01-11T00:00:00Z
+NOW = 1578700800.0
+
+
+def repository(name: str = 'repo', **metadata) -> Repository:
+    return Repository(name=name, description=name, url='file:///' + name,
+                      **metadata)
+
+
+class TestRepositoryFilter:
+    def test_names(self):
+        repository_filter = RepositoryFilter(include=['kb-*', 'other/*'],
+                                             exclude=['*-old'])
+
+        assert repository_filter.reason(repository('kb-tools')) is None
+        assert repository_filter.reason(repository('tools')) == 'name'
+        assert repository_filter.reason(repository('tools'), 'other') is None
+        assert repository_filter.reason(repository('kb-old')) == 'name'
+
+    def test_forks_and_archived(self):
+        repository_filter = RepositoryFilter(forks='modified',
+                                             archived='exclude')
+        untouched = repository('untouched', fork=True,
+                               created_at='2020-01-02T00:00:00Z',
+                               pushed_at='2020-01-01T00:00:00Z')
+        modified = repository('modified', fork=True,
+                              created_at='2020-01-02T00:00:00Z',
+                              pushed_at='2020-01-03T00:00:00Z')
+
+        assert repository_filter.reason(untouched) == 'fork'
+        assert repository_filter.reason(modified) is None
+        assert repository_filter.reason(repository(archived=True)) == \
+            'archived'
+        assert RepositoryFilter(forks='only').reason(
+            repository(fork=False)) == 'fork'
+
+    def test_size_age_and_visibility(self):
+        repository_filter = RepositoryFilter(min_size=10, max_size=100,
+                                             max_pushed_age=7,
+                                             visibility=['public'],
+                                             clock=lambda: NOW)
+
+        assert repository_filter.reason(repository(size=5)) == 'size'
+        assert repository_filter.reason(repository(size=500)) == 'size'
+        assert repository_filter.reason(
+            repository(pushed_at='2020-01-01T00:00:00Z')) == 'pushed'
+        assert repository_filter.reason(
+            repository(pushed_at='2020-01-10T00:00:00Z')) is None
+        assert repository_filter.reason(
+            repository(visibility='private')) == 'visibility'
+        # Metadata github did not report does not skip a repository
+        assert repository_filter.reason(repository()) is None
+
+    def test_filter_counts_skipped(self):
+        repository_filter = RepositoryFilter(exclude=['b*'],
+                                             archived='exclude')
+        repositories = [repository('a'), repository('b'),
+                        repository('c', archived=True)]
+
+        kept = list(repository_filter.filter(repositories, 'org'))
+
+        assert [kept_repository.name for kept_repository in kept] == ['a']
+        assert repository_filter.take_skipped() == {'name': 1,
+                                                    'archived': 1}
+        assert repository_filter.take_skipped() == {}
+
+    def test_settings_override_config(self):
+        config = os.path.join(tempfile.mkdtemp(), 'filters.json')
+        with open(config, 'w') as config_file:
+            json.dump({'exclude': ['*-old'], 'forks': 'exclude'},
+                      config_file)
+
+        repository_filter = RepositoryFilter.from_settings(
+            config, forks='include', max_size=None)
+
+        assert repository_filter.exclude == ['*-old']
+        assert repository_filter.forks == 'include'
+        assert RepositoryFilter.from_settings().is_empty
+        with open(config, 'w') as config_file:
+            json.dump({'forkz': 'exclude'}, config_file)
+        with pytest.raises(ValueError):
+            RepositoryFilter.from_settings(config)
+
+    def test_parses_visibility(self):
+        parsed = parse_github_repositories(
+            [{'name': 'a', 'description': None, 'ssh_url': 'a',
+              'private': True},
+             {'name': 'b', 'description': None, 'ssh_url': 'b',
+              'visibility': 'internal', 'private': True}], RepoType.REPO)
+
+        assert [repository.visibility for repository in parsed] == \
+            ['private', 'internal']
+
+
+def test_backup_accounts_skips_before_cloning():
+    tempdir = tempfile.mkdtemp()
+    entries = create_remotes(os.path.join(tempdir, 'remotes'), 3, commits=1)
+    entries[1]['archived'] = True
+    entries[2]['url'] = entries[2]['ssh_url'] = 'file:///does/not/exist'
+    entries[2]['size'] = 10 ** 7
+    run_metrics = RunMetrics()
+    os.chdir(tempdir)
+    with FakeGithub({'/orgs/org/repos': entries}) as fake:
+        results, failed_listings = backup_accounts(
+            [('org', UserType.ORG)], repo_types=[RepoType.REPO],
+            api_url=fake.url, run_metrics=run_metrics,
+            repository_filter=RepositoryFilter(archived='exclude',
+                                               max_size=1024))
+
+    assert [result.repository.name for result in results] == \
+        [entries[0]['name']]
+    assert all(result.ok for result in results)
+    assert not os.path.exists(entries[1]['name'] + '.git')
+    assert run_metrics.summary()['filtered'] == {'archived': 1, 'size': 1}
@@ -8,18 +8,60 @@ test_github_cloner
 Tests for `github_cloner` module.
 """
 import json
+import subprocess
 
 import os
 import pytest
+import requests
 import shutil
 
+from statsbiblioteket.github_cloner import github_cloner
 from statsbiblioteket.github_cloner.github_cloner import \
-    parse_github_repositories, fetch_or_clone
-from statsbiblioteket.github_cloner import RepoType
+    parse_github_repositories, fetch_or_clone, github_backup, \
+    get_github_repositories, iter_github_repositories, remove_partial_clones
+from statsbiblioteket.github_cloner import RepoType, Repository, UserType
+from statsbiblioteket.github_cloner.manifest import Manifest
 
 curdir = os.path.dirname(os.path.realpath(__file__))
 
 
+def make_response(body, link: str = None, status_code: int = 200,
+                  headers: dict = None) -> requests.Response:
+    """Build a requests Response as github would have sent it"""
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = json.dumps(body).encode('utf-8')
+    response.headers.update(headers or {})
+    if link:
+        response.headers['Link'] = link
+    return response
+
+
+def paginated_get(repositories: list, batch_size: int,
+                  with_last: bool = True):
+    """
+    A stand-in for requests.get serving repositories in pages, with Link
+    headers like github's
+    """
+    pages = [repositories[i:i + batch_size]
+             for i in range(0, len(repositories), batch_size)]
+    requested = []
+
+    def _get(url, params=None, **kwargs):
+        page = int((params or {}).get('page', 1))
+        requested.append(page)
+        links = []
+        if page < len(pages):
+            links.append('<{0}?page={1}>; rel="next"'.format(url, page + 1))
+            if with_last:
+                links.append('<{0}?page={1}>; rel="last"'.format(
+                    url, len(pages)))
+        return make_response(pages[page - 1], ', '.join(links))
+
+    _get.requested = requested
+    return _get
+
+
 class TestGithubCloner:
     @pytest.fixture()
     def repositories(self):
@@ -36,6 +78,24 @@ class TestGithubCloner:
         import tempfile
         return tempfile.mkdtemp()
 
+    @pytest.fixture()
+    def local_repositories(self, tempdir):
+        """Some small local git repositories to clone from"""
+        repositories = []
+        for i in range(4):
+            name = 'local{0}'.format(i)
+            path = os.path.join(tempdir, 'remotes', name)
+            os.makedirs(path)
+            subprocess.check_call(['git', 'init', '-q', path])
+            subprocess.check_call(
+                ['git', '-C', path, '-c', 'user.name=test',
+                 '-c', 'user.email=test@example.com',
+                 'commit', '-q', '--allow-empty', '-m', name])
+            repositories.append(Repository(name=name,
+                                           description=name,
+                                           url='file://' + path))
+        return repositories
+
     def test_parse_repositories(self, repositories):
         repositories_parsed = parse_github_repositories(
             repositories,
@@ -51,6 +111,9 @@ class TestGithubCloner:
         assert repo3.name == 'cloudera-vmware-setup'
         assert repo3.url == 'git@github.com:blekinge/cloudera-vmware-setup' \
                             '.git'
+        assert repo1.size == 128
+        assert repo1.fork is False
+        assert repo1.pushed_at == repositories[0]['pushed_at']
 
     def test_parse_repositories_gists(self, gists):
         repositories = parse_github_repositories(gists,
@@ -75,3 +138,175 @@ class TestGithubCloner:
                     'packed-refs', 'description', 'info', 'refs']
         assert sorted(contents) == sorted(expected)
         shutil.rmtree(path)
+
+    def test_github_backup_concurrently(self, tempdir, local_repositories,
+                                        monkeypatch):
+        monkeypatch.setattr(github_cloner, 'iter_github_repositories',
+                            lambda *args, **kwargs: local_repositories)
+        os.chdir(tempdir)
+        results = github_backup('local', max_workers=3)
+
+        assert len(results) == len(local_repositories)
+        assert all(result.ok for result in results)
+        for repository in local_repositories:
+            assert os.path.isfile(os.path.join(repository.name + '.git',
+                                               'HEAD'))
+
+    def test_github_backup_isolates_failure(self, tempdir,
+                                            local_repositories, monkeypatch):
+        broken = Repository(name='broken', description='broken',
+                            url='file://' + tempdir + '/does-not-exist')
+        monkeypatch.setattr(github_cloner, 'iter_github_repositories',
+                            lambda *args, **kwargs:
+                            [broken] + local_repositories)
+        os.chdir(tempdir)
+        results = github_backup('local', max_workers=2)
+
+        failed = [result for result in results if not result.ok]
+        assert len(results) == len(local_repositories) + 1
+        assert [result.repository for result in failed] == [broken]
+        assert isinstance(failed[0].error, subprocess.CalledProcessError)
+        assert failed[0].metrics.failure == 'permanent'
+
+    def test_github_backup_isolates_other_errors(self, tempdir,
+                                                 local_repositories,
+                                                 monkeypatch):
+        def _fetch_or_clone(git_url, repository_path, **kwargs):
+            if repository_path == local_repositories[1].name + '.git':
+                raise PermissionError('Permission denied')
+            fetch_or_clone(git_url, repository_path, **kwargs)
+
+        monkeypatch.setattr(github_cloner, 'iter_github_repositories',
+                            lambda *args, **kwargs: local_repositories)
+        monkeypatch.setattr(github_cloner, 'fetch_or_clone', _fetch_or_clone)
+        os.chdir(tempdir)
+        manifest = Manifest(os.path.join(tempdir, 'manifest.json'))
+        results = github_backup('local', manifest=manifest)
+
+        failed = [result for result in results if not result.ok]
+        assert len(results) == len(local_repositories)
+        assert [result.repository for result in failed] == \
+            [local_repositories[1]]
+        assert isinstance(failed[0].error, PermissionError)
+        assert os.path.exists(os.path.join(tempdir, 'manifest.json'))
+
+    def test_maintenance_failure_keeps_the_backup(self, tempdir,
+                                                  local_repositories,
+                                                  monkeypatch):
+        class BrokenMaintenance(object):
+            def maintain(self, repository_path, changed=True):
+                raise subprocess.CalledProcessError(128, ['git', 'gc'],
+                                                    b'fatal: out of memory')
+
+        monkeypatch.setattr(github_cloner, 'iter_github_repositories',
+                            lambda *args, **kwargs: local_repositories)
+        os.chdir(tempdir)
+        manifest = Manifest(os.path.join(tempdir, 'manifest.json'))
+        results = github_backup('local', manifest=manifest,
+                                maintenance=BrokenMaintenance())
+
+        assert all(result.ok for result in results)
+        assert all(manifest.duration(repository) is not None
+                   for repository in local_repositories)
+
+    def test_owning_account_by_clone_url(self):
+        names = ['acme', 'Bob']
+
+        for url in ('git@github.com:bob/tool.git',
+                    'https://github.com/bob/tool.git',
+                    'ssh://git@github.com/bob/tool.git'):
+            repository = Repository('tool', 'tool', url)
+            assert github_cloner._owning_account(repository, 'acme',
+                                                 names) == 'Bob'
+        for url in ('file:///remotes/tool.git',
+                    'git@github.com:carol/tool.git'):
+            repository = Repository('tool', 'tool', url)
+            assert github_cloner._owning_account(repository, 'acme',
+                                                 names) == 'acme'
+
+    def test_get_repositories_pages_concurrently(self, repositories,
+                                                 monkeypatch):
+        many = [dict(repositories[0], name='repo{0}'.format(i))
+                for i in range(10)]
+        fake_get = paginated_get(many, batch_size=3)
+        monkeypatch.setattr(requests, 'get', fake_get)
+
+        result = get_github_repositories('blekinge', UserType.USER,
+                                         RepoType.REPO, batch_size=3)
+
+        assert [repo.name for repo in result] == \
+            ['repo{0}'.format(i) for i in range(10)]
+        assert sorted(fake_get.requested) == [1, 2, 3, 4]
+
+    def test_get_repositories_without_last_link(self, repositories,
+                                                monkeypatch):
+        many = [dict(repositories[0], name='repo{0}'.format(i))
+                for i in range(5)]
+        monkeypatch.setattr(requests, 'get',
+                            paginated_get(many, batch_size=2,
+                                          with_last=False))
+
+        result = get_github_repositories('blekinge', UserType.USER,
+                                         RepoType.REPO, batch_size=2)
+
+        assert len(result) == 5
+
+    def test_get_repositories_single_page(self, repositories, monkeypatch):
+        monkeypatch.setattr(requests, 'get',
+                            lambda url, params=None, **kwargs:
+                            make_response(repositories))
+
+        result = get_github_repositories('blekinge', UserType.USER,
+                                         RepoType.REPO)
+
+        assert len(result) == 3
+
+    def test_iter_repositories_streams_pages(self, repositories,
+                                             monkeypatch):
+        many = [dict(repositories[0], name='repo{0}'.format(i))
+                for i in range(10)]
+        fake_get = paginated_get(many, batch_size=3)
+        monkeypatch.setattr(requests, 'get', fake_get)
+
+        iterator = iter_github_repositories('blekinge', UserType.USER,
+                                            RepoType.REPO, batch_size=3,
+                                            max_workers=2)
+        first = next(iterator)
+
+        assert first.name == 'repo0'
+        assert fake_get.requested == [1]
+        assert len(list(iterator)) == 9
+
+    def test_failed_clone_leaves_nothing_behind(self, tempdir):
+        os.chdir(tempdir)
+        with pytest.raises(subprocess.CalledProcessError):
+            fetch_or_clone(git_url='file://' + tempdir + '/does-not-exist',
+                           repository_path='broken.git')
+
+        assert os.listdir(tempdir) == []
+
+    def test_clone_times_out(self, tempdir, local_repositories):
+        os.chdir(tempdir)
+        with pytest.raises(subprocess.TimeoutExpired):
+            fetch_or_clone(git_url=local_repositories[0].url,
+                           repository_path='slow.git', timeout=1e-6)
+
+        assert os.listdir(tempdir) == ['remotes']
+
+    def test_incomplete_mirror_is_cloned_again(self, tempdir,
+                                               local_repositories):
+        os.chdir(tempdir)
+        os.makedirs(os.path.join('local0.git', 'objects'))
+
+        fetch_or_clone(git_url=local_repositories[0].url,
+                       repository_path='local0.git')
+
+        assert os.path.isfile(os.path.join('local0.git', 'HEAD'))
+
+    def test_remove_partial_clones(self, tempdir):
+        os.makedirs(os.path.join(tempdir, '.repo.git.abc123.tmp', 'objects'))
+        os.makedirs(os.path.join(tempdir, 'repo2.git'))
+
+        remove_partial_clones(tempdir)
+
+        assert os.listdir(tempdir) == ['repo2.git']
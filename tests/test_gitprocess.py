@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_gitprocess
+----------------------------------
+
+Tests for `gitprocess` module.
+"""
+import os
+import subprocess
+import tempfile
+import time
+
+import pytest
+
+from benchmarks.remotes import create_remote
+from statsbiblioteket.github_cloner.gitprocess import GitProgress, \
+    GitStalled, run_git
+
+
+class TestGitProgress:
+    def test_parses_receiving_objects(self):
+        progress = GitProgress()
+        assert not progress.update('Cloning into bare repository ...')
+        assert progress.update('remote: Counting objects:  50% (5/10)')
+        assert progress.phase == 'Counting objects'
+        assert progress.update('Receiving objects:  45% (450/1000), '
+                               '1.50 MiB | 512.00 KiB/s')
+
+        assert progress.percent == 45
+        assert progress.received_objects == 450
+        assert progress.received_bytes == int(1.5 * 1024 ** 2)
+        assert progress.rate == 512 * 1024
+
+
+class TestRunGit:
+    def test_streams_progress_of_a_clone(self):
+        tempdir = tempfile.mkdtemp()
+        url = create_remote(os.path.join(tempdir, 'remote.git'), commits=5)
+        progress = GitProgress()
+
+        run_git(['git', 'clone', '--mirror', '--progress', url,
+                 os.path.join(tempdir, 'mirror.git')], progress=progress)
+
+        assert progress.received_objects > 0
+
+    def test_keeps_the_tail_of_the_output(self):
+        with pytest.raises(subprocess.CalledProcessError) as error:
+            run_git(['sh', '-c', 'for i in $(seq 500); do echo line $i; '
+                                 'printf "progress $i\\r"; done; exit 3'],
+                    max_lines=10)
+
+        lines = error.value.output.decode('utf-8').splitlines()
+        assert len(lines) == 10
+        assert lines[-2:] == ['line 500', 'progress 500']
+        assert error.value.returncode == 3
+
+    def test_kills_stalled_process(self):
+        started = time.monotonic()
+        with pytest.raises(GitStalled) as error:
+            run_git(['sh', '-c', 'echo start; sleep 30'], stall_timeout=0.5)
+
+        assert time.monotonic() - started < 10
+        assert error.value.output == b'start'
+
+    def test_kills_process_on_timeout(self):
+        started = time.monotonic()
+        with pytest.raises(subprocess.TimeoutExpired) as error:
+            run_git(['sh', '-c', 'while true; do echo busy; sleep 0.1; done'],
+                    timeout=0.5, stall_timeout=5)
+
+        assert not isinstance(error.value, GitStalled)
+        assert time.monotonic() - started < 10
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_graphql
+----------------------------------
+
+Tests for `graphql` module.
+"""
+import os
+import tempfile
+
+import pytest
+
+from benchmarks.fakegithub import FakeGithub
+from benchmarks.remotes import create_remotes, gist_entry
+from statsbiblioteket.github_cloner import RepoType, UserType
+from statsbiblioteket.github_cloner.github_cloner import github_backup
+from statsbiblioteket.github_cloner.graphql import GraphQLError, \
+    iter_graphql_repositories
+
+
+class TestGraphQL:
+    @pytest.fixture()
+    def entries(self):
+        return create_remotes(tempfile.mkdtemp(), 5, commits=1)
+
+    def test_lists_repositories_with_cursors(self, entries):
+        entries[1]['parent'] = {'full_name': 'upstream/repo00001'}
+        with FakeGithub({'/orgs/bench/repos': entries}) as fake:
+            repositories = list(iter_graphql_repositories(
+                'bench', fake.url, batch_size=2))
+            requests_made = len(fake.requests)
+
+        assert [repository.name for repository in repositories] == \
+            [entry['name'] for entry in entries]
+        assert requests_made == 3
+        assert repositories[0].url == entries[0]['ssh_url']
+        assert repositories[0].size == entries[0]['size']
+        assert repositories[0].id == entries[0]['id']
+        assert repositories[1].source == 'upstream/repo00001'
+
+    def test_unknown_owner(self):
+        with FakeGithub() as fake:
+            with pytest.raises(GraphQLError):
+                list(iter_graphql_repositories('nobody', fake.url))
+
+    def test_backup_falls_back_to_rest_for_gists(self, entries):
+        listings = {'/users/bench/repos': entries,
+                    '/users/bench/gists': [gist_entry('abc',
+                                                      entries[0]['ssh_url'])]}
+        backup = tempfile.mkdtemp()
+        os.chdir(backup)
+        with FakeGithub(listings) as fake:
+            repos = github_backup('bench', UserType.USER, RepoType.REPO,
+                                  api_url=fake.url, listing='graphql')
+            gists = github_backup('bench', UserType.USER, RepoType.GIST,
+                                  api_url=fake.url, listing='graphql')
+            paths = [path.split('?')[0] for path in fake.requests]
+
+        assert len(repos) == 5 and len(gists) == 1
+        assert paths == ['/graphql', '/users/bench/gists']
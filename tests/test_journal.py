@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_journal
+----------------------------------
+
+Tests for `journal` module.
+"""
+import os
+import tempfile
+
+import pytest
+
+from statsbiblioteket.github_cloner.journal import RunJournal
+
+
+class TestRunJournal:
+    @pytest.fixture()
+    def path(self):
+        return os.path.join(tempfile.mkdtemp(), 'journal.jsonl')
+
+    def test_resumes_interrupted_run(self, path):
+        journal = RunJournal(path)
+        journal.started('url1')
+        journal.finished('url1')
+        journal.started('url2')
+        journal.close()
+        with open(path, 'a') as journal_file:
+            journal_file.write('{"event": "do')
+
+        resumed = RunJournal(path)
+
+        assert resumed.is_done('url1')
+        assert not resumed.is_done('url2')
+        resumed.close()
+
+    def test_complete_run_is_not_resumed(self, path):
+        journal = RunJournal(path)
+        journal.finished('url1')
+        journal.complete()
+
+        assert not os.path.exists(path)
+        assert not RunJournal(path).is_done('url1')
+
+    def test_no_resume_starts_over(self, path):
+        journal = RunJournal(path)
+        journal.finished('url1')
+        journal.close()
+
+        assert not RunJournal(path, resume=False).is_done('url1')
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_layout
+----------------------------------
+
+Tests for `layout` module.
+"""
+import os
+import tempfile
+
+import pytest
+
+from benchmarks.fakegithub import FakeGithub
+from benchmarks.remotes import create_remote, create_remotes
+from statsbiblioteket.github_cloner import RepoType, Repository, UserType
+from statsbiblioteket.github_cloner.github_cloner import backup_accounts, \
+    fetch_or_clone, remove_partial_clones
+from statsbiblioteket.github_cloner.layout import Layout
+
+
+class TestLayout:
+    @pytest.fixture()
+    def tempdir(self):
+        return tempfile.mkdtemp()
+
+    def test_paths(self, tempdir):
+        repository = Repository('tool', 'tool', 'file:///tool')
+
+        assert Layout(tempdir).path(repository, 'kb-dk', RepoType.REPO) == \
+            os.path.join(tempdir, 'kb-dk', 'repos', 'tool.git')
+        fanned_out = Layout(tempdir, fanout=2).path(repository, 'kb-dk',
+                                                    RepoType.GIST)
+        levels = os.path.relpath(fanned_out, tempdir).split(os.sep)
+        assert levels[:2] == ['kb-dk', 'gists']
+        assert [len(level) for level in levels[2:4]] == [2, 2]
+        assert levels[4] == 'tool.git'
+        with pytest.raises(ValueError):
+            Layout(tempdir, fanout=4)
+
+    def test_migrates_by_renaming(self, tempdir):
+        url = create_remote(os.path.join(tempdir, 'remote.git'), commits=1)
+        output = os.path.join(tempdir, 'output')
+        flat = os.path.join(output, 'tool.git')
+        fetch_or_clone(url, flat)
+        inode = os.stat(flat).st_ino
+        repository = Repository('tool', 'tool', url)
+
+        path = Layout(output).migrate(repository, 'kb-dk', RepoType.REPO)
+
+        assert not os.path.exists(flat)
+        assert os.stat(path).st_ino == inode
+        # Changing the fan-out moves the mirror again
+        fanned_out = Layout(output, fanout=1).migrate(repository, 'kb-dk',
+                                                      RepoType.REPO)
+        assert not os.path.exists(path)
+        assert os.stat(fanned_out).st_ino == inode
+
+    def test_migrates_from_another_account(self, tempdir):
+        url = create_remote(os.path.join(tempdir, 'remote.git'), commits=1)
+        layout = Layout(os.path.join(tempdir, 'output'))
+        repository = Repository('tool', 'tool', url)
+        other = layout.path(repository, 'bob', RepoType.REPO)
+        fetch_or_clone(url, other)
+
+        path = layout.migrate(repository, 'acme', RepoType.REPO)
+
+        assert not os.path.exists(other)
+        assert os.path.isfile(os.path.join(path, 'HEAD'))
+
+    def test_leaves_mirrors_of_other_repositories(self, tempdir):
+        url = create_remote(os.path.join(tempdir, 'remote.git'), commits=1)
+        flat = os.path.join(tempdir, 'tool.git')
+        fetch_or_clone(url, flat)
+        repository = Repository('tool', 'tool', 'file:///other/tool.git')
+
+        path = Layout(tempdir).migrate(repository, 'other', RepoType.REPO)
+
+        assert os.path.isdir(flat)
+        assert not os.path.exists(path)
+
+    def test_removes_only_partial_clones_of_the_layout(self, tempdir):
+        namespace = os.path.join(tempdir, 'kb-dk', 'repos', 'ab')
+        os.makedirs(os.path.join(namespace, '.tool.git.abc_123.tmp'))
+        os.makedirs(os.path.join(namespace, 'tool.git'))
+        os.makedirs(os.path.join(namespace, '.cache.tmp'))
+        project = os.path.join(tempdir, 'project', 'node_modules')
+        os.makedirs(os.path.join(project, '.tool.git.abc_123.tmp'))
+
+        remove_partial_clones(layout=Layout(tempdir, fanout=1))
+
+        assert sorted(os.listdir(namespace)) == ['.cache.tmp', 'tool.git']
+        assert os.listdir(project) == ['.tool.git.abc_123.tmp']
+
+    def test_removes_only_own_partial_clones(self, tempdir, monkeypatch):
+        url = create_remote(os.path.join(tempdir, 'remote.git'), commits=1)
+        output = os.path.join(tempdir, 'output')
+        os.makedirs(output)
+        other = os.path.join(output, '.tool.git.shard-0-of-2.abc_123.tmp')
+        mine = os.path.join(output, '.tool.git.shard-1-of-2.def_456.tmp')
+        os.makedirs(other)
+        os.makedirs(mine)
+
+        remove_partial_clones(layout=Layout(output), owner='shard-1-of-2')
+
+        assert os.path.isdir(other)
+        assert not os.path.exists(mine)
+        # Clones in progress are named after their owner
+        real_mkdtemp = tempfile.mkdtemp
+        prefixes = []
+
+        def _mkdtemp(**kwargs):
+            prefixes.append(kwargs['prefix'])
+            return real_mkdtemp(**kwargs)
+
+        monkeypatch.setattr(tempfile, 'mkdtemp', _mkdtemp)
+        fetch_or_clone(url, os.path.join(output, 'tool.git'),
+                       owner='shard-1-of-2')
+        assert prefixes == ['.tool.git.shard-1-of-2.']
+
+    def test_output_dir_with_spaces(self, tempdir):
+        url = create_remote(os.path.join(tempdir, 'remote.git'), commits=1)
+        layout = Layout(os.path.join(tempdir, 'my backups'))
+        repository = Repository('tool', 'tool', url)
+        path = layout.path(repository, 'kb-dk', RepoType.REPO)
+
+        fetch_or_clone(url, path, reference=os.path.join(tempdir,
+                                                         'remote.git'))
+        fetch_or_clone(url, path)
+
+        assert os.path.isfile(os.path.join(path, 'HEAD'))
+
+
+def test_backup_accounts_namespaces_and_migrates():
+    tempdir = tempfile.mkdtemp()
+    entries = create_remotes(os.path.join(tempdir, 'remotes'), 2, commits=1)
+    os.chdir(tempdir)
+    # A mirror left in the working directory by the flat layout
+    fetch_or_clone(entries[0]['ssh_url'], entries[0]['name'] + '.git')
+    layout = Layout(os.path.join(tempdir, 'output'), fanout=1)
+    with FakeGithub({'/orgs/org/repos': entries}) as fake:
+        results, failed_listings = backup_accounts(
+            [('org', UserType.ORG)], repo_types=[RepoType.REPO],
+            api_url=fake.url, layout=layout)
+
+    operations = {result.repository.name: result.metrics.operation
+                  for result in results}
+    assert operations == {entries[0]['name']: 'fetch',
+                          entries[1]['name']: 'clone'}
+    for result in results:
+        assert result.path == layout.path(result.repository, 'org',
+                                          RepoType.REPO)
+        assert os.path.isfile(os.path.join(result.path, 'HEAD'))
+    assert not os.path.exists(entries[0]['name'] + '.git')
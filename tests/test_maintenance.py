@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_maintenance
+----------------------------------
+
+Tests for `maintenance` module.
+"""
+import os
+import subprocess
+import tempfile
+
+import pytest
+
+from benchmarks.remotes import add_commits, create_remote
+from statsbiblioteket.github_cloner.github_cloner import fetch_or_clone
+from statsbiblioteket.github_cloner.maintenance import Maintenance, \
+    count_objects
+
+
+class TestMaintenance:
+    @pytest.fixture()
+    def mirror(self):
+        """A mirror that has fetched a few times, leaving several packs"""
+        tempdir = tempfile.mkdtemp()
+        remote = os.path.join(tempdir, 'remote.git')
+        url = create_remote(remote, commits=2)
+        mirror = os.path.join(tempdir, 'mirror.git')
+        fetch_or_clone(url, mirror)
+        for _ in range(3):
+            add_commits(remote, commits=20)
+            # Keep fetched packs as packs rather than loose objects
+            subprocess.check_call(['git', '-C', mirror, 'config',
+                                   'fetch.unpackLimit', '1'])
+            fetch_or_clone(url, mirror)
+        return mirror
+
+    def test_repacks_and_writes_commit_graph(self, mirror):
+        assert count_objects(mirror)['packs'] == 4
+        maintenance = Maintenance(max_packs=2)
+
+        tasks = maintenance.maintain(mirror)
+
+        assert tasks == ['repack', 'commit-graph']
+        assert count_objects(mirror)['packs'] < 4
+        assert os.path.exists(os.path.join(mirror, 'objects', 'pack',
+                                           'multi-pack-index'))
+        assert maintenance.used > 0
+        subprocess.check_call(['git', '-C', mirror, 'fsck',
+                               '--no-dangling'])
+
+    def test_unchanged_mirror_with_graph_needs_nothing(self, mirror):
+        maintenance = Maintenance(max_packs=10)
+        maintenance.maintain(mirror)
+
+        assert maintenance.maintain(mirror, changed=False) == []
+
+    def test_respects_budget(self, mirror):
+        maintenance = Maintenance(budget=0)
+
+        assert maintenance.maintain(mirror) == []
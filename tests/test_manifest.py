@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_manifest
+----------------------------------
+
+Tests for `manifest` module.
+"""
+import os
+import subprocess
+import tempfile
+
+import pytest
+
+from statsbiblioteket.github_cloner import Repository
+from statsbiblioteket.github_cloner import github_cloner
+from statsbiblioteket.github_cloner.manifest import Manifest
+
+
+class TestManifest:
+    @pytest.fixture()
+    def tempdir(self):
+        return tempfile.mkdtemp()
+
+    @pytest.fixture()
+    def remote(self, tempdir):
+        path = os.path.join(tempdir, 'remote')
+        subprocess.check_call(['git', 'init', '-q', path])
+        subprocess.check_call(
+            ['git', '-C', path, '-c', 'user.name=test',
+             '-c', 'user.email=test@example.com',
+             'commit', '-q', '--allow-empty', '-m', 'initial'])
+        return path
+
+    def test_skips_unchanged_repositories(self, tempdir, remote,
+                                          monkeypatch):
+        repository = Repository(name='remote', description='remote',
+                                url='file://' + remote,
+                                pushed_at='2016-08-02T10:00:00Z',
+                                updated_at='2016-08-02T10:00:00Z')
+        monkeypatch.setattr(github_cloner, 'iter_github_repositories',
+                            lambda *args, **kwargs: [repository])
+        os.chdir(tempdir)
+        manifest_path = os.path.join(tempdir, 'manifest.json')
+
+        first = github_cloner.github_backup(
+            'local', manifest=Manifest(manifest_path))
+        second = github_cloner.github_backup(
+            'local', manifest=Manifest(manifest_path))
+        forced = github_cloner.github_backup(
+            'local', manifest=Manifest(manifest_path), force=True)
+        repository.pushed_at = '2016-08-03T10:00:00Z'
+        pushed = github_cloner.github_backup(
+            'local', manifest=Manifest(manifest_path))
+
+        assert not first[0].skipped
+        assert second[0].skipped
+        assert not forced[0].skipped
+        assert not pushed[0].skipped
+
+    def test_ls_remote_detects_unchanged_refs(self, tempdir, remote):
+        repository = Repository(name='remote', description='remote',
+                                url='file://' + remote)
+        mirror = os.path.join(tempdir, 'remote.git')
+        os.makedirs(mirror)
+        manifest = Manifest(os.path.join(tempdir, 'manifest.json'),
+                            ls_remote=True)
+
+        manifest.record(repository, {})
+        unchanged, state = manifest.unchanged(repository, mirror)
+        assert not unchanged
+        manifest.record(repository, state)
+
+        unchanged, state = manifest.unchanged(repository, mirror)
+        assert unchanged
+
+        subprocess.check_call(
+            ['git', '-C', remote, '-c', 'user.name=test',
+             '-c', 'user.email=test@example.com',
+             'commit', '-q', '--allow-empty', '-m', 'second'])
+        unchanged, state = manifest.unchanged(repository, mirror)
+        assert not unchanged
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_metrics
+----------------------------------
+
+Tests for `metrics` module.
+"""
+import json
+import os
+import tempfile
+
+import pytest
+
+from benchmarks.remotes import create_remote
+from statsbiblioteket.github_cloner import Repository
+from statsbiblioteket.github_cloner import github_cloner
+from statsbiblioteket.github_cloner.metrics import RunMetrics
+
+
+class TestMetrics:
+    @pytest.fixture()
+    def tempdir(self):
+        return tempfile.mkdtemp()
+
+    @pytest.fixture()
+    def run_metrics(self, tempdir, monkeypatch):
+        url = create_remote(os.path.join(tempdir, 'remotes', 'remote.git'),
+                            commits=3, file_size=4096)
+        repository = Repository(name='remote', description='remote', url=url)
+        monkeypatch.setattr(github_cloner, 'iter_github_repositories',
+                            lambda *args, **kwargs: [repository])
+        os.chdir(tempdir)
+        run_metrics = RunMetrics()
+        github_cloner.github_backup('bench', run_metrics=run_metrics)
+        github_cloner.github_backup('bench', run_metrics=run_metrics)
+        run_metrics.finish()
+        return run_metrics
+
+    def test_records_repository_metrics(self, run_metrics):
+        clone, fetch = run_metrics.repositories
+
+        assert (clone.operation, clone.outcome) == ('clone', 'ok')
+        assert (fetch.operation, fetch.outcome) == ('fetch', 'ok')
+        assert clone.bytes_received > 3 * 4096
+        assert fetch.bytes_received == 0
+        assert 0 < clone.git_time <= clone.wall_time
+        assert len(run_metrics.listings) == 2
+        assert run_metrics.listings[0]['repositories'] == 1
+
+    def test_writes_reports(self, run_metrics, tempdir):
+        report = os.path.join(tempdir, 'report.json')
+        textfile = os.path.join(tempdir, 'github_cloner.prom')
+
+        run_metrics.write_json(report)
+        run_metrics.write_prometheus(textfile)
+
+        with open(report) as report_file:
+            summary = json.load(report_file)['summary']
+        assert summary['operations']['clone']['count'] == 1
+        assert summary['outcomes'] == {'ok': 2}
+        with open(textfile) as prom_file:
+            lines = prom_file.read().splitlines()
+        assert '# TYPE github_cloner_repository_duration_seconds gauge' \
+            in lines
+        assert 'github_cloner_repositories{outcome="ok"} 2.0' in lines
+        assert any(line.startswith(
+            'github_cloner_repository_received_bytes{account="bench",'
+            'operation="clone",outcome="ok",repository="remote",'
+            'type="repos"}') for line in lines)
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_objectpool
+----------------------------------
+
+Tests for `objectpool` module.
+"""
+import functools
+import os
+import subprocess
+import tempfile
+
+import pytest
+
+from benchmarks.fakegithub import FakeGithub
+from benchmarks.remotes import add_commits, create_remote
+from statsbiblioteket.github_cloner import Repository
+from statsbiblioteket.github_cloner import github_cloner
+from statsbiblioteket.github_cloner.metrics import directory_size
+from statsbiblioteket.github_cloner.objectpool import ObjectPool
+from statsbiblioteket.github_cloner.partial import Hydration
+
+
+class TestObjectPool:
+    @pytest.fixture()
+    def tempdir(self):
+        return tempfile.mkdtemp()
+
+    @pytest.fixture()
+    def network(self, tempdir):
+        """An upstream and a fork of it with one more commit"""
+        remotes = os.path.join(tempdir, 'remotes')
+        upstream = create_remote(os.path.join(remotes, 'upstream.git'),
+                                 commits=5, file_size=64 * 1024)
+        fork = os.path.join(remotes, 'fork.git')
+        subprocess.check_call(['git', 'clone', '-q', '--bare', upstream,
+                               fork])
+        add_commits(fork)
+        return [Repository(name='upstream', description='', url=upstream),
+                Repository(name='fork', description='', url='file://' + fork,
+                           fork=True)]
+
+    def test_forks_share_objects(self, tempdir, network, monkeypatch):
+        monkeypatch.setattr(github_cloner, 'iter_github_repositories',
+                            lambda *args, **kwargs: network)
+        backup = os.path.join(tempdir, 'backup')
+        os.makedirs(backup)
+        os.chdir(backup)
+        pool = ObjectPool(os.path.join(tempdir, 'pool'))
+
+        github_cloner.github_backup('bench', object_pool=pool)
+        github_cloner.github_backup('bench', object_pool=pool)
+
+        assert len(set(pool.members.values())) == 1
+        for name in ('upstream.git', 'fork.git'):
+            assert os.path.exists(os.path.join(name, 'objects', 'info',
+                                               'alternates'))
+            assert directory_size(os.path.join(name, 'objects')) < 64 * 1024
+            subprocess.check_call(['git', '-C', name, 'fsck', '--no-dangling'])
+        assert ObjectPool(pool.directory).members == pool.members
+
+    def test_pools_partial_mirrors_once_hydrated(self, tempdir, network,
+                                                 monkeypatch):
+        for repository in network:
+            remote = repository.url.replace('file://', '')
+            for key in ('uploadpack.allowFilter',
+                        'uploadpack.allowAnySHA1InWant'):
+                subprocess.check_call(['git', '-C', remote, 'config', key,
+                                       'true'])
+        monkeypatch.setattr(github_cloner, 'iter_github_repositories',
+                            lambda *args, **kwargs: network)
+        backup = os.path.join(tempdir, 'backup')
+        os.makedirs(backup)
+        os.chdir(backup)
+        pool = ObjectPool(os.path.join(tempdir, 'pool'))
+
+        results = github_cloner.github_backup(
+            'bench', object_pool=pool, partial_filter='blob:none')
+
+        assert all(result.ok for result in results)
+        assert not any(result.metrics.complete for result in results)
+        assert pool.members == {}
+
+        results = github_cloner.github_backup(
+            'bench', object_pool=pool, hydration=Hydration())
+
+        assert all(result.ok for result in results)
+        assert len(pool.members) == 2
+        for name in ('upstream.git', 'fork.git'):
+            subprocess.check_call(['git', '-C', name, 'fsck', '--no-dangling'])
+
+    def test_clones_with_reference_once_known(self, tempdir, network):
+        upstream, fork = network
+        pool = ObjectPool(os.path.join(tempdir, 'pool'))
+        os.chdir(tempdir)
+        github_cloner.fetch_or_clone(upstream.url, 'upstream.git')
+        pool.add(upstream, 'upstream.git')
+        # The full name github reports, of the mirror of file://.../upstream
+        fork.source = 'Remotes/upstream'
+
+        reference = pool.reference_for(fork)
+        github_cloner.fetch_or_clone(fork.url, 'fork.git',
+                                     reference=reference)
+
+        assert reference is not None
+        assert directory_size(os.path.join('fork.git', 'objects')) < \
+            64 * 1024
+
+    def test_looks_up_the_source_of_new_forks(self, tempdir, network):
+        upstream, fork = network
+        source = {'name': 'upstream', 'description': '',
+                  'ssh_url': upstream.url}
+        with FakeGithub({'/repos/bench/fork': {
+                'name': 'fork', 'description': '', 'ssh_url': fork.url,
+                'fork': True, 'source': source}}) as fake:
+            pool = ObjectPool(os.path.join(tempdir, 'pool'),
+                              find_source=functools.partial(
+                                  github_cloner.get_source_url,
+                                  api_url=fake.url))
+            os.chdir(tempdir)
+            github_cloner.fetch_or_clone(upstream.url, 'upstream.git')
+            pool.add(upstream, 'upstream.git')
+
+            assert pool.reference_for(fork) is None
+            assert pool.reference_for(fork, 'other') is None
+            reference = pool.reference_for(fork, 'bench')
+            # A parent that has not been backed up is looked up as well
+            fork.source = 'bench/unknown'
+            assert pool.reference_for(fork, 'bench') == reference
+
+        assert reference == pool.pool_path(pool.members[upstream.url])
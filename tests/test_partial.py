@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_partial
+----------------------------------
+
+Tests for `partial` module.
+"""
+import os
+import subprocess
+import tempfile
+
+import pytest
+
+from benchmarks.remotes import create_remote
+from statsbiblioteket.github_cloner.github_cloner import fetch_or_clone
+from statsbiblioteket.github_cloner import partial
+from statsbiblioteket.github_cloner.partial import Hydration, \
+    missing_objects, partial_filter
+
+
+class TestPartial:
+    @pytest.fixture()
+    def mirror(self):
+        """A blobless mirror of a remote with 10 blobs"""
+        tempdir = tempfile.mkdtemp()
+        remote = os.path.join(tempdir, 'remote.git')
+        url = create_remote(remote, commits=10)
+        for key in ('uploadpack.allowFilter', 'uploadpack.allowAnySHA1InWant'):
+            subprocess.check_call(['git', '-C', remote, 'config', key,
+                                   'true'])
+        mirror = os.path.join(tempdir, 'mirror.git')
+        fetch_or_clone(url, mirror, partial_filter='blob:none')
+        return mirror
+
+    def test_partial_clone_is_missing_blobs(self, mirror):
+        assert partial_filter(mirror) == 'blob:none'
+        assert len(missing_objects(mirror)) == 10
+        assert len(missing_objects(mirror, limit=3)) == 3
+
+    def test_hydrates_in_batches(self, mirror):
+        hydration = Hydration(batch_size=4)
+
+        fetched, complete = hydration.hydrate(mirror)
+
+        assert (fetched, complete) == (10, True)
+        assert partial_filter(mirror) is None
+        subprocess.check_call(['git', '-C', mirror, 'fsck',
+                               '--no-dangling'])
+
+    def test_walks_the_history_once_per_pass(self, mirror, monkeypatch):
+        walks = []
+        iter_missing_objects = partial.iter_missing_objects
+
+        def counting(repository_path):
+            walks.append(repository_path)
+            return iter_missing_objects(repository_path)
+
+        monkeypatch.setattr(partial, 'iter_missing_objects', counting)
+        hydration = Hydration(batch_size=1)
+
+        assert hydration.hydrate(mirror) == (10, True)
+        # One walk fetches all ten blobs, and one finds none missing
+        assert len(walks) == 2
+
+    def test_respects_budget(self, mirror):
+        hydration = Hydration(budget=0)
+
+        assert hydration.hydrate(mirror) == (0, False)
+        assert partial_filter(mirror) == 'blob:none'
+
+    def test_reads_the_filter_of_origin(self, tmpdir):
+        assert partial_filter(str(tmpdir)) is None
+        tmpdir.join('config').write(
+            '[core]\n\tbare = true\n'
+            '[remote "upstream"]\n\tpartialclonefilter = blob:none\n'
+            '[remote "origin"]\n\turl = file:///remote.git\n')
+        assert partial_filter(str(tmpdir)) is None
+        tmpdir.join('config').write(
+            '[Remote "origin"]\n\tpromisor = true\n'
+            '\tpartialCloneFilter = blob:limit=1m\n', mode='a')
+        assert partial_filter(str(tmpdir)) == 'blob:limit=1m'
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_ratelimit
+----------------------------------
+
+Tests for `ratelimit` module.
+"""
+import threading
+
+import pytest
+
+from statsbiblioteket.github_cloner.ratelimit import RateLimiter
+from test_github_cloner import make_response
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class TestRateLimiter:
+    @pytest.fixture()
+    def clock(self):
+        return FakeClock()
+
+    @pytest.fixture()
+    def limiter(self, clock):
+        return RateLimiter(reserve=10, backoff=1.0, clock=clock,
+                           sleep=clock.sleep)
+
+    def test_waits_for_reset_when_exhausted(self, limiter, clock):
+        def _get(url, **kwargs):
+            return make_response([], headers={
+                'X-RateLimit-Limit': '60',
+                'X-RateLimit-Remaining': '0',
+                'X-RateLimit-Reset': str(clock.now + 30)})
+
+        limiter.get('https://api.github.com/users/x/repos', get=_get)
+        limiter.get('https://api.github.com/users/x/repos', get=_get)
+
+        assert clock.sleeps == [31.0]
+        assert limiter.used() == 2
+
+    def test_spreads_requests_below_reserve(self, limiter, clock):
+        def _get(url, **kwargs):
+            return make_response([], headers={
+                'X-RateLimit-Remaining': '5',
+                'X-RateLimit-Reset': str(1000.0 + 50)})
+
+        limiter.get('https://api.github.com/users/x/repos', get=_get)
+        limiter.get('https://api.github.com/users/x/repos', get=_get)
+
+        # 5 requests left, 50s to the reset
+        assert clock.sleeps == [10.0]
+
+    def test_retries_secondary_rate_limit(self, limiter, clock):
+        responses = [make_response({'message': 'You have exceeded a '
+                                               'secondary rate limit'},
+                                   status_code=403,
+                                   headers={'Retry-After': '5'}),
+                     make_response([{'name': 'repo'}])]
+
+        response = limiter.get('https://api.github.com/users/x/repos',
+                               get=lambda url, **kwargs: responses.pop(0))
+
+        assert response.json() == [{'name': 'repo'}]
+        assert limiter.retries == 1
+        assert 5 <= clock.sleeps[0] <= 10
+
+    def test_does_not_retry_forbidden(self, limiter, clock):
+        response = limiter.get(
+            'https://api.github.com/users/x/repos',
+            get=lambda url, **kwargs: make_response(
+                {'message': 'Forbidden'}, status_code=403))
+
+        assert response.status_code == 403
+        assert limiter.retries == 0
+
+    def test_tracks_each_resource(self, limiter, clock):
+        def _post(url, **kwargs):
+            return make_response({}, headers={
+                'X-RateLimit-Resource': 'graphql',
+                'X-RateLimit-Remaining': '0',
+                'X-RateLimit-Reset': str(clock.now + 30)})
+
+        def _get(url, **kwargs):
+            return make_response([], headers={
+                'X-RateLimit-Resource': 'core',
+                'X-RateLimit-Remaining': '4000',
+                'X-RateLimit-Reset': str(clock.now + 3000)})
+
+        limiter.post('https://api.github.com/graphql', post=_post)
+        limiter.get('https://api.github.com/users/x/repos', get=_get)
+        limiter.get('https://api.github.com/users/x/repos', get=_get)
+
+        assert clock.sleeps == []
+        assert limiter.budgets['core'].remaining == 4000
+        limiter.post('https://api.github.com/graphql', post=_post)
+        assert clock.sleeps == [31.0]
+
+    def test_waiting_for_a_reset_does_not_block_other_resources(self, clock):
+        released = threading.Event()
+        sleeping = threading.Event()
+
+        def _sleep(seconds: float):
+            sleeping.set()
+            released.wait(10)
+
+        limiter = RateLimiter(clock=clock, sleep=_sleep)
+
+        def _get(url, **kwargs):
+            return make_response([], headers={
+                'X-RateLimit-Resource': 'core',
+                'X-RateLimit-Remaining': '0',
+                'X-RateLimit-Reset': str(clock.now + 3600)})
+
+        limiter.get('https://api.github.com/users/x/repos', get=_get)
+        waiting = threading.Thread(target=limiter.get, args=(
+            'https://api.github.com/users/x/repos',), kwargs={'get': _get})
+        waiting.start()
+        try:
+            assert sleeping.wait(10)
+            posting = threading.Thread(target=limiter.post, args=(
+                'https://api.github.com/graphql',), kwargs={
+                'post': lambda url, **kwargs: make_response({})})
+            posting.start()
+            posting.join(timeout=5)
+            assert not posting.is_alive()
+        finally:
+            released.set()
+            waiting.join(timeout=10)
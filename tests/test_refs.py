@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_refs
+----------------------------------
+
+Tests for `refs` module.
+"""
+import os
+import subprocess
+import tempfile
+
+import pytest
+
+from benchmarks.remotes import create_remote
+from statsbiblioteket.github_cloner.bundle import list_refs
+from statsbiblioteket.github_cloner.github_cloner import fetch_or_clone
+from statsbiblioteket.github_cloner.refs import MIRROR_REFSPEC, RefFilter, \
+    RefFilters, configured_refspecs
+
+
+class TestRefs:
+    @pytest.fixture()
+    def tempdir(self):
+        return tempfile.mkdtemp()
+
+    @pytest.fixture()
+    def remote(self, tempdir):
+        path = os.path.join(tempdir, 'remote.git')
+        create_remote(path, commits=2)
+        # The ref github publishes for every pull request
+        subprocess.check_output(['git', '-C', path, 'update-ref',
+                                 'refs/pull/1/head', 'refs/heads/master'])
+        return path
+
+    def test_parse_per_account(self):
+        refs = RefFilters.parse(['refs/heads/*', 'kb-dk=refs/tags/*'],
+                                ['refs/pull/*', 'other=refs/heads/wip'])
+
+        assert refs.for_account('anyone').refspecs() == \
+            ['+refs/heads/*:refs/heads/*', '^refs/pull/*']
+        assert refs.for_account('kb-dk').refspecs() == \
+            ['+refs/tags/*:refs/tags/*', '^refs/pull/*']
+        assert refs.for_account('other').refspecs() == \
+            ['+refs/heads/*:refs/heads/*', '^refs/pull/*',
+             '^refs/heads/wip']
+        assert RefFilter().is_mirror
+        with pytest.raises(ValueError):
+            RefFilters.parse(['heads/*'])
+
+    def test_clone_excludes_pull_refs(self, tempdir, remote):
+        mirror = os.path.join(tempdir, 'mirror.git')
+        fetch_or_clone('file://' + remote, mirror,
+                       refspecs=RefFilter(exclude=['refs/pull/*']).refspecs())
+
+        assert sorted(list_refs(mirror)) == ['refs/heads/master']
+        assert configured_refspecs(mirror) == [MIRROR_REFSPEC,
+                                               '^refs/pull/*']
+        head = subprocess.check_output(
+            ['git', '-C', mirror, 'symbolic-ref', 'HEAD'])
+        assert head.strip() == b'refs/heads/master'
+
+    def test_refspecs_change_in_place(self, tempdir, remote):
+        mirror = os.path.join(tempdir, 'mirror.git')
+        fetch_or_clone('file://' + remote, mirror)
+        assert 'refs/pull/1/head' in list_refs(mirror)
+
+        subprocess.check_output(['git', '-C', remote, 'update-ref',
+                                 'refs/pull/2/head', 'refs/heads/master'])
+        fetch_or_clone('file://' + remote, mirror,
+                       refspecs=RefFilter(exclude=['refs/pull/*']).refspecs())
+
+        assert configured_refspecs(mirror) == [MIRROR_REFSPEC,
+                                               '^refs/pull/*']
+        # Refs already fetched are kept, new ones are not fetched
+        assert 'refs/pull/1/head' in list_refs(mirror)
+        assert 'refs/pull/2/head' not in list_refs(mirror)
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_scheduling
+----------------------------------
+
+Tests for `scheduling` module.
+"""
+import os
+import tempfile
+
+from statsbiblioteket.github_cloner import Repository
+from statsbiblioteket.github_cloner.manifest import Manifest
+from statsbiblioteket.github_cloner.scheduling import order_jobs, \
+    select_shard, shard_file, shard_of
+
+
+def _repository(name: str, size: int) -> Repository:
+    return Repository(name=name, description=name,
+                      url='git@github.com:x/{0}.git'.format(name), size=size)
+
+
+class TestScheduling:
+    def test_orders_by_size_without_history(self):
+        repositories = [_repository('small', 10), _repository('huge', 10000),
+                        _repository('unknown', None),
+                        _repository('medium', 500)]
+
+        ordered = order_jobs(repositories)
+
+        assert [repository.name for repository in ordered] == \
+            ['huge', 'medium', 'small', 'unknown']
+
+    def test_recorded_durations_take_precedence(self):
+        small_but_slow = _repository('small_but_slow', None)
+        big = _repository('big', 1000)
+        bigger = _repository('bigger', 2000)
+        manifest = Manifest(os.path.join(tempfile.mkdtemp(), 'manifest.json'))
+        manifest.record(small_but_slow, {'duration': 600.0})
+        manifest.record(big, {'duration': 10.0})
+
+        ordered = order_jobs([big, bigger, small_but_slow], manifest)
+
+        # bigger is estimated at 10s per 1000KB, like big, so 20s
+        assert [repository.name for repository in ordered] == \
+            ['small_but_slow', 'bigger', 'big']
+
+    def test_shards_partition_the_repositories(self):
+        repositories = [_repository('repo{0}'.format(i), 1)
+                        for i in range(200)]
+
+        shards = [list(select_shard(repositories, index, 4))
+                  for index in range(4)]
+
+        assert sorted(repository.name for shard in shards
+                      for repository in shard) == \
+            sorted(repository.name for repository in repositories)
+        assert all(20 < len(shard) < 80 for shard in shards)
+
+    def test_shards_are_stable(self):
+        repositories = [_repository('repo{0}'.format(i), 1)
+                        for i in range(100)]
+        before = {repository.name for repository in
+                  select_shard(repositories, 1, 3)}
+
+        after = {repository.name for repository in
+                 select_shard(repositories[10:] + [_repository('new', 1)],
+                              1, 3)}
+
+        assert after - {'new'} == before - {'repo{0}'.format(i)
+                                            for i in range(10)}
+
+    def test_shard_by_id_survives_rename(self):
+        repository = _repository('old', 1)
+        repository.id = 1234
+        renamed = _repository('new', 1)
+        renamed.id = 1234
+
+        assert shard_of(repository, 5) == shard_of(renamed, 5)
+
+    def test_shard_files(self):
+        assert shard_file('github_cloner_manifest.json', 1, 4) == \
+            'github_cloner_manifest.shard-1-of-4.json'
+        assert shard_file('github_cloner_manifest.json', 0, 1) == \
+            'github_cloner_manifest.json'
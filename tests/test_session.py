@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_session
+----------------------------------
+
+Tests for `session` module.
+"""
+import http.server
+import socketserver
+import threading
+
+import pytest
+
+from statsbiblioteket.github_cloner.session import GithubSession
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        body = self.headers.get('Authorization', '').encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _Server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+
+class TestGithubSession:
+    @pytest.fixture()
+    def server_url(self):
+        server = _Server(('127.0.0.1', 0), _Handler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        yield 'http://127.0.0.1:{0}/'.format(server.server_port)
+        server.shutdown()
+        server.server_close()
+
+    def test_reuses_connections(self, server_url):
+        session = GithubSession(token='secret', pool_size=2)
+
+        responses = [session.get(server_url) for _ in range(5)]
+
+        assert all(response.text == 'token secret'
+                   for response in responses)
+        assert session.connection_stats() == {'127.0.0.1': (1, 5)}
+        session.close()
+
+    def test_default_timeout(self, monkeypatch):
+        session = GithubSession(timeout=1.5)
+        seen = {}
+
+        def _send(request, **kwargs):
+            seen.update(kwargs)
+            raise RuntimeError('stop')
+
+        monkeypatch.setattr(session, 'send', _send)
+        with pytest.raises(RuntimeError):
+            session.get('http://127.0.0.1:1/')
+        assert seen['timeout'] == 1.5
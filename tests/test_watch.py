@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_watch
+----------------------------------
+
+Tests for `watch` module.
+"""
+import hashlib
+import hmac
+import json
+import threading
+import time
+
+import requests
+
+from benchmarks.fakegithub import FakeGithub
+from statsbiblioteket.github_cloner.metrics import RepositoryMetrics
+from statsbiblioteket.github_cloner.myTypes import BackupResult, RepoType, \
+    Repository, UserType
+from statsbiblioteket.github_cloner.watch import Debouncer, EventPoller, \
+    Watcher, WebhookServer
+
+
+def event(event_id: int, repo: str, event_type: str = 'PushEvent') -> dict:
+    return {'id': str(event_id), 'type': event_type, 'repo': {'name': repo}}
+
+
+def wait_for(condition, timeout: float = 10.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.01)
+
+
+class FakePoller(object):
+    github_name = 'org'
+    interval = 0.0
+
+    def __init__(self):
+        self.polls = 0
+
+    def poll(self):
+        self.polls += 1
+        return set(), False
+
+
+class TestEventPoller:
+    def test_reports_new_pushes(self):
+        events = [event(2, 'org/a', 'WatchEvent'), event(1, 'org/b')]
+        with FakeGithub({'/orgs/org/events': events}) as fake:
+            poller = EventPoller('org', UserType.ORG, fake.url)
+            assert poller.poll() == (set(), False)
+            assert poller.interval == 60
+
+            fake.listings['/orgs/org/events'] = \
+                [event(4, 'Org/C'), event(3, 'org/a', 'WatchEvent')] + events
+            assert poller.poll() == ({'org/c'}, False)
+
+            # Unchanged, answered with a 304
+            assert poller.poll() == (set(), False)
+
+            fake.listings['/orgs/org/events'] = [event(6, 'org/d'),
+                                                 event(5, 'org/e')]
+            assert poller.poll() == ({'org/d', 'org/e'}, True)
+
+
+class TestDebouncer:
+    def test_waits_for_quiet(self):
+        now = [0.0]
+        debouncer = Debouncer(10, clock=lambda: now[0])
+        debouncer.touch('org/a')
+        now[0] = 5
+        debouncer.touch('org/a')
+        debouncer.touch('org/b')
+        assert debouncer.next_due() == 15
+
+        now[0] = 14
+        assert debouncer.due() == []
+        now[0] = 15
+        assert debouncer.due() == ['org/a', 'org/b']
+        assert debouncer.next_due() is None
+
+
+class TestWebhookServer:
+    def test_checks_signatures(self):
+        pushed = []
+        webhook = WebhookServer(pushed.append, secret='s3cret').start()
+        url = 'http://127.0.0.1:{0}/'.format(webhook.port)
+        body = json.dumps({'repository': {'full_name': 'Org/A'}}).encode()
+        signature = 'sha256=' + hmac.new(b's3cret', body,
+                                         hashlib.sha256).hexdigest()
+        try:
+            bad = requests.post(url, data=body, headers={
+                'X-GitHub-Event': 'push',
+                'X-Hub-Signature-256': 'sha256=0'})
+            good = requests.post(url, data=body, headers={
+                'X-GitHub-Event': 'push',
+                'X-Hub-Signature-256': signature})
+        finally:
+            webhook.stop()
+
+        assert bad.status_code == 401
+        assert good.status_code == 204
+        assert pushed == ['org/a']
+
+
+class TestWatcher:
+    def test_fetches_changed_and_sweeps_for_unknown(self):
+        repository = Repository(name='a', description='a', url='file:///a')
+        metrics = RepositoryMetrics('a', 'org', RepoType.REPO.value)
+        sweeps = []
+        fetched = []
+
+        def _sweep():
+            sweeps.append(1)
+            return [BackupResult(repository, 'a.git', metrics=metrics)]
+
+        watcher = Watcher(_sweep, fetched.append, [FakePoller()],
+                          min_poll_interval=0.01, debounce=0)
+        thread = threading.Thread(target=watcher.run)
+        thread.start()
+        try:
+            wait_for(lambda: sweeps)
+            watcher.changed('Org/A')
+            wait_for(lambda: fetched)
+            watcher.changed('org/new')
+            wait_for(lambda: len(sweeps) == 2)
+        finally:
+            watcher.stop()
+            thread.join(timeout=10)
+
+        assert [job.repository for job in fetched[0]] == [repository]
+        assert fetched[0][0].repo_type is RepoType.REPO
+        assert not thread.is_alive()
+
+    def test_ignores_pushes_it_does_not_backup(self):
+        listed = [Repository(name=name, description=name,
+                             url='file:///' + name)
+                  for name in ('a', 'other-shard')]
+        metrics = RepositoryMetrics('a', 'org', RepoType.REPO.value)
+        fetched = []
+
+        def _sweep():
+            for repository in listed:
+                watcher.listed('org', repository)
+            return [BackupResult(listed[0], 'a.git', metrics=metrics)]
+
+        watcher = Watcher(_sweep, fetched.append, [FakePoller()],
+                          debounce=0)
+        watcher._sweep()
+        for name in ('elsewhere/a', 'org/other-shard', 'org/a'):
+            watcher.changed(name)
+        watcher._fetch_due()
+
+        assert [job.repository for job in fetched[0]] == [listed[0]]
+        assert not watcher.sweep_requested.is_set()
+        watcher.changed('org/new')
+        watcher._fetch_due()
+        assert watcher.sweep_requested.is_set()
@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_workqueue
+----------------------------------
+
+Tests for `workqueue` module.
+"""
+import os
+import tempfile
+import threading
+import time
+
+from benchmarks.fakegithub import FakeGithub
+from benchmarks.remotes import create_remotes
+from statsbiblioteket.github_cloner import RepoType, Repository, UserType
+from statsbiblioteket.github_cloner import github_cloner
+from statsbiblioteket.github_cloner.github_cloner import backup_accounts
+from statsbiblioteket.github_cloner.workqueue import Job, QueueClosed, \
+    WorkQueue
+
+
+def job(name: str, account: str, priority: int = 0) -> Job:
+    repository = Repository(name=name, description=name,
+                            url='file:///' + name)
+    return Job(repository, account, RepoType.REPO, priority)
+
+
+def names(queue: WorkQueue) -> list:
+    return [queued.repository.name for queued in queue]
+
+
+class TestWorkQueue:
+    def test_interleaves_accounts_by_priority(self):
+        queue = WorkQueue()
+        for name in ('a1', 'a2', 'a3'):
+            queue.put(job(name, 'a'))
+        for name in ('b1', 'b2'):
+            queue.put(job(name, 'b'))
+        queue.put(job('c1', 'c', priority=1))
+
+        assert names(queue) == ['c1', 'a1', 'b1', 'a2', 'b2', 'a3']
+
+    def test_drops_duplicates(self):
+        queue = WorkQueue()
+        assert queue.put(job('shared', 'a'))
+        assert not queue.put(job('shared', 'b'))
+
+        assert [queued.account for queued in queue] == ['a']
+        assert queue.duplicates == 1
+
+    def test_prefers_accounts_in_order(self):
+        queue = WorkQueue(accounts=['a', 'b'])
+        assert queue.put(job('shared', 'b'))
+        assert not queue.put(job('shared', 'a'))
+        assert not queue.put(job('shared', 'c'))
+
+        assert [queued.account for queued in queue] == ['a']
+        assert queue.duplicates == 2
+
+    def test_waits_for_producers(self):
+        queue = WorkQueue()
+        queue.add_producer()
+        taken = []
+        consumer = threading.Thread(target=lambda: taken.extend(queue))
+        consumer.start()
+        queue.put(job('late', 'a'))
+        queue.producer_done()
+        consumer.join(timeout=10)
+
+        assert not consumer.is_alive()
+        assert [queued.repository.name for queued in taken] == ['late']
+
+    def test_hold_orders_everything_by_key(self):
+        queue = WorkQueue(key=lambda queued: -len(queued.repository.name),
+                          hold=True)
+        queue.add_producer()
+        taken = []
+        consumer = threading.Thread(target=lambda: taken.extend(queue))
+        consumer.start()
+        for name in ('s', 'mmm', 'll'):
+            queue.put(job(name, 'a'))
+        queue.producer_done()
+        consumer.join(timeout=10)
+
+        assert [queued.repository.name for queued in taken] == \
+            ['mmm', 'll', 's']
+
+    def test_hold_orders_only_when_listings_are_done(self):
+        keyed = []
+
+        def _key(queued: Job) -> int:
+            keyed.append(queued.repository.name)
+            return 0
+
+        queue = WorkQueue(key=_key, hold=True)
+        queue.add_producer()
+        for name in ('a', 'b'):
+            queue.put(job(name, 'a'))
+
+        assert keyed == []
+        queue.producer_done()
+        assert names(queue) == ['a', 'b']
+        assert keyed == ['a', 'b']
+
+    def test_bounded_put_waits_for_get(self):
+        queue = WorkQueue(max_size=2)
+        queue.add_producer()
+
+        def _produce():
+            for name in ('a', 'b', 'c', 'd'):
+                queue.put(job(name, 'a'))
+            queue.producer_done()
+
+        producer = threading.Thread(target=_produce)
+        producer.start()
+        wait = time.monotonic() + 10
+        while len(queue._heap) < 2 and time.monotonic() < wait:
+            time.sleep(0.01)
+        time.sleep(0.05)
+
+        assert len(queue._heap) == 2
+        assert names(queue) == ['a', 'b', 'c', 'd']
+        producer.join(timeout=10)
+        assert not producer.is_alive()
+
+    def test_close_wakes_waiting_producers(self):
+        queue = WorkQueue(max_size=1)
+        queue.put(job('a', 'a'))
+        raised = []
+
+        def _produce():
+            try:
+                queue.put(job('b', 'a'))
+            except QueueClosed as error:
+                raised.append(error)
+
+        producer = threading.Thread(target=_produce)
+        producer.start()
+        queue.close()
+        producer.join(timeout=10)
+
+        assert not producer.is_alive()
+        assert len(raised) == 1
+
+
+def test_backup_accounts_stops_listings_when_the_backup_fails(monkeypatch):
+    tempdir = tempfile.mkdtemp()
+    entries = create_remotes(os.path.join(tempdir, 'remotes'), 4, commits=1)
+
+    def _backup_jobs(queue, **kwargs):
+        queue.get()
+        raise RuntimeError('the backup failed')
+
+    monkeypatch.setattr(github_cloner, 'MAX_QUEUED_JOBS', 1)
+    monkeypatch.setattr(github_cloner, 'backup_jobs', _backup_jobs)
+    raised = []
+
+    def _backup():
+        try:
+            backup_accounts([('org', UserType.ORG)],
+                            repo_types=[RepoType.REPO], api_url=fake.url)
+        except RuntimeError as error:
+            raised.append(error)
+
+    with FakeGithub({'/orgs/org/repos': entries}) as fake:
+        backup = threading.Thread(target=_backup, daemon=True)
+        backup.start()
+        backup.join(timeout=10)
+
+    assert not backup.is_alive()
+    assert len(raised) == 1
+
+
+def test_backup_accounts_deduplicates_and_isolates_listings():
+    tempdir = tempfile.mkdtemp()
+    entries = create_remotes(os.path.join(tempdir, 'remotes'), 4, commits=1)
+    listings = {'/orgs/org/repos': entries[:3],
+                '/users/user/repos': entries[1:],
+                '/users/user/gists': []}
+    os.chdir(tempdir)
+    with FakeGithub(listings) as fake:
+        results, failed_listings = backup_accounts(
+            [('org', UserType.ORG), ('user', UserType.USER),
+             ('nobody', UserType.USER)],
+            repo_types=[RepoType.REPO], priorities={'user': 1},
+            max_workers=2, api_url=fake.url)
+
+    assert sorted(result.repository.name for result in results) == \
+        sorted(entry['name'] for entry in entries)
+    assert all(result.ok for result in results)
+    assert len(failed_listings) == 1
+    assert failed_listings[0].startswith('repos of nobody')